@@ -0,0 +1,32 @@
+"""add storevisits.version
+
+Revision ID: 75a9aa37d5bb
+Revises: fbfd18639608
+Create Date: 2026-10-17 14:48:49.159484
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "75a9aa37d5bb"
+down_revision = "fbfd18639608"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "storevisits",
+        sa.Column(
+            "version",
+            sa.Integer(),
+            nullable=False,
+            server_default=sa.text("0"),
+        ),
+    )
+
+
+def downgrade():
+    op.drop_column("storevisits", "version")
@@ -0,0 +1,29 @@
+"""add products name search index
+
+Revision ID: 913aaf340f89
+Revises: 75a9aa37d5bb
+Create Date: 2026-10-17 14:52:10.814420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "913aaf340f89"
+down_revision = "75a9aa37d5bb"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_products_name_tsvector",
+        "products",
+        [sa.text("to_tsvector('simple'::regconfig, name)")],
+        postgresql_using="gin",
+    )
+
+
+def downgrade():
+    op.drop_index("ix_products_name_tsvector", table_name="products")
@@ -0,0 +1,47 @@
+"""add productprices
+
+Revision ID: be16c12d8ee5
+Revises: 913aaf340f89
+Create Date: 2026-10-17 14:58:13.624205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "be16c12d8ee5"
+down_revision = "913aaf340f89"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "productprices",
+        sa.Column(
+            "product_id",
+            postgresql.UUID(),
+            sa.ForeignKey("products.id"),
+            primary_key=True,
+        ),
+        sa.Column("valid_from", sa.DateTime(timezone=True), primary_key=True),
+        sa.Column("price", sa.Integer(), nullable=False),
+    )
+    op.create_index(
+        "ix_productprices_valid_from",
+        "productprices",
+        ["valid_from"],
+        postgresql_using="brin",
+    )
+    # The current prices are the first entries in the history
+    op.execute(
+        "INSERT INTO productprices (product_id, valid_from, price) "
+        "SELECT id, updated_at, floor(price * 100) FROM products"
+    )
+
+
+def downgrade():
+    op.drop_index("ix_productprices_valid_from", table_name="productprices")
+    op.drop_table("productprices")
@@ -0,0 +1,32 @@
+"""add stores.catalog_version
+
+Revision ID: fbfd18639608
+Revises: 0a51e05c0710
+Create Date: 2026-10-17 14:30:44.150591
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "fbfd18639608"
+down_revision = "0a51e05c0710"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "stores",
+        sa.Column(
+            "catalog_version",
+            sa.Integer(),
+            nullable=False,
+            server_default=sa.text("0"),
+        ),
+    )
+
+
+def downgrade():
+    op.drop_column("stores", "catalog_version")
@@ -0,0 +1,87 @@
+"""Common benchmark configuration
+
+The benchmarks are not part of the test suite.  Run them with:
+
+    $ pytest benchmarks --benchmark-autosave
+
+The results are saved as JSON under ``.benchmarks/``.  A later run can be
+compared against the saved results, failing if any benchmark regressed:
+
+    $ pytest benchmarks --benchmark-compare --benchmark-compare-fail=median:10%
+
+Use ``--benchmark-json=PATH`` to write the results to a specific file instead.
+
+The benchmarks touching the database use an in-memory SQLite database.  Set
+``BENCHMARK_DATABASE_URL`` to benchmark against PostgreSQL instead.  The schema
+of that database is dropped and recreated.
+"""
+
+import asyncio
+import os
+
+import pytest
+import sqlalchemy.ext.asyncio as sqlaio
+
+from groceryaid import db
+from groceryaid.db import _db
+from groceryaid.retail import catalog
+from groceryaid.retail.faker import StoreFactory, ProductFactory
+
+CATALOG_SIZE = 1000
+
+
+@pytest.fixture(scope="session")
+def run():
+    """Return a function running a coroutine to completion
+
+    All coroutines are run in the same event loop, so that the database
+    connections can be reused between them.
+    """
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def engine(run):
+    """Return the engine of the benchmark database"""
+    if url := os.environ.get("BENCHMARK_DATABASE_URL"):
+        engine = _db._create_engine(url, "primary")
+    else:
+        engine = sqlaio.create_async_engine("sqlite+aiosqlite://")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(
+            "groceryaid.db._db.get_engine", lambda readonly=False: engine
+        )
+        yield engine
+    run(engine.dispose())
+
+
+@pytest.fixture(scope="module")
+def database(run, engine):
+    """Create an empty schema in the benchmark database for each module"""
+
+    async def _create_schema():
+        async with engine.begin() as conn:
+            await conn.run_sync(db.get_metadata().drop_all)
+            await conn.run_sync(db.get_metadata().create_all)
+
+    run(_create_schema())
+    catalog.clear_cache()
+    return engine
+
+
+@pytest.fixture(scope="module")
+def store(run, database):
+    """Return a store saved in the benchmark database"""
+    store = StoreFactory.build()
+    run(db.create(db.stores, store.dict()))
+    return store
+
+
+@pytest.fixture(scope="module")
+def products(run, store):
+    """Return the catalog of ``store`` saved in the benchmark database"""
+    products = ProductFactory.build_batch(CATALOG_SIZE, store_id=store.id)
+    run(db.create(db.products, [product.dict() for product in products]))
+    return products
@@ -0,0 +1,40 @@
+"""Bin packing benchmarks
+
+Run with:
+
+    $ pytest benchmarks/test_binpacking.py --benchmark-group-by=param:units
+
+Carts larger than :attr:`Settings.bin_packing_exact_max_units` fall back from
+the exact strategy to the best fit strategy.
+"""
+
+import decimal
+
+import factory.random
+import pytest
+
+from groceryaid.retail import binpacking, BinPackingStrategy
+from groceryaid.retail.faker import CartProductFactory
+
+LIMIT = decimal.Decimal(10)
+
+
+@pytest.fixture(scope="module", params=[10, 100, 1000], ids=lambda n: f"units={n}")
+def cart(request):
+    """Return a cart with the given number of product units"""
+    factory.random.reseed_random(request.param)
+    cart = []
+    units = request.param
+    while units:
+        cartproduct = CartProductFactory.build()
+        cartproduct.quantity = min(cartproduct.quantity, units)
+        units -= cartproduct.quantity
+        cart.append(cartproduct)
+    return cart
+
+
+@pytest.mark.parametrize("strategy", BinPackingStrategy, ids=lambda s: s.value)
+@pytest.mark.benchmark(group="bin-packing")
+def test_pack(benchmark, cart, strategy):
+    bins = benchmark(binpacking.pack, cart, LIMIT, strategy=strategy)
+    assert len(bins) >= binpacking.get_lower_bound(cart, LIMIT)
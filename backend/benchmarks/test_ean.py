@@ -0,0 +1,68 @@
+"""EAN validation benchmarks
+
+Run with:
+
+    $ pytest benchmarks/test_ean.py --benchmark-group-by=group,param:eans
+"""
+
+import random
+import uuid
+
+import pytest
+
+from groceryaid.retail import Ean, Product
+
+
+def _validate_with_regex(value: str) -> Ean:
+    # The original implementation of Ean.validate() as a baseline
+    if not Ean.pattern.fullmatch(value):
+        raise ValueError(f"{value!r} is not valid EAN number")
+    checksum = sum(int(c) for c in value[0:12:2]) + 3 * sum(
+        int(c) for c in value[1:12:2]
+    )
+    if str(-checksum % 10) != value[12]:
+        raise ValueError(f"{value!r} is not valid EAN number")
+    return Ean(value)
+
+
+@pytest.fixture(scope="module", params=[10_000, 100_000], ids=lambda n: f"n={n}")
+def eans(request):
+    """Return EAN codes, of which every tenth is variable price"""
+    rng = random.Random(request.param)
+    return [
+        Ean.from_prefix(("2" if i % 10 == 0 else "6") + f"{rng.randrange(10**11):011d}")
+        for i in range(request.param)
+    ]
+
+
+@pytest.mark.benchmark(group="ean-validate")
+def test_validate_with_regex(benchmark, eans):
+    values = [str(ean) for ean in eans]
+    benchmark(lambda: [_validate_with_regex(value) for value in values])
+
+
+@pytest.mark.benchmark(group="ean-validate")
+def test_validate(benchmark, eans):
+    values = [str(ean) for ean in eans]
+    benchmark(lambda: [Ean.validate(value) for value in values])
+
+
+@pytest.mark.benchmark(group="ean-validate")
+def test_build_products(benchmark, eans):
+    # The EANs fetched from the retail chains are validated while building the
+    # products, which bounds what faster EAN validation can gain there
+    store_id = uuid.uuid4()
+    items = [{"ean": str(ean), "name": "Product", "price": 1.23} for ean in eans]
+    benchmark(lambda: [Product(store_id=store_id, **item) for item in items])
+
+
+@pytest.mark.benchmark(group="ean-normalize")
+def test_get_ean_for_query(benchmark, eans):
+    benchmark(lambda: [ean.get_ean_for_query() for ean in eans])
+
+
+@pytest.mark.benchmark(group="ean-normalize")
+def test_normalize_many(benchmark, eans):
+    assert benchmark(Ean.normalize_many, eans) == [
+        ean.get_ean_for_query() for ean in eans
+    ]
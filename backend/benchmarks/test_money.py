@@ -0,0 +1,62 @@
+"""Monetary arithmetic benchmarks
+
+Run with:
+
+    $ pytest benchmarks --benchmark-group-by=group
+"""
+
+import decimal
+
+import pytest
+
+from groceryaid.retail import binpacking, BinPackingStrategy, from_cents
+from groceryaid.retail.faker import CartProductFactory
+
+CART_SIZE = 500
+
+
+@pytest.fixture(scope="module")
+def cart():
+    """Return a cart with 500 products"""
+    return CartProductFactory.build_batch(CART_SIZE)
+
+
+@pytest.mark.benchmark(group="cart-total")
+def test_cart_total_decimal(benchmark, cart):
+    def _get_total_price():
+        return sum(
+            (cartproduct.quantity or 1) * cartproduct.price for cartproduct in cart
+        )
+
+    benchmark(_get_total_price)
+
+
+@pytest.mark.benchmark(group="cart-total")
+def test_cart_total_cents(benchmark, cart):
+    def _get_total_price():
+        return from_cents(
+            sum(cartproduct.get_total_price_in_cents() for cartproduct in cart)
+        )
+
+    total_price = benchmark(_get_total_price)
+    assert total_price == sum(
+        (cartproduct.quantity or 1) * cartproduct.price for cartproduct in cart
+    )
+
+
+@pytest.mark.benchmark(group="cart-total")
+def test_cart_total_precomputed_cents(benchmark, cart):
+    # The price in cents only needs to be computed once per product, after
+    # which aggregating is integer arithmetic
+    prices_in_cents = [cartproduct.get_total_price_in_cents() for cartproduct in cart]
+    benchmark(lambda: from_cents(sum(prices_in_cents)))
+
+
+@pytest.mark.benchmark(group="bin-packing")
+@pytest.mark.parametrize(
+    "strategy", [BinPackingStrategy.GREEDY, BinPackingStrategy.BEST_FIT]
+)
+def test_bin_packing(benchmark, cart, strategy):
+    limit = decimal.Decimal(10)
+    bins = benchmark(binpacking.pack, cart, limit, strategy=strategy)
+    assert len(bins) >= binpacking.get_lower_bound(cart, limit)
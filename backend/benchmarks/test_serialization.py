@@ -0,0 +1,64 @@
+"""Store visit serialization benchmarks
+
+Run with:
+
+    $ pytest benchmarks/test_serialization.py --benchmark-group-by=param:storevisit
+"""
+
+import fastapi
+from fastapi.encoders import jsonable_encoder
+import fastapi.responses
+from hrefs.starlette import href_context
+import pytest
+
+from groceryaid import app
+from groceryaid.api.models import StoreVisit
+from groceryaid.api.storevisits import (
+    _prepare_store_visit_for_api,
+    _serialize_store_visit,
+)
+from groceryaid.retail import StoreVisit as DbStoreVisit
+from groceryaid.retail.faker import CartProductFactory, StoreVisitFactory
+
+
+@pytest.fixture(scope="module")
+def request_():
+    """Return a request used to generate hyperlinks"""
+    request = fastapi.Request(
+        {
+            "type": "http",
+            "app": app,
+            "router": app.router,
+            "scheme": "http",
+            "server": ("testserver", 80),
+            "root_path": "",
+            "path": "/",
+            "query_string": b"",
+            "headers": [],
+        }
+    )
+    with href_context(request):
+        yield request
+
+
+@pytest.fixture(scope="module", params=[100, 1000], ids=lambda n: f"n_items={n}")
+def storevisit(request):
+    """Return a store visit with 100 or 1000 items in the cart"""
+    return StoreVisitFactory.build(cart=CartProductFactory.build_batch(request.param))
+
+
+def test_serialize_with_validation(benchmark, request_, storevisit):
+    # This replicates building the response from a validated store visit, and
+    # FastAPI validating it against the response model
+    def _serialize():
+        validated_storevisit = DbStoreVisit(**storevisit.dict())
+        response_model = StoreVisit(
+            **_prepare_store_visit_for_api(validated_storevisit)
+        )
+        return fastapi.responses.JSONResponse(jsonable_encoder(response_model))
+
+    benchmark(_serialize)
+
+
+def test_serialize_fast_path(benchmark, request_, storevisit):
+    benchmark(_serialize_store_visit, request_, storevisit)
@@ -0,0 +1,130 @@
+"""Store visit benchmarks
+
+The round trips to the database are benchmarked both by calling the retail
+services directly, and by making full requests through the ASGI application.
+
+Run with:
+
+    $ pytest benchmarks/test_storevisits.py --benchmark-group-by=group,param:cart_size
+"""
+
+import asyncio
+import itertools
+import json
+
+import pytest
+
+from groceryaid import app
+from groceryaid.retail import storevisits, CartProduct
+from groceryaid.retail.faker import StoreVisitFactory
+
+
+@pytest.fixture(scope="module", params=[5, 50], ids=lambda n: f"cart_size={n}")
+def storevisit(request, run, store, products):
+    """Return a store visit saved in the benchmark database"""
+    storevisit = StoreVisitFactory.build(
+        store_id=store.id,
+        cart=[
+            CartProduct(ean=product.ean, name=product.name, quantity=1)
+            for product in products[: request.param]
+        ],
+    )
+    run(storevisits.create_store_visit(storevisit))
+    return storevisit
+
+
+@pytest.fixture
+def quantities():
+    """Return an iterator of alternating quantities
+
+    Changing the quantity every round makes sure that each update writes to
+    the database.
+    """
+    return itertools.cycle([1, 2])
+
+
+async def _request(method: str, path: str, *, body: bytes = b"", headers=()) -> int:
+    # Calls the application directly without a server or an HTTP client
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = 0
+    response_complete = asyncio.Event()
+
+    async def _receive():
+        if messages:
+            return messages.pop()
+        # The client only disconnects after receiving the response
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and not message.get(
+            "more_body", False
+        ):
+            response_complete.set()
+
+    await app(
+        {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "server": ("testserver", 80),
+            "client": ("testclient", 50000),
+            "root_path": "",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "headers": [(b"host", b"testserver"), *headers],
+        },
+        _receive,
+        _send,
+    )
+    return status
+
+
+@pytest.mark.benchmark(group="storevisit-read")
+def test_read_store_visit(benchmark, run, storevisit):
+    storevisit_in_db = benchmark(
+        lambda: run(storevisits.read_store_visit(storevisit.id))
+    )
+    assert len(storevisit_in_db.cart) == len(storevisit.cart)
+
+
+@pytest.mark.benchmark(group="storevisit-update")
+def test_read_and_update_store_visit(benchmark, run, storevisit, quantities):
+    async def _read_and_update():
+        storevisit_in_db = await storevisits.read_store_visit(storevisit.id)
+        storevisit_in_db.cart[0].quantity = next(quantities)
+        await storevisits.update_store_visit(storevisit_in_db)
+
+    benchmark(lambda: run(_read_and_update()))
+
+
+@pytest.mark.benchmark(group="storevisit-read")
+def test_get_store_visit_request(benchmark, run, storevisit):
+    path = f"/api/v1/storevisits/{storevisit.id}"
+    assert benchmark(lambda: run(_request("GET", path))) == 200
+
+
+@pytest.mark.benchmark(group="storevisit-update")
+def test_patch_store_visit_request(benchmark, run, storevisit, quantities):
+    path = f"/api/v1/storevisits/{storevisit.id}"
+    headers = [(b"content-type", b"application/json-patch+json")]
+
+    def _patch():
+        body = json.dumps(
+            [
+                {
+                    "op": "replace",
+                    "path": "/cart/items/0/quantity",
+                    "value": next(quantities),
+                }
+            ]
+        ).encode()
+        return run(_request("PATCH", path, body=body, headers=headers))
+
+    assert benchmark(_patch) == 200
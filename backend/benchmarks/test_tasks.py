@@ -0,0 +1,61 @@
+"""Store and product ingestion benchmarks
+
+The products are generated by the faker chain, so the benchmarks measure
+comparing and saving the catalogs, not the network.  The generation is
+included in the measurements.
+
+Run with:
+
+    $ pytest benchmarks/test_tasks.py --benchmark-group-by=group,param:catalog_size
+"""
+
+import pytest
+import sqlalchemy
+
+from groceryaid import db
+from groceryaid.retail import catalog, RetailChain
+from groceryaid.retail.tasks import fetch_and_save_stores_and_products
+from groceryaid.settings import settings
+
+
+@pytest.fixture(
+    autouse=True,
+    params=[1_000, 10_000, 100_000],
+    ids=lambda n: f"catalog_size={n}",
+)
+def catalog_size(request, monkeypatch):
+    """Configure the size of the catalogs generated by the faker chain"""
+    monkeypatch.setattr(settings, "faker_products_per_store", request.param)
+    monkeypatch.setattr(
+        settings, "faker_products_batch_size", settings.sok_products_batch_size
+    )
+    return request.param
+
+
+async def _delete_catalogs():
+    async with db.get_connection() as connection:
+        for table in [db.productprices, db.products, db.stores]:
+            await connection.execute(sqlalchemy.delete(table))
+    catalog.clear_cache()
+
+
+async def _fetch():
+    reports = await fetch_and_save_stores_and_products(RetailChain.FAKER)
+    assert all(report.is_success() for report in reports)
+    return reports
+
+
+@pytest.mark.benchmark(group="fetch")
+def test_fetch_new_catalog(benchmark, run, database):
+    reports = benchmark.pedantic(
+        lambda: run(_fetch()), setup=lambda: run(_delete_catalogs()), rounds=3
+    )
+    assert all(report.inserted for report in reports)
+
+
+@pytest.mark.benchmark(group="fetch")
+def test_fetch_unchanged_catalog(benchmark, run, database):
+    run(_delete_catalogs())
+    run(_fetch())
+    reports = benchmark.pedantic(lambda: run(_fetch()), rounds=3)
+    assert not any(report.inserted or report.updated for report in reports)
@@ -5,7 +5,7 @@ import typing
 
 import typer
 
-from . import db
+from . import db, loadtest
 from .retail import RetailChain, tasks as retail_tasks
 
 cli = typer.Typer()
@@ -17,9 +17,24 @@ def init():
     asyncio.run(db.init())
 
 
-async def _fetch_stores_async(chains: list[RetailChain]):
+async def _fetch_stores_async(chains: list[RetailChain]) -> bool:
+    success = True
     for chain in chains:
-        await retail_tasks.fetch_and_save_stores_and_products(chain)
+        for report in await retail_tasks.fetch_and_save_stores_and_products(chain):
+            if report.is_success():
+                typer.echo(
+                    f"Fetched {chain.value} store {report.store_external_id!r}: "
+                    f"{report.inserted} inserted, {report.updated} updated, "
+                    f"{report.unchanged} unchanged, {report.vanished} vanished"
+                )
+            else:
+                typer.echo(
+                    f"Failed to fetch {chain.value} store "
+                    f"{report.store_external_id!r}: {report.error}",
+                    err=True,
+                )
+                success = False
+    return success
 
 
 @cli.command()
@@ -30,7 +45,64 @@ def fetch_stores(chains: typing.Optional[list[RetailChain]] = None):
         if chains
         else [chain for chain in RetailChain if chain is not RetailChain.FAKER]
     )
-    asyncio.run(_fetch_stores_async(chains))
+    if not asyncio.run(_fetch_stores_async(chains)):
+        raise typer.Exit(1)
+
+
+async def _load_test_async(*, fetch_catalog: bool, **kwargs) -> loadtest.LoadTestReport:
+    if fetch_catalog and not await _fetch_stores_async([RetailChain.FAKER]):
+        raise typer.Exit(1)
+    return await loadtest.run_load_test(**kwargs)
+
+
+def _format_load_test_report(report: loadtest.LoadTestReport) -> str:
+    header = (
+        f"{'Endpoint':<28} {'Requests':>8} {'Errors':>7} {'Req/s':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    lines = [
+        f"{report.shoppers} shoppers, {report.concurrency} concurrently, "
+        f"in {report.duration:.1f} s",
+        header,
+    ]
+    for stats in report.endpoints:
+        lines.append(
+            f"{stats.endpoint:<28} {stats.requests:>8} "
+            f"{stats.error_rate:>7.1%} {stats.throughput:>8.1f} "
+            f"{stats.p50 * 1000:>8.1f} {stats.p95 * 1000:>8.1f} "
+            f"{stats.p99 * 1000:>8.1f}"
+        )
+    return "\n".join(lines)
+
+
+@cli.command()
+def load_test(
+    shoppers: int = typer.Option(100, min=1, help="Number of simulated shoppers"),
+    concurrency: int = typer.Option(10, min=1, help="Number of concurrent shoppers"),
+    url: typing.Optional[str] = typer.Option(
+        None,
+        help="Base URL of the instance under test. If omitted, the application "
+        "is called in this process.",
+    ),
+    seed: int = typer.Option(0, help="Seed of the generated store visits"),
+    fetch_catalog: bool = typer.Option(
+        False, help="Fetch the stores and products of the faker chain first"
+    ),
+    json_output: bool = typer.Option(False, "--json", help="Print the report as JSON"),
+):
+    """Simulate shoppers using the store visit workflow concurrently"""
+    report = asyncio.run(
+        _load_test_async(
+            fetch_catalog=fetch_catalog,
+            shoppers=shoppers,
+            concurrency=concurrency,
+            url=url,
+            seed=seed,
+        )
+    )
+    typer.echo(report.json() if json_output else _format_load_test_report(report))
+    if any(stats.errors for stats in report.endpoints):
+        raise typer.Exit(1)
 
 
 if __name__ == "__main__":
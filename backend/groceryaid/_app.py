@@ -4,7 +4,7 @@ import fastapi
 from fastapi.middleware.cors import CORSMiddleware
 from hrefs.starlette import HrefMiddleware
 
-from . import api
+from . import api, metrics, tracing
 
 app = fastapi.FastAPI(
     title="Grocery Aid",
@@ -22,8 +22,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Link"],
 )
 
 app.add_middleware(HrefMiddleware)
 
+app.add_middleware(metrics.MetricsMiddleware)
+
+app.add_middleware(tracing.TracingMiddleware)
+
 app.include_router(api.app, prefix="/api/v1")
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """
+    Expose the metrics to Prometheus
+    """
+    return fastapi.Response(metrics.generate_latest(), media_type=metrics.CONTENT_TYPE)
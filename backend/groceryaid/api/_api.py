@@ -2,9 +2,10 @@
 
 import fastapi
 
-from . import stores, storevisits
+from . import stores, storevisits, status
 
 app = fastapi.APIRouter()
 
 app.include_router(stores.router, prefix="/stores", tags=["stores"])
 app.include_router(storevisits.router, prefix="/storevisits", tags=["storevisits"])
+app.include_router(status.router, prefix="/status", tags=["status"])
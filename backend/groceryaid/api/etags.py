@@ -0,0 +1,56 @@
+"""Entity tags and conditional requests"""
+
+import hashlib
+import typing
+
+import fastapi
+
+
+def make_etag(*parts: typing.Any) -> str:
+    """Return strong entity tag identifying a representation
+
+    The entity tag is a hash of ``parts``, which should together identify the
+    version of the representation (e.g. the resource id and the version of the
+    data it is built from).
+    """
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def matches(header: typing.Optional[str], etag: str, *, weak: bool = False) -> bool:
+    """Return ``True`` if ``etag`` matches a conditional request header
+
+    Parameters:
+        header: The value of ``If-None-Match`` or ``If-Match`` header, or
+            ``None`` if the header is missing
+        etag: The current entity tag of the resource
+
+    Keyword Arguments:
+        weak: If ``True``, use the weak comparison (required for
+            ``If-None-Match``), otherwise the strong comparison (required for
+            ``If-Match``)
+    """
+    if header is None:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if weak:
+            tag = tag.removeprefix("W/")
+        if tag == etag:
+            return True
+    return False
+
+
+def is_not_modified(request: fastapi.Request, etag: str) -> bool:
+    """Return ``True`` if the ``If-None-Match`` header of the request matches
+    ``etag``"""
+    return matches(request.headers.get("if-none-match"), etag, weak=True)
+
+
+def not_modified(headers: typing.Mapping[str, str]) -> fastapi.Response:
+    """Return 304 Not Modified response with the given headers"""
+    return fastapi.Response(
+        status_code=fastapi.status.HTTP_304_NOT_MODIFIED, headers=dict(headers)
+    )
@@ -1,6 +1,7 @@
 """API models"""
 
 import collections
+import datetime
 import decimal
 import uuid
 import typing
@@ -10,7 +11,10 @@ import pydantic
 import hrefs
 from hrefs.starlette import ReferrableModel
 
+from ..db import PoolStats, StatementCacheStats
 from ..retail import RetailChain, Name, Ean, Price, Quantity
+from ..retail.catalog import ProductCacheStats
+from ..settings import settings
 
 
 class Store(ReferrableModel):
@@ -72,6 +76,77 @@ class Product(ReferrableModel):
 Product.update_forward_refs()
 
 
+class ProductPage(pydantic.BaseModel):
+    """A page of products"""
+
+    items: list[Product] = pydantic.Field(description="The products on the page")
+    next_cursor: typing.Optional[str] = pydantic.Field(
+        description="""The ``cursor`` query parameter for retrieving the next
+                    page, or ``null`` if this is the last page
+                    """
+    )
+
+
+class ProductPrice(pydantic.BaseModel):
+    """Price of a product from the given time on"""
+
+    valid_from: datetime.datetime = pydantic.Field(
+        description="The time the price took effect"
+    )
+    price: Price = pydantic.Field(description="The price per unit")
+
+
+class ProductPriceHistory(pydantic.BaseModel):
+    """Price history of a product"""
+
+    product: hrefs.Href[Product] = pydantic.Field(
+        title="Product hyperlink", description="The product"
+    )
+    prices: list[ProductPrice] = pydantic.Field(
+        description="The price changes in time order"
+    )
+
+
+class ProductLookup(pydantic.BaseModel):
+    """Payload for looking up products by EAN code"""
+
+    eans: list[Ean] = pydantic.Field(
+        min_items=1,
+        max_items=settings.max_product_lookup_size,
+        description="""The EAN codes to look up.  Both fixed and variable price
+                    EAN codes are accepted.
+                    """,
+    )
+
+
+class ProductLookupItem(pydantic.BaseModel):
+    """Result of looking up a single EAN code"""
+
+    ean: Ean = pydantic.Field(description="The EAN code as given in the request")
+    product: typing.Optional[Product] = pydantic.Field(
+        description="The product, or ``null`` if the product is unknown"
+    )
+    price: typing.Optional[Price] = pydantic.Field(
+        description="""The price of the item, or ``null`` if the product is
+                    unknown
+
+                    For a variable price EAN code, this is the price encoded in
+                    the EAN code, and otherwise the price of the product.
+                    """
+    )
+
+
+class ProductLookupResult(pydantic.BaseModel):
+    """Result of looking up products by EAN code"""
+
+    items: list[ProductLookupItem] = pydantic.Field(
+        description="The results in the same order as the EAN codes in the request"
+    )
+    missing: list[Ean] = pydantic.Field(
+        description="The EAN codes of the unknown products"
+    )
+
+
 class _CartProductBase(pydantic.BaseModel):
     quantity: typing.Optional[Quantity] = pydantic.Field(
         description="""Number of items
@@ -213,3 +288,31 @@ class GroupedCart(pydantic.BaseModel):
 
     store_visit: hrefs.Href[StoreVisit]
     binned_cart: list[Cart]
+    lower_bound: int = pydantic.Field(
+        ge=0,
+        description="""Lower bound for the number of bins
+
+                    The optimal grouping has at least this many bins.  The
+                    products whose price exceeds the limit are counted as one
+                    additional bin.
+                    """,
+    )
+
+
+class WorkerStatus(pydantic.BaseModel):
+    """Status of a worker process"""
+
+    product_cache: ProductCacheStats = pydantic.Field(
+        description="Statistics of the product cache of the worker"
+    )
+    database_pool: PoolStats = pydantic.Field(
+        description="Statistics of the database connection pool of the worker"
+    )
+    statement_cache: StatementCacheStats = pydantic.Field(
+        description="Statistics of the SQL statement cache of the worker"
+    )
+    database_replica_pool: typing.Optional[PoolStats] = pydantic.Field(
+        description="""Statistics of the read replica connection pool of the
+                    worker, if a read replica is configured
+                    """
+    )
@@ -0,0 +1,52 @@
+"""Cursor pagination
+
+The cursors are opaque to the clients.  Internally they encode the position of
+the last item of the previous page, which is used to continue the query from
+where the previous page ended.
+"""
+
+import base64
+import json
+import typing
+
+import fastapi
+import pydantic
+
+T = typing.TypeVar("T")
+
+
+def encode_cursor(position: typing.Any) -> str:
+    """Encode position of an item as a cursor"""
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor: typing.Optional[str], type_: type[T]) -> typing.Optional[T]:
+    """Decode cursor into position of an item
+
+    Parameters:
+        cursor: The cursor, or ``None`` for the first page
+        type_: The type of the position
+
+    Raises:
+        :exc:`fastapi.HTTPException` if the cursor is invalid
+    """
+    if cursor is None:
+        return None
+    try:
+        return pydantic.parse_obj_as(
+            type_, json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        )
+    except (ValueError, pydantic.ValidationError) as ex:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid cursor: {cursor!r}",
+        ) from ex
+
+
+def get_next_link(request: fastapi.Request, cursor: str) -> str:
+    """Return ``Link`` header value pointing to the next page
+
+    The next page is requested with the same query parameters as the current
+    page, except ``cursor``.
+    """
+    return f'<{request.url.include_query_params(cursor=cursor)}>; rel="next"'
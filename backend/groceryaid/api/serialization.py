@@ -0,0 +1,33 @@
+"""Serializing responses without the API models
+
+The hot paths serialize trusted data directly instead of letting FastAPI
+validate it against the API models.  The serialized documents must be the same
+as what FastAPI would produce.
+"""
+
+import uuid
+
+import fastapi
+import fastapi.responses
+import orjson
+
+JSONResponse = fastapi.responses.ORJSONResponse
+
+# Placeholder for generating product URLs without looking up the route for
+# each product
+_URL_TEMPLATE_EAN = "{ean}"
+
+
+def dumps(obj) -> bytes:
+    """Serialize ``obj`` to JSON"""
+    return orjson.dumps(obj)
+
+
+def get_product_url_prefix(request: fastapi.Request, store_id: uuid.UUID) -> str:
+    """Return the common prefix of the URLs of the products of a store
+
+    The URL of a product is the prefix followed by the EAN code.
+    """
+    return request.url_for(
+        "get_product", store_id=store_id, ean=_URL_TEMPLATE_EAN
+    ).removesuffix(_URL_TEMPLATE_EAN)
@@ -0,0 +1,32 @@
+"""Status API"""
+
+import fastapi
+
+from .. import db
+from ..retail import catalog
+from ..settings import settings
+
+from .models import WorkerStatus
+
+router = fastapi.APIRouter()
+
+
+@router.get(
+    "",
+    response_model=WorkerStatus,
+)
+async def get_status():
+    """
+    Retrieve the status of the worker process serving the request
+
+    The application may be served by multiple worker processes, each having
+    their own caches.
+    """
+    return {
+        "product_cache": catalog.get_cache_stats(),
+        "database_pool": db.get_pool_stats(),
+        "statement_cache": db.get_statement_cache_stats(),
+        "database_replica_pool": (
+            db.get_pool_stats(readonly=True) if settings.database_replica_url else None
+        ),
+    }
@@ -1,45 +1,138 @@
 """Stores API"""
 
+import datetime
+import typing
 import uuid
 
 import fastapi
+import fastapi.responses
+import sqlalchemy
 
 from .. import db
+from ..retail import catalog, prices
+from ..settings import settings
 
-from .models import Store, Product, Ean
+from . import etags, pagination, serialization
+from .models import (
+    Store,
+    Product,
+    ProductPage,
+    ProductLookup,
+    ProductLookupResult,
+    ProductPriceHistory,
+    Ean,
+)
 
 router = fastapi.APIRouter()
 
+_RESPONSE_304 = {
+    "description": "Not modified since the version identified by ``If-None-Match``",
+}
+
+_RESPONSE_STORE_404 = {
+    "description": "Store not found",
+}
+
+_NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+_CURSOR_DESCRIPTION = "The cursor of the next page, as returned by the previous page"
+
+
+def _get_cache_headers(etag: str) -> dict[str, str]:
+    # The catalog only changes when the products are fetched, so the clients and
+    # proxies may cache the responses for a while even without revalidating
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.catalog_cache_max_age}",
+    }
+
+
+async def _get_catalog_version(store_id: uuid.UUID) -> int:
+    if (version := await catalog.get_catalog_version(store_id, readonly=True)) is None:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_404_NOT_FOUND,
+            detail=f"Store {store_id=!r} not found",
+        )
+    return version
+
 
 @router.get(
     "",
     response_model=list[Store],
+    responses={
+        fastapi.status.HTTP_304_NOT_MODIFIED: _RESPONSE_304,
+    },
 )
-async def get_stores():
+async def get_stores(
+    request: fastapi.Request,
+    response: fastapi.Response,
+    limit: typing.Optional[int] = fastapi.Query(
+        None,
+        ge=1,
+        le=settings.max_page_size,
+        description="The maximum number of stores returned (defaults to all)",
+    ),
+    cursor: typing.Optional[str] = fastapi.Query(None, description=_CURSOR_DESCRIPTION),
+):
     """
     Retrieve basic information about all stores
+
+    If ``limit`` is given, the stores are paginated.  The URL of the next page
+    is returned in the ``Link`` header.
     """
-    return await db.select(
-        db.stores, columns=[db.stores.c.id, db.stores.c.chain, db.stores.c.name]
+    after = pagination.decode_cursor(cursor, uuid.UUID)
+    versions = await catalog.get_catalog_versions(readonly=True)
+    headers = _get_cache_headers(
+        etags.make_etag(*sorted(versions.items()), limit, after)
     )
+    if etags.is_not_modified(request, headers["ETag"]):
+        return etags.not_modified(headers)
+    stmt = sqlalchemy.select(
+        [db.stores.c.id, db.stores.c.chain, db.stores.c.name]
+    ).order_by(db.stores.c.id)
+    if after is not None:
+        stmt = stmt.where(db.stores.c.id > after)
+    if limit is not None:
+        # One extra store is retrieved to know if there is a next page
+        stmt = stmt.limit(limit + 1)
+    stores = (await db.execute(stmt, readonly=True)).fetchall()
+    if limit is not None and len(stores) > limit:
+        del stores[limit:]
+        headers["Link"] = pagination.get_next_link(
+            request, pagination.encode_cursor(str(stores[-1].id))
+        )
+    response.headers.update(headers)
+    return stores
 
 
 @router.get(
     "/{id}",
     response_model=Store,
     responses={
-        fastapi.status.HTTP_404_NOT_FOUND: {
-            "description": "Store not found",
-        },
+        fastapi.status.HTTP_304_NOT_MODIFIED: _RESPONSE_304,
+        fastapi.status.HTTP_404_NOT_FOUND: _RESPONSE_STORE_404,
     },
 )
-async def get_store(id: uuid.UUID):
+async def get_store(
+    id: uuid.UUID, request: fastapi.Request, response: fastapi.Response
+):
     """
     Retrieve basic information about store identified by ``id``
     """
-    if store := await db.read(
-        db.stores, id, columns=[db.stores.c.chain, db.stores.c.name]
+    version = await catalog.get_catalog_version(id, readonly=True)
+    if version is not None:
+        headers = _get_cache_headers(etags.make_etag(id, version))
+        if etags.is_not_modified(request, headers["ETag"]):
+            return etags.not_modified(headers)
+    if version is not None and (
+        store := await db.read(
+            db.stores,
+            id,
+            columns=[db.stores.c.chain, db.stores.c.name],
+            readonly=True,
+        )
     ):
+        response.headers.update(headers)
         return {"id": id, **store}
     raise fastapi.HTTPException(
         status_code=fastapi.status.HTTP_404_NOT_FOUND,
@@ -47,32 +140,242 @@ async def get_store(id: uuid.UUID):
     )
 
 
+async def _serialize_products_as_ndjson(
+    request: fastapi.Request,
+    store_id: uuid.UUID,
+    products: typing.AsyncIterator[catalog.ProductRecord],
+) -> typing.AsyncIterator[bytes]:
+    store_url = request.url_for("get_store", id=store_id)
+    product_url_prefix = serialization.get_product_url_prefix(request, store_id)
+    async for product in products:
+        yield serialization.dumps(
+            {
+                "self": product_url_prefix + product["ean"],
+                "store": store_url,
+                "ean": product["ean"],
+                "name": product["name"],
+                "price": float(product["price"]),
+            }
+        ) + b"\n"
+
+
+@router.get(
+    "/{store_id}/products/export",
+    response_class=fastapi.responses.StreamingResponse,
+    responses={
+        fastapi.status.HTTP_200_OK: {
+            "description": """
+            The products of the store as newline delimited JSON, one product per
+            line
+            """,
+            "content": {_NDJSON_CONTENT_TYPE: {}},
+        },
+        fastapi.status.HTTP_304_NOT_MODIFIED: _RESPONSE_304,
+        fastapi.status.HTTP_404_NOT_FOUND: _RESPONSE_STORE_404,
+    },
+)
+async def export_products(store_id: uuid.UUID, request: fastapi.Request):
+    """
+    Export all products of a store
+
+    The products are streamed from the database, which makes this the
+    preferred way to retrieve the whole catalog of a store.
+    """
+    version = await _get_catalog_version(store_id)
+    headers = _get_cache_headers(etags.make_etag(store_id, version, "export"))
+    if etags.is_not_modified(request, headers["ETag"]):
+        return etags.not_modified(headers)
+    return fastapi.responses.StreamingResponse(
+        _serialize_products_as_ndjson(
+            request, store_id, catalog.stream_products(store_id, readonly=True)
+        ),
+        media_type=_NDJSON_CONTENT_TYPE,
+        headers=headers,
+    )
+
+
 @router.get(
     "/{store_id}/products/{ean}",
     response_model=Product,
     responses={
+        fastapi.status.HTTP_304_NOT_MODIFIED: _RESPONSE_304,
         fastapi.status.HTTP_404_NOT_FOUND: {
             "description": "Product not found",
         },
     },
 )
-async def get_product(store_id: uuid.UUID, ean: Ean):
+async def get_product(
+    store_id: uuid.UUID,
+    ean: Ean,
+    request: fastapi.Request,
+    response: fastapi.Response,
+):
     """
     Retrieve information about a product identified by store and EAN code
     """
     ean = ean.get_ean_for_query()
-    if product := await db.read(
-        db.products,
-        (db.products.c.store_id == store_id)
-        & (db.products.c.ean == ean.get_ean_for_query()),
-        columns=[db.products.c.name, db.products.c.price],
+    version = await catalog.get_catalog_version(store_id, readonly=True)
+    if version is not None:
+        headers = _get_cache_headers(etags.make_etag(store_id, ean, version))
+        if etags.is_not_modified(request, headers["ETag"]):
+            return etags.not_modified(headers)
+    if version is not None and (
+        product := await catalog.get_product(store_id, ean, readonly=True)
     ):
-        return {
-            "store": store_id,
-            "ean": ean,
-            **product,
-        }
+        response.headers.update(headers)
+        return {"store": store_id, **product}
     raise fastapi.HTTPException(
         status_code=fastapi.status.HTTP_404_NOT_FOUND,
         detail="Product not found",
     )
+
+
+@router.get(
+    "/{store_id}/products",
+    response_model=ProductPage,
+    responses={
+        fastapi.status.HTTP_304_NOT_MODIFIED: _RESPONSE_304,
+        fastapi.status.HTTP_404_NOT_FOUND: _RESPONSE_STORE_404,
+    },
+)
+async def get_products(
+    store_id: uuid.UUID,
+    request: fastapi.Request,
+    response: fastapi.Response,
+    q: typing.Optional[str] = fastapi.Query(
+        None,
+        min_length=1,
+        max_length=255,
+        description="""
+        Search query.  If given, only the products whose name contains words
+        starting with each word in the query are returned, the best matches
+        first.  Otherwise all products are returned ordered by EAN code.
+        """,
+    ),
+    limit: int = fastapi.Query(
+        settings.default_page_size,
+        ge=1,
+        le=settings.max_page_size,
+        description="The maximum number of products on the page",
+    ),
+    cursor: typing.Optional[str] = fastapi.Query(None, description=_CURSOR_DESCRIPTION),
+):
+    """
+    List or search products of a store
+
+    The products are paginated.  The cursor of the next page is returned in
+    the body, and the URL of the next page in the ``Link`` header.
+    """
+    after = pagination.decode_cursor(
+        cursor, str if q is None else catalog.SearchPosition
+    )
+    version = await _get_catalog_version(store_id)
+    headers = _get_cache_headers(etags.make_etag(store_id, version, q, limit, after))
+    if etags.is_not_modified(request, headers["ETag"]):
+        return etags.not_modified(headers)
+    # One extra product is retrieved to know if there is a next page
+    if q is None:
+        products = await catalog.list_products(
+            store_id, limit=limit + 1, after=after, readonly=True
+        )
+    else:
+        products = await catalog.search_products(
+            store_id, q, limit=limit + 1, after=after, readonly=True
+        )
+    next_cursor = None
+    if len(products) > limit:
+        del products[limit:]
+        last_product = products[-1]
+        next_cursor = pagination.encode_cursor(
+            last_product["ean"]
+            if q is None
+            else [last_product["score"], last_product["ean"]]
+        )
+        headers["Link"] = pagination.get_next_link(request, next_cursor)
+    response.headers.update(headers)
+    return {
+        "items": [{"store": store_id, **product} for product in products],
+        "next_cursor": next_cursor,
+    }
+
+
+@router.post(
+    "/{store_id}/products/lookup",
+    response_model=ProductLookupResult,
+    responses={
+        fastapi.status.HTTP_404_NOT_FOUND: _RESPONSE_STORE_404,
+    },
+)
+async def lookup_products(store_id: uuid.UUID, lookup: ProductLookup):
+    """
+    Look up multiple products of a store by EAN code
+
+    This is equivalent to retrieving each product separately, but the products
+    are looked up at once.  Unknown products don't fail the request, but are
+    returned as missing.
+    """
+    await _get_catalog_version(store_id)
+    eans_for_query = Ean.normalize_many(lookup.eans)
+    products = await catalog.get_products(store_id, eans_for_query, readonly=True)
+    items = []
+    missing = {}
+    for ean, ean_for_query in zip(lookup.eans, eans_for_query):
+        if (product := products.get(ean_for_query)) is None:
+            items.append({"ean": ean, "product": None, "price": None})
+            missing[ean] = None
+        else:
+            items.append(
+                {
+                    "ean": ean,
+                    "product": {"store": store_id, **product},
+                    "price": (
+                        ean.get_price() if ean.is_variable_price() else product["price"]
+                    ),
+                }
+            )
+    return {"items": items, "missing": list(missing)}
+
+
+@router.get(
+    "/{store_id}/products/{ean}/prices",
+    response_model=ProductPriceHistory,
+    responses={
+        fastapi.status.HTTP_304_NOT_MODIFIED: _RESPONSE_304,
+        fastapi.status.HTTP_404_NOT_FOUND: {
+            "description": "Product not found",
+        },
+    },
+)
+async def get_product_prices(
+    store_id: uuid.UUID,
+    ean: Ean,
+    request: fastapi.Request,
+    response: fastapi.Response,
+    since: typing.Optional[datetime.datetime] = fastapi.Query(
+        None,
+        description="""
+        If given, only the price changes after this time are returned, preceded
+        by the price valid at this time
+        """,
+    ),
+):
+    """
+    Retrieve the price history of a product identified by store and EAN code
+    """
+    ean = ean.get_ean_for_query()
+    version = await _get_catalog_version(store_id)
+    headers = _get_cache_headers(etags.make_etag(store_id, ean, version, since))
+    if etags.is_not_modified(request, headers["ETag"]):
+        return etags.not_modified(headers)
+    if not await catalog.get_product(store_id, ean, readonly=True):
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_404_NOT_FOUND,
+            detail="Product not found",
+        )
+    response.headers.update(headers)
+    return {
+        "product": (store_id, ean),
+        "prices": await prices.read_price_history(
+            store_id, ean, since=since, readonly=True
+        ),
+    }
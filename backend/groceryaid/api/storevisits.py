@@ -1,15 +1,21 @@
 """Stores API"""
 
+import functools
+import math
+import time
 import typing
+import urllib.parse
 import uuid
 
 import fastapi
+from fastapi.concurrency import run_in_threadpool
 import jsonpatch
 import jsonpointer
 import pydantic
-import sqlalchemy
+import sqlalchemy.engine
 import sqlalchemy.ext.asyncio as sqlaio
 
+from . import etags, serialization
 from .models import (
     StoreVisit,
     StoreVisitCreate,
@@ -17,9 +23,10 @@ from .models import (
     GroupedCart,
 )
 
-from .. import db
-from ..retail import storevisits
+from .. import db, tracing
+from ..retail import storevisits, binpacking, catalog, BinPackingStrategy
 from ..retail import StoreVisit as DbStoreVisit, CartProduct as DbCartProduct
+from ..retail import Ean, to_cents, from_cents
 from ..settings import settings
 
 router = fastapi.APIRouter()
@@ -30,8 +37,17 @@ _RESPONSE_404 = {
     "description": "Store visit not found",
 }
 
+_RESPONSE_412 = {
+    "description": "The store visit doesn't match the version in ``If-Match``",
+}
+
 _ProductProxy = typing.Mapping[str, typing.Any]
 
+# Cookie telling until when (as UNIX time) a store visit modified by the client
+# is read from the primary database.  The client carries the cookie, so the
+# guard holds regardless of which worker or container serves the next request.
+_READ_YOUR_WRITES_COOKIE = "storevisit_primary_until"
+
 
 async def _get_json_patch(
     request: fastapi.Request,
@@ -61,91 +77,94 @@ async def _get_json_patch(
         ) from ex
 
 
+@tracing.traced
 async def _get_product_records(
     connection: sqlaio.AsyncConnection,
     storevisit: StoreVisitCreate | StoreVisitUpdate,
     store_id: uuid.UUID,
 ) -> _ProductProxy:
-    product_eans = set(ean.get_ean_for_query() for ean in storevisit.cart.get_eans())
-    known_products = (
-        await db.execute(
-            sqlalchemy.select([db.products.c.ean, db.products.c.name, db.products.c.price]).where(  # type: ignore
-                db.products.c.store_id == store_id,
-                db.products.c.ean.in_(product_eans),
-            ),
-            connection=connection,
-        )
-    ).fetchall()
-    known_product_eans = set(product.ean for product in known_products)
-    if missing_eans := product_eans - known_product_eans:
+    product_eans = set(Ean.normalize_many(storevisit.cart.get_eans()))
+    known_products = await catalog.get_products(
+        store_id, product_eans, connection=connection
+    )
+    if missing_eans := product_eans - known_products.keys():
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_400_BAD_REQUEST,
             detail=f"Unknown products: {', '.join(missing_eans)}",
         )
-    return {product.ean: product for product in known_products}
+    return known_products
 
 
 def _prepare_store_visit_for_db(
     storevisit: StoreVisitCreate | StoreVisitUpdate, **kwargs
 ) -> DbStoreVisit:
+    eans_for_query = Ean.normalize_many(storevisit.cart.get_eans())
     return DbStoreVisit(
         **kwargs,
         cart=[
             {
-                "ean": item.get_ean_for_query(),
+                "ean": ean,
                 "price": item.get_price(),
                 **item.dict(exclude={"product", "ean", "price"}),
             }
-            for item in storevisit.cart.items
+            for (item, ean) in zip(storevisit.cart.items, eans_for_query)
         ],
     )
 
 
-def _get_total_price(cartproduct: DbCartProduct, product: _ProductProxy):
-    if (total_price := cartproduct.get_total_price()) is not None:
+def _get_total_price_in_cents(cartproduct: DbCartProduct, product: _ProductProxy):
+    if (total_price := cartproduct.get_total_price_in_cents()) is not None:
         return total_price
-    return (cartproduct.quantity or 1) * (product["price"] or 0)
+    if (price := product["price"]) is not None:
+        return (cartproduct.quantity or 1) * to_cents(price)
+    return 0
 
 
 def _prepare_cart_product_for_api(
     store_id: uuid.UUID,
     cartproduct: DbCartProduct,
-    # pylint: disable=dangerous-default-value
-    product: _ProductProxy = {},
+    total_price_in_cents: int,
+    product: typing.Optional[_ProductProxy] = None,
 ):
     return {
         "product": {
             "store": store_id,
             **cartproduct.dict(include={"ean", "name", "price"}),
-            **product,
+            **(product or {}),
         },
         "quantity": cartproduct.quantity,
-        "total_price": _get_total_price(cartproduct, product),
+        "total_price": from_cents(total_price_in_cents),
     }
 
 
 def _prepare_cart_for_api(
     store_id: uuid.UUID,
     cart: typing.Iterable[DbCartProduct],
-    # pylint: disable=dangerous-default-value
-    products: typing.Mapping[str, _ProductProxy] = {},
+    products: typing.Optional[typing.Mapping[str, _ProductProxy]] = None,
 ):
-    items = [
-        _prepare_cart_product_for_api(
-            store_id, cartproduct, products.get(cartproduct.ean, {})
+    # The totals are summed in integer cents and only converted to decimal
+    # amounts in the response
+    items = []
+    total_price_in_cents = 0
+    products = products or {}
+    for cartproduct in cart:
+        product = products.get(cartproduct.ean, {})
+        item_total_price = _get_total_price_in_cents(cartproduct, product)
+        total_price_in_cents += item_total_price
+        items.append(
+            _prepare_cart_product_for_api(
+                store_id, cartproduct, item_total_price, product
+            )
         )
-        for cartproduct in cart
-    ]
     return {
         "items": items,
-        "total_price": sum(item["total_price"] for item in items),
+        "total_price": from_cents(total_price_in_cents),
     }
 
 
 def _prepare_store_visit_for_api(
     storevisit: DbStoreVisit,
-    # pylint: disable=dangerous-default-value
-    products: typing.Mapping[str, _ProductProxy] = {},
+    products: typing.Optional[typing.Mapping[str, _ProductProxy]] = None,
 ) -> dict:
     store_id = storevisit.store_id
     return {
@@ -155,10 +174,126 @@ def _prepare_store_visit_for_api(
     }
 
 
+def _serialize_cart_product(item: dict, store_url: str, product_url_prefix: str):
+    product = item["product"]
+    return {
+        "quantity": item["quantity"],
+        "product": {
+            "self": product_url_prefix + product["ean"],
+            "store": store_url,
+            "ean": product["ean"],
+            "name": product["name"],
+            "price": float(product["price"]),
+        },
+        "total_price": float(item["total_price"]),
+    }
+
+
+def _serialize_store_visit(
+    request: fastapi.Request,
+    storevisit: DbStoreVisit,
+    products: typing.Optional[typing.Mapping[str, _ProductProxy]] = None,
+    **kwargs,
+) -> fastapi.Response:
+    # Fast path for responding with a store visit.  The response must be the
+    # same as what FastAPI would produce from _prepare_store_visit_for_api().
+    store_id = storevisit.store_id
+    store_url = request.url_for("get_store", id=store_id)
+    product_url_prefix = serialization.get_product_url_prefix(request, store_id)
+    cart = _prepare_cart_for_api(store_id, storevisit.cart, products)
+    headers = {"ETag": _get_etag(storevisit), **kwargs.pop("headers", {})}
+    items = sorted(cart["items"], key=lambda item: item["product"]["ean"])
+    return serialization.JSONResponse(
+        {
+            "store": store_url,
+            "self": request.url_for("get_store_visit", id=storevisit.id),
+            "id": str(storevisit.id),
+            "cart": {
+                "items": [
+                    _serialize_cart_product(item, store_url, product_url_prefix)
+                    for item in items
+                ],
+                "total_price": float(cart["total_price"]),
+            },
+        },
+        headers=headers,
+        **kwargs,
+    )
+
+
+def _set_read_your_writes_cookie(
+    request: fastapi.Request, response: fastapi.Response, id: uuid.UUID
+):
+    if not (window := settings.database_replica_read_your_writes_window):
+        return
+    # The cookie is scoped to the store visit and the resources under it
+    response.set_cookie(
+        _READ_YOUR_WRITES_COOKIE,
+        str(time.time() + window),
+        max_age=math.ceil(window),
+        path=urllib.parse.urlsplit(request.url_for("get_store_visit", id=id)).path,
+        httponly=True,
+        samesite="lax",
+    )
+
+
+def _is_recently_modified(request: fastapi.Request) -> bool:
+    try:
+        return float(request.cookies.get(_READ_YOUR_WRITES_COOKIE, "")) > time.time()
+    except ValueError:
+        return False
+
+
+def _get_etag(storevisit: DbStoreVisit | sqlalchemy.engine.Row) -> str:
+    return etags.make_etag(storevisit.id, storevisit.version)
+
+
+def _check_if_match(
+    request: fastapi.Request, storevisit: DbStoreVisit | sqlalchemy.engine.Row
+):
+    if (header := request.headers.get("if-match")) is not None and not etags.matches(
+        header, _get_etag(storevisit)
+    ):
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_412_PRECONDITION_FAILED,
+            detail=f"Store visit {storevisit.id!r} has been modified",
+        )
+
+
+async def _update_store_visit(
+    request: fastapi.Request,
+    storevisit: DbStoreVisit,
+    *,
+    previous: typing.Optional[DbStoreVisit] = None,
+    connection: sqlaio.AsyncConnection,
+):
+    # The version of the store visit was checked when it was read, but it may
+    # still have been modified concurrently before the update.  If the client
+    # didn't make the request conditional, it's reported as a conflict.
+    try:
+        await storevisits.update_store_visit(
+            storevisit, previous=previous, connection=connection
+        )
+    except storevisits.StoreVisitConflict as ex:
+        raise fastapi.HTTPException(
+            status_code=(
+                fastapi.status.HTTP_412_PRECONDITION_FAILED
+                if "if-match" in request.headers
+                else fastapi.status.HTTP_409_CONFLICT
+            ),
+            detail=f"Store visit {storevisit.id!r} has been modified",
+        ) from ex
+
+
 async def _read_store_visit(
-    id: uuid.UUID, *, connection: typing.Optional[sqlaio.AsyncConnection] = None
+    id: uuid.UUID,
+    *,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
 ) -> DbStoreVisit:
-    if storevisit := await storevisits.read_store_visit(id, connection=connection):
+    if storevisit := await storevisits.read_store_visit(
+        id, connection=connection, readonly=readonly
+    ):
         return storevisit
     raise fastapi.HTTPException(
         status_code=fastapi.status.HTTP_404_NOT_FOUND,
@@ -166,13 +301,6 @@ async def _read_store_visit(
     )
 
 
-async def _get_store_visit(
-    id: uuid.UUID, *, connection: typing.Optional[sqlaio.AsyncConnection] = None
-) -> dict:
-    storevisit = await _read_store_visit(id, connection=connection)
-    return _prepare_store_visit_for_api(storevisit)
-
-
 @router.get(
     "/{id}",
     response_model=StoreVisit,
@@ -180,11 +308,17 @@ async def _get_store_visit(
         fastapi.status.HTTP_404_NOT_FOUND: _RESPONSE_404,
     },
 )
-async def get_store_visit(id: uuid.UUID):
+async def get_store_visit(id: uuid.UUID, request: fastapi.Request):
     """
     Retrieve information about store visit identified by ``id``
+
+    The store visit may be read from a read replica, unless it was recently
+    modified by the same client.
     """
-    return await _get_store_visit(id)
+    storevisit = await _read_store_visit(
+        id, readonly=not _is_recently_modified(request)
+    )
+    return _serialize_store_visit(request, storevisit)
 
 
 @router.post(
@@ -193,9 +327,7 @@ async def get_store_visit(id: uuid.UUID):
     response_model=StoreVisit,
     response_description="The created store visit",
 )
-async def post_store_visit(
-    storevisit: StoreVisitCreate, response: fastapi.Response, request: fastapi.Request
-):
+async def post_store_visit(storevisit: StoreVisitCreate, request: fastapi.Request):
     """
     Create a new store visit
     """
@@ -212,10 +344,17 @@ async def post_store_visit(
         products = await _get_product_records(connection, storevisit, store_id)
         new_storevisit = _prepare_store_visit_for_db(storevisit, store_id=store.id)
         await storevisits.create_store_visit(new_storevisit, connection=connection)
-        response.headers["Location"] = request.url_for(
-            "get_store_visit", id=new_storevisit.id
+        response = _serialize_store_visit(
+            request,
+            new_storevisit,
+            products,
+            status_code=fastapi.status.HTTP_201_CREATED,
+            headers={
+                "Location": request.url_for("get_store_visit", id=new_storevisit.id)
+            },
         )
-        return _prepare_store_visit_for_api(new_storevisit, products)
+        _set_read_your_writes_cookie(request, response, new_storevisit.id)
+        return response
 
 
 @router.put(
@@ -224,17 +363,30 @@ async def post_store_visit(
     response_description="The updated store visit",
     responses={
         fastapi.status.HTTP_404_NOT_FOUND: _RESPONSE_404,
+        fastapi.status.HTTP_409_CONFLICT: {
+            "description": "The store visit was modified concurrently",
+        },
+        fastapi.status.HTTP_412_PRECONDITION_FAILED: _RESPONSE_412,
     },
 )
-async def put_store_visit(id: uuid.UUID, storevisit: StoreVisitUpdate):
+async def put_store_visit(
+    id: uuid.UUID, storevisit: StoreVisitUpdate, request: fastapi.Request
+):
     """
     Update a store visit
+
+    The update can be made conditional by including the ``ETag`` of the store
+    visit in the ``If-Match`` header.
     """
     async with db.get_connection() as connection:
         storevisit_in_db = await db.read(
             db.storevisits,
             id,
-            columns=[db.storevisits.c.store_id],
+            columns=[
+                db.storevisits.c.id,
+                db.storevisits.c.store_id,
+                db.storevisits.c.version,
+            ],
             connection=connection,
         )
         if not storevisit_in_db:
@@ -242,13 +394,16 @@ async def put_store_visit(id: uuid.UUID, storevisit: StoreVisitUpdate):
                 status_code=fastapi.status.HTTP_404_NOT_FOUND,
                 detail=f"Store visit {id=!r} not found",
             )
+        _check_if_match(request, storevisit_in_db)
         store_id = storevisit_in_db.store_id
         products = await _get_product_records(connection, storevisit, store_id)
         new_storevisit = _prepare_store_visit_for_db(
-            storevisit, id=id, store_id=store_id
+            storevisit, id=id, store_id=store_id, version=storevisit_in_db.version
         )
-        await storevisits.update_store_visit(new_storevisit, connection=connection)
-        return _prepare_store_visit_for_api(new_storevisit, products)
+        await _update_store_visit(request, new_storevisit, connection=connection)
+        response = _serialize_store_visit(request, new_storevisit, products)
+        _set_read_your_writes_cookie(request, response, id)
+        return response
 
 
 @router.patch(
@@ -258,12 +413,18 @@ async def put_store_visit(id: uuid.UUID, storevisit: StoreVisitUpdate):
     responses={
         fastapi.status.HTTP_404_NOT_FOUND: _RESPONSE_404,
         fastapi.status.HTTP_409_CONFLICT: {
-            "description": "Cannot apply the JSON patch in the body"
+            "description": """
+            Cannot apply the JSON patch in the body, or the store visit was
+            modified concurrently
+            """,
         },
+        fastapi.status.HTTP_412_PRECONDITION_FAILED: _RESPONSE_412,
     },
 )
 async def patch_store_visit(
-    id: uuid.UUID, patch: jsonpatch.JsonPatch = fastapi.Depends(_get_json_patch)
+    id: uuid.UUID,
+    request: fastapi.Request,
+    patch: jsonpatch.JsonPatch = fastapi.Depends(_get_json_patch),
 ):
     """
     Partially update a store visit
@@ -273,10 +434,14 @@ async def patch_store_visit(
     doesn't apply, or the resulting JSON document doesn't represent a valid
     store visit, the operation fails.  Fields that cannot be updated with a PUT
     request cannot be updated with a PATCH request either, and are ignored.
+
+    The update can be made conditional by including the ``ETag`` of the store
+    visit in the ``If-Match`` header.
     """
     async with db.get_connection() as connection:
-        old_storevisit_data = await _get_store_visit(id, connection=connection)
-        old_storevisit = StoreVisit(**old_storevisit_data)
+        storevisit_in_db = await _read_store_visit(id, connection=connection)
+        _check_if_match(request, storevisit_in_db)
+        old_storevisit = StoreVisit(**_prepare_store_visit_for_api(storevisit_in_db))
         store_id = old_storevisit.store.key
         try:
             new_storevisit_data = patch.apply(old_storevisit.dict())
@@ -294,10 +459,17 @@ async def patch_store_visit(
             ) from ex
         products = await _get_product_records(connection, new_storevisit, store_id)
         new_storevisit_data = _prepare_store_visit_for_db(
-            new_storevisit, id=id, store_id=store_id
+            new_storevisit, id=id, store_id=store_id, version=storevisit_in_db.version
+        )
+        await _update_store_visit(
+            request,
+            new_storevisit_data,
+            previous=storevisit_in_db,
+            connection=connection,
         )
-        await storevisits.update_store_visit(new_storevisit_data, connection=connection)
-        return _prepare_store_visit_for_api(new_storevisit_data, products)
+        response = _serialize_store_visit(request, new_storevisit_data, products)
+        _set_read_your_writes_cookie(request, response, id)
+        return response
 
 
 @router.get(
@@ -307,18 +479,48 @@ async def patch_store_visit(
         fastapi.status.HTTP_404_NOT_FOUND: _RESPONSE_404,
     },
 )
-async def get_grouped_store_visit_cart(store_visit_id: uuid.UUID):
+async def get_grouped_store_visit_cart(
+    store_visit_id: uuid.UUID,
+    request: fastapi.Request,
+    strategy: BinPackingStrategy = fastapi.Query(
+        BinPackingStrategy(settings.default_store_visit_bin_packing_strategy),
+        description="The algorithm used to group the cart",
+    ),
+    time_budget: typing.Optional[float] = fastapi.Query(
+        None,
+        gt=0,
+        le=settings.bin_packing_max_time_budget,
+        description="""
+        Maximum time (in seconds) spent searching for the optimal grouping.
+        Only applies to the ``exact`` strategy.
+        """,
+    ),
+):
     """
     Group cart (from store visit identified by ``store_visit_id``) into fixed
     bins, each having its total price capped below a given limit
     """
-    storevisit = await _read_store_visit(store_visit_id)
-    bins = storevisits.bin_pack_cart(
-        storevisit.cart, settings.default_store_visit_bin_limit
+    storevisit = await _read_store_visit(
+        store_visit_id, readonly=not _is_recently_modified(request)
+    )
+    limit = settings.default_store_visit_bin_limit
+    bin_pack_cart = functools.partial(
+        storevisits.bin_pack_cart,
+        storevisit.cart,
+        limit,
+        strategy=strategy,
+        time_budget=time_budget,
     )
+    if strategy is BinPackingStrategy.EXACT:
+        # The exact search may take the whole time budget, so it shouldn't
+        # block the event loop
+        bins = await run_in_threadpool(bin_pack_cart)
+    else:
+        bins = bin_pack_cart()
     return {
         "store_visit": store_visit_id,
         "binned_cart": [
             _prepare_cart_for_api(storevisit.store_id, cart) for cart in bins
         ],
+        "lower_bound": binpacking.get_lower_bound(storevisit.cart, limit),
     }
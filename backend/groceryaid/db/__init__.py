@@ -1,22 +1,30 @@
 """Database services"""
 
 from ._db import (
+    PoolStats,
     get_metadata,
     get_engine,
     get_connection,
+    get_pool_stats,
     init,
     stores,
     products,
+    products_fts,
+    productprices,
     storevisits,
     cartproducts,
 )
 from .utils import (
+    StatementCacheStats,
     begin_connection,
     execute,
+    stream,
     create,
     upsert,
+    bulk_upsert,
     update,
     select,
     read,
     delete,
+    get_statement_cache_stats,
 )
@@ -4,17 +4,21 @@ This module contains the basic SQLAlchemy definitions needed to setup the
 database environment.
 """
 
+import collections
+import contextlib
+import os
+import time
 import typing
 
+import pydantic
 import sqlalchemy
 import sqlalchemy.ext.asyncio as sqlaio
 import sqlalchemy_utils.types as sqlt
 
+from .. import metrics, tracing
 from ..retail import RetailChain
 from ..settings import settings
 
-_engine = sqlaio.create_async_engine(settings.database_url)
-
 _meta = sqlalchemy.MetaData()
 
 
@@ -43,6 +47,13 @@ stores = sqlalchemy.Table(
     sqlalchemy.Column("chain", sqlalchemy.Enum(RetailChain), nullable=False),
     sqlalchemy.Column("external_id", sqlalchemy.String(36), nullable=False),
     sqlalchemy.Column("name", sqlalchemy.String(255), nullable=False),
+    sqlalchemy.Column(
+        "catalog_version",
+        sqlalchemy.Integer,
+        nullable=False,
+        default=0,
+        server_default=sqlalchemy.text("0"),
+    ),
     *_get_timestamp_columns(),
     sqlalchemy.UniqueConstraint("chain", "external_id"),
 )
@@ -63,6 +74,70 @@ products = sqlalchemy.Table(
     sqlalchemy.UniqueConstraint("store_id", "ean"),
 )
 
+# The price history is append-only and grows large, so it doesn't have the
+# usual timestamp columns, and the prices are stored in integer cents.  The
+# rows are inserted in time order, which makes BRIN index on the time both
+# small and efficient.
+productprices = sqlalchemy.Table(
+    "productprices",
+    _meta,
+    sqlalchemy.Column(
+        "product_id", sqlalchemy.ForeignKey("products.id"), primary_key=True
+    ),
+    sqlalchemy.Column(
+        "valid_from", sqlalchemy.DateTime(timezone=True), primary_key=True
+    ),
+    sqlalchemy.Column("price", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Index(
+        "ix_productprices_valid_from", "valid_from", postgresql_using="brin"
+    ),
+)
+
+# The product names are indexed for full text search.  PostgreSQL indexes the
+# names directly, while SQLite (used for testing) needs a separate FTS5 table
+# kept in sync with triggers.
+
+sqlalchemy.event.listen(
+    products,
+    "after_create",
+    sqlalchemy.DDL(
+        "CREATE INDEX ix_products_name_tsvector ON products "
+        "USING gin (to_tsvector('simple'::regconfig, name))"
+    ).execute_if(dialect="postgresql"),
+)
+
+products_fts = sqlalchemy.table(
+    "products_fts",
+    sqlalchemy.column("rowid"),
+    sqlalchemy.column("rank"),
+    sqlalchemy.column("products_fts"),
+)
+
+for _statement in [
+    "CREATE VIRTUAL TABLE products_fts "
+    "USING fts5(name, content='products', content_rowid='rowid')",
+    "CREATE TRIGGER products_fts_insert AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, name) VALUES (new.rowid, new.name); END",
+    "CREATE TRIGGER products_fts_delete AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name) "
+    "VALUES ('delete', old.rowid, old.name); END",
+    "CREATE TRIGGER products_fts_update AFTER UPDATE OF name ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name) "
+    "VALUES ('delete', old.rowid, old.name); "
+    "INSERT INTO products_fts(rowid, name) VALUES (new.rowid, new.name); END",
+]:
+    sqlalchemy.event.listen(
+        products,
+        "after_create",
+        sqlalchemy.DDL(_statement).execute_if(dialect="sqlite"),
+    )
+
+sqlalchemy.event.listen(
+    products,
+    "before_drop",
+    sqlalchemy.DDL("DROP TABLE IF EXISTS products_fts").execute_if(dialect="sqlite"),
+)
+
 
 storevisits = sqlalchemy.Table(
     "storevisits",
@@ -72,6 +147,13 @@ storevisits = sqlalchemy.Table(
         "store_id",
         sqlalchemy.ForeignKey("stores.id"),
     ),
+    sqlalchemy.Column(
+        "version",
+        sqlalchemy.Integer,
+        nullable=False,
+        default=0,
+        server_default=sqlalchemy.text("0"),
+    ),
     *_get_timestamp_columns(),
 )
 
@@ -97,14 +179,203 @@ def get_metadata() -> sqlalchemy.MetaData:
     return _meta
 
 
-def get_engine() -> sqlaio.AsyncEngine:
-    """Return the default database engine"""
-    return _engine
+class PoolStats(pydantic.BaseModel):
+    """Database connection pool statistics"""
+
+    size: int = pydantic.Field(description="Number of connections kept in the pool")
+    checked_out: int = pydantic.Field(description="Number of connections in use")
+    overflow: int = pydantic.Field(
+        description="Number of connections opened beyond the pool size"
+    )
+    waiting: int = pydantic.Field(
+        description="Number of tasks waiting to check out a connection"
+    )
+    checkouts: int = pydantic.Field(
+        description="Total number of connections checked out"
+    )
+    checkout_seconds_total: float = pydantic.Field(
+        description="Total time spent waiting to check out connections"
+    )
+    checkout_seconds_max: float = pydantic.Field(
+        description="Longest time spent waiting to check out a connection"
+    )
+
+
+class _CheckoutStats:
+    def __init__(self):
+        self.waiting = 0
+        self.checkouts = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+
+
+# The engines and their checkout statistics, keyed by whether the engine is
+# for the read replica
+_engines: dict[bool, sqlaio.AsyncEngine] = {}
+_checkout_stats: collections.defaultdict[
+    bool, _CheckoutStats
+] = collections.defaultdict(_CheckoutStats)
+
+
+class SlowQuery(typing.NamedTuple):
+    """A query that took longer than the slow query threshold"""
+
+    statement: str
+    parameters: typing.Any
+    duration: float
+    request_id: typing.Optional[str]
+    database: str
+
+
+def _instrument_engine(engine: sqlaio.AsyncEngine, database: str):
+    # The start time is kept in the execution context, so that nothing is left
+    # behind in the connection if the statement fails
+    @sqlalchemy.event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        if context is not None:
+            context.query_start_time = time.perf_counter()
+
+    @sqlalchemy.event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        if (start_time := getattr(context, "query_start_time", None)) is None:
+            return
+        duration = time.perf_counter() - start_time
+        metrics.db_query_duration.labels(
+            database, metrics.get_operation(statement)
+        ).observe(duration)
+        tracing.record_statement(
+            statement, duration, **{"db.system": conn.dialect.name, "db.name": database}
+        )
+        # Only single statements can be explained
+        if (
+            (threshold := settings.database_slow_query_threshold) is not None
+            and duration >= threshold
+            and not executemany
+        ):
+            conn.info.setdefault("slow_queries", []).append(
+                SlowQuery(
+                    statement,
+                    parameters,
+                    duration,
+                    tracing.request_id.get(),
+                    database,
+                )
+            )
+
+
+def pop_slow_queries(connection: sqlaio.AsyncConnection) -> list[SlowQuery]:
+    """Return and forget the slow queries executed with ``connection``"""
+    return connection.info.pop("slow_queries", [])
+
+
+def _create_engine(url: str, database: str) -> sqlaio.AsyncEngine:
+    engine = sqlaio.create_async_engine(
+        url,
+        pool_size=settings.database_pool_size,
+        max_overflow=settings.database_max_overflow,
+        pool_timeout=settings.database_pool_timeout,
+        pool_recycle=settings.database_pool_recycle,
+        pool_pre_ping=settings.database_pool_pre_ping,
+        connect_args={
+            "prepared_statement_cache_size": settings.database_statement_cache_size
+        },
+    )
+    _instrument_engine(engine, database)
+    return engine
+
+
+def _reset_engines():
+    # The connections of the parent process must not be shared with the child
+    # process, so the child creates its own engines on first use
+    _engines.clear()
+    _checkout_stats.clear()
+
+
+os.register_at_fork(after_in_child=_reset_engines)
+
+
+def _use_replica(readonly: bool) -> bool:
+    return readonly and settings.database_replica_url is not None
+
+
+def get_engine(readonly: bool = False) -> sqlaio.AsyncEngine:
+    """Return the default database engine
+
+    The engine is created on first use, separately in each worker process.
+
+    Parameters:
+        readonly: If ``True``, return the engine for the read replica.  If no
+            read replica is configured, the primary engine is returned.
+    """
+    use_replica = _use_replica(readonly)
+    if (engine := _engines.get(use_replica)) is None:
+        engine = _engines[use_replica] = _create_engine(
+            settings.database_replica_url if use_replica else settings.database_url,
+            "replica" if use_replica else "primary",
+        )
+    return engine
+
+
+@contextlib.asynccontextmanager
+async def get_connection(
+    readonly: bool = False,
+) -> typing.AsyncIterator[sqlaio.AsyncConnection]:
+    """Return database connection
+
+    The connection is checked out from the pool of the default engine, and a
+    transaction is begun.  The time spent waiting for the connection is
+    recorded in the pool statistics.
+
+    Parameters:
+        readonly: If ``True``, the connection is to the read replica (if
+            configured).  Read-only connections may lag behind the primary.
+    """
+    stats = _checkout_stats[_use_replica(readonly)]
+    connection = get_engine(readonly).connect()
+    stats.waiting += 1
+    started_at = time.perf_counter()
+    try:
+        await connection.start()
+    finally:
+        stats.waiting -= 1
+    checkout_seconds = time.perf_counter() - started_at
+    stats.checkouts += 1
+    stats.seconds_total += checkout_seconds
+    stats.seconds_max = max(stats.seconds_max, checkout_seconds)
+    try:
+        async with connection.begin():
+            yield connection
+    finally:
+        await connection.close()
+
 
+def get_pool_stats(readonly: bool = False) -> PoolStats:
+    """Return the connection pool statistics of this worker process
 
-def get_connection() -> typing.AsyncContextManager[sqlaio.AsyncConnection]:
-    """Return database connection"""
-    return get_engine().begin()
+    Parameters:
+        readonly: If ``True``, return the statistics of the read replica pool
+    """
+    pool = get_engine(readonly).pool
+    stats = _checkout_stats[_use_replica(readonly)]
+    size = checked_out = overflow = 0
+    # Only queue pools keep track of their connections
+    if isinstance(pool, sqlalchemy.pool.QueuePool):
+        size = pool.size()
+        checked_out = pool.checkedout()
+        overflow = max(pool.overflow(), 0)
+    return PoolStats(
+        size=size,
+        checked_out=checked_out,
+        overflow=overflow,
+        waiting=stats.waiting,
+        checkouts=stats.checkouts,
+        checkout_seconds_total=stats.seconds_total,
+        checkout_seconds_max=stats.seconds_max,
+    )
 
 
 async def init():
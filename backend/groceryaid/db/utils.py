@@ -4,11 +4,14 @@ Provides wrappers for executing queries in the default database, as well as
 abstraction layer over common CRUD operations.
 """
 
+import asyncio
 import contextlib
 import functools
+import logging
 import operator
 import typing
 
+import pydantic
 import sqlalchemy
 from sqlalchemy.dialects import postgresql
 import sqlalchemy.engine
@@ -16,6 +19,10 @@ import sqlalchemy.ext.asyncio as sqlaio
 from sqlalchemy.sql.expression import ColumnElement
 
 from . import _db
+from .. import tracing
+from ..settings import settings
+
+logger = logging.getLogger(__name__)
 
 
 def _to_sequence(value):
@@ -24,21 +31,44 @@ def _to_sequence(value):
     return [value]
 
 
-def _pk_sequence_to_where_expr(
-    table: sqlalchemy.Table, pk: typing.Sequence[typing.Any]
-):
-    return functools.reduce(
-        operator.and_, (c == p for (c, p) in zip(table.primary_key, pk))
-    )
+class StatementCacheStats(pydantic.BaseModel):
+    """Statement cache statistics"""
 
+    hits: int = pydantic.Field(description="Number of statements reused")
+    misses: int = pydantic.Field(description="Number of statements constructed")
+    size: int = pydantic.Field(description="Number of statements in the cache")
 
-def _pk_to_where_expr(
-    table: sqlalchemy.Table,
-    pk: typing.Any | typing.Sequence[typing.Any] | ColumnElement,
-):
-    if isinstance(pk, ColumnElement):
-        return pk
-    return _pk_sequence_to_where_expr(table, _to_sequence(pk))
+
+_STATEMENT_CACHE_SIZE = 256
+
+_statement_builders: list[typing.Any] = []
+
+
+def _cached_statement(builder):
+    # The statements are parametrized with bind parameters, so that they can be
+    # reused, and so that SQLAlchemy can reuse their compiled forms and the
+    # database driver its prepared statements
+    cached_builder = functools.lru_cache(maxsize=_STATEMENT_CACHE_SIZE)(builder)
+    _statement_builders.append(cached_builder)
+    return cached_builder
+
+
+def _get_pk_param_name(column: sqlalchemy.Column) -> str:
+    return f"pk_{column.name}"
+
+
+def _get_pk_params(table: sqlalchemy.Table, pk: typing.Any) -> dict[str, typing.Any]:
+    return {
+        _get_pk_param_name(c): p for (c, p) in zip(table.primary_key, _to_sequence(pk))
+    }
+
+
+@_cached_statement
+def _get_pk_where_expr(table: sqlalchemy.Table):
+    return functools.reduce(
+        operator.and_,
+        (c == sqlalchemy.bindparam(_get_pk_param_name(c)) for c in table.primary_key),
+    )
 
 
 def _columns_to_select_expr(
@@ -50,35 +80,212 @@ def _columns_to_select_expr(
     return table.select()
 
 
+@_cached_statement
+def _get_select_stmt(
+    table: sqlalchemy.Table, columns: typing.Optional[tuple[sqlalchemy.Column, ...]]
+):
+    return _columns_to_select_expr(table, columns)
+
+
+@_cached_statement
+def _get_read_stmt(
+    table: sqlalchemy.Table, columns: typing.Optional[tuple[sqlalchemy.Column, ...]]
+):
+    return _get_select_stmt(table, columns).where(_get_pk_where_expr(table))
+
+
+@_cached_statement
+def _get_update_stmt(table: sqlalchemy.Table):
+    # The updated columns are inferred from the parameters
+    return table.update().where(_get_pk_where_expr(table))
+
+
+@_cached_statement
+def _get_delete_stmt(table: sqlalchemy.Table):
+    return table.delete().where(_get_pk_where_expr(table))
+
+
+def _get_on_conflict_do_update_stmt(
+    insert_stmt: postgresql.Insert,
+    table: sqlalchemy.Table,
+    column_names: typing.Iterable[str],
+):
+    pk_names = [key.name for key in table.primary_key]
+    set_ = {
+        name: insert_stmt.excluded[name]
+        for name in column_names
+        if name not in pk_names
+    }
+    set_["updated_at"] = insert_stmt.excluded.updated_at
+    return insert_stmt.on_conflict_do_update(index_elements=pk_names, set_=set_)
+
+
+@_cached_statement
+def _get_upsert_stmt(table: sqlalchemy.Table, column_names: tuple[str, ...]):
+    return _get_on_conflict_do_update_stmt(
+        postgresql.insert(table), table, column_names
+    )
+
+
+@_cached_statement
+def _get_bulk_upsert_stmt(
+    table: sqlalchemy.Table,
+    staging_table_name: str,
+    column_names: tuple[str, ...],
+):
+    staging_table = sqlalchemy.table(
+        staging_table_name, *(sqlalchemy.column(name) for name in column_names)
+    )
+    insert_stmt = postgresql.insert(table).from_select(
+        column_names, sqlalchemy.select(staging_table)
+    )
+    return _get_on_conflict_do_update_stmt(insert_stmt, table, column_names)
+
+
+def get_statement_cache_stats() -> StatementCacheStats:
+    """Return the statement cache statistics of this process
+
+    The statements constructed by the CRUD operations in this module are cached
+    and reused.
+    """
+    cache_infos = [builder.cache_info() for builder in _statement_builders]
+    return StatementCacheStats(
+        hits=sum(info.hits for info in cache_infos),
+        misses=sum(info.misses for info in cache_infos),
+        size=sum(info.currsize for info in cache_infos),
+    )
+
+
 def begin_connection(
     connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    *,
+    readonly: bool = False,
 ) -> typing.AsyncContextManager[sqlaio.AsyncConnection]:
     """Begin transaction, or continue an existing one
 
     Arguments:
         connection: Database connection, or ``None`` to use a fresh connection
 
+    Keyword Arguments:
+        readonly: If ``True`` and a fresh connection is needed, route it to the
+            read replica (if configured)
+
     Returns:
         ``connection`` wrapped in null context manager if it exists, otherwise a new
         connection
     """
     if connection:
         return contextlib.nullcontext(connection)
-    return _db.get_connection()
+    return _db.get_connection(readonly)
+
+
+# Prefixes of the statements showing the execution plans in each dialect
+_EXPLAIN_PREFIXES = {
+    "postgresql": "EXPLAIN ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+
+# The background tasks explaining slow queries, referenced until they finish
+_explain_tasks: set[asyncio.Task] = set()
+
+
+async def _explain(query: _db.SlowQuery) -> str:
+    async with _db.get_connection(query.database == "replica") as conn:
+        if (prefix := _EXPLAIN_PREFIXES.get(conn.dialect.name)) is None:
+            return ""
+        result = await conn.exec_driver_sql(
+            prefix + query.statement, [query.parameters]
+        )
+        plan = "\n".join(" ".join(str(value) for value in row) for row in result)
+        # The explanation may itself be slow
+        _db.pop_slow_queries(conn)
+        return plan
+
+
+async def _log_execution_plan(query: _db.SlowQuery, fingerprint: str):
+    try:
+        plan = await _explain(query)
+    except Exception as ex:  # pylint: disable=broad-except
+        logger.warning(
+            "Failed to explain slow query (fingerprint %s): %s", fingerprint, ex
+        )
+        return
+    logger.warning(
+        "Execution plan of slow query (request %s, fingerprint %s):\n%s",
+        query.request_id,
+        fingerprint,
+        plan,
+    )
+
+
+def _log_slow_queries(slow_queries: list[_db.SlowQuery]):
+    for query in slow_queries:
+        fingerprint = tracing.get_fingerprint(query.statement)
+        logger.warning(
+            "Slow query (request %s, %.3f s, fingerprint %s): %s",
+            query.request_id,
+            query.duration,
+            fingerprint,
+            tracing.normalize_statement(query.statement),
+        )
+        # Explaining the query in the request path would make the slow request
+        # even slower
+        if settings.database_slow_query_explain:
+            task = asyncio.create_task(_log_execution_plan(query, fingerprint))
+            _explain_tasks.add(task)
+            task.add_done_callback(_explain_tasks.discard)
 
 
 async def execute(
     *args,
     connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
     **kwargs,
 ):
     """Execute a SQL expression in the default database
 
+    The statements taking longer than
+    :attr:`Settings.database_slow_query_threshold` are logged with the id of
+    the request that executed them.  If
+    :attr:`Settings.database_slow_query_explain` is set, their execution plans
+    are logged later in the background.
+
     Keyword Arguments:
        connection: Database connection, or ``None`` to use a fresh connection
+       readonly: If ``True``, a fresh connection is routed to the read replica
     """
-    async with begin_connection(connection) as conn:
-        return await conn.execute(*args, **kwargs)
+    async with begin_connection(connection, readonly=readonly) as conn:
+        # Forget the slow queries executed outside this function
+        _db.pop_slow_queries(conn)
+        result = await conn.execute(*args, **kwargs)
+        if slow_queries := _db.pop_slow_queries(conn):
+            _log_slow_queries(slow_queries)
+        return result
+
+
+async def stream(
+    *args,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
+    **kwargs,
+) -> typing.AsyncIterator[sqlalchemy.engine.Row]:
+    """Stream the results of a SQL expression from the default database
+
+    The rows are fetched with a server-side cursor in batches of
+    :attr:`Settings.database_stream_batch_size` rows, so the memory needed
+    doesn't depend on the number of rows.  The connection is held until the
+    iteration finishes.
+
+    Keyword Arguments:
+       connection: Database connection, or ``None`` to use a fresh connection
+       readonly: If ``True``, a fresh connection is routed to the read replica
+    """
+    async with begin_connection(connection, readonly=readonly) as conn:
+        result = await conn.stream(*args, **kwargs)
+        async for rows in result.partitions(settings.database_stream_batch_size):
+            for row in rows:
+                yield row
 
 
 async def create(
@@ -115,14 +322,66 @@ async def upsert(
         connection: Database connection, or ``None`` to use a fresh connection
     """
     obj = objs if isinstance(objs, typing.Mapping) else objs[0]
-    pk_names = {key.name for key in table.primary_key}
-    insert_stmt = postgresql.insert(table)
-    set_ = {key: insert_stmt.excluded[key] for key in obj.keys() if key not in pk_names}
-    set_["updated_at"] = insert_stmt.excluded.updated_at
-    do_update_stmt = insert_stmt.on_conflict_do_update(
-        index_elements=pk_names, set_=set_
+    await execute(
+        _get_upsert_stmt(table, tuple(sorted(obj.keys()))),
+        objs,
+        connection=connection,
     )
-    await execute(do_update_stmt, objs, connection=connection)
+
+
+async def bulk_upsert(
+    table: sqlalchemy.Table,
+    objs: typing.Sequence[typing.Mapping],
+    *,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+):
+    """Upsert a large number of ``objs`` into ``table``
+
+    In PostgreSQL the objects are first copied into a temporary staging table
+    using the binary COPY protocol, and then merged into ``table`` with a single
+    statement.  In other databases this is the same as :func:`upsert()`.
+
+    If several objects have the same primary key, the last one is upserted.
+
+    Parameters:
+        table: Database table
+        objs: Objects to insert, all having the same keys
+
+    Keyword Arguments:
+        connection: Database connection, or ``None`` to use a fresh connection
+    """
+    if not objs:
+        return
+    # A single merge statement cannot affect the same row twice
+    pk_names = [key.name for key in table.primary_key]
+    objs = list({tuple(obj[name] for name in pk_names): obj for obj in objs}.values())
+    async with begin_connection(connection) as conn:
+        if conn.dialect.driver != "asyncpg":
+            await upsert(table, objs, connection=conn)
+            return
+        column_names = tuple(objs[0].keys())
+        quote = conn.dialect.identifier_preparer.quote
+        staging_table_name = f"{table.name}_staging"
+        # Issuing the statement via SQLAlchemy also makes sure that the
+        # transaction is started before accessing the driver connection
+        await conn.execute(
+            sqlalchemy.text(
+                f"CREATE TEMPORARY TABLE IF NOT EXISTS {quote(staging_table_name)} "
+                "ON COMMIT DROP AS "
+                f"SELECT {', '.join(quote(name) for name in column_names)} "
+                f"FROM {quote(table.name)} WITH NO DATA"
+            )
+        )
+        raw_connection = await conn.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            staging_table_name,
+            records=[tuple(obj[name] for name in column_names) for obj in objs],
+            columns=column_names,
+        )
+        await conn.execute(
+            _get_bulk_upsert_stmt(table, staging_table_name, column_names)
+        )
+        await conn.execute(sqlalchemy.text(f"TRUNCATE {quote(staging_table_name)}"))
 
 
 async def update(
@@ -140,11 +399,13 @@ async def update(
     Keyword Arguments:
         connection: Database connection, or ``None`` to use a fresh connection
     """
-    pk_names = {key.name for key in table.primary_key}
-    pk = [value for (key, value) in obj.items() if key in pk_names]
-    values = {key: value for (key, value) in obj.items() if key not in pk_names}
+    pk = [obj[key.name] for key in table.primary_key]
+    values = {
+        key: value for (key, value) in obj.items() if key not in table.primary_key
+    }
     await execute(
-        table.update().where(_pk_sequence_to_where_expr(table, pk)).values(**values),
+        _get_update_stmt(table),
+        {**values, **_get_pk_params(table, pk)},
         connection=connection,
     )
 
@@ -155,6 +416,7 @@ async def read(
     *,
     columns: typing.Optional[typing.Sequence[sqlalchemy.Column]] = None,
     connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
 ) -> sqlalchemy.engine.CursorResult:  # type: ignore
     """Read a row(s) from ``table`` by primary key
 
@@ -165,14 +427,25 @@ async def read(
     Keyword Arguments:
        columns: The list of columns to select (defaults to whole table)
        connection: Database connection, or ``None`` to use a fresh connection
+       readonly: If ``True``, a fresh connection is routed to the read replica
 
     Returns:
        The resulting row
     """
-    result = await execute(
-        _columns_to_select_expr(table, columns).where(_pk_to_where_expr(table, pk)),
-        connection=connection,
-    )
+    columns = tuple(columns) if columns else None
+    if isinstance(pk, ColumnElement):
+        result = await execute(
+            _get_select_stmt(table, columns).where(pk),
+            connection=connection,
+            readonly=readonly,
+        )
+    else:
+        result = await execute(
+            _get_read_stmt(table, columns),
+            _get_pk_params(table, pk),
+            connection=connection,
+            readonly=readonly,
+        )
     return result.first()
 
 
@@ -181,6 +454,7 @@ async def select(
     *,
     columns: typing.Optional[typing.Sequence[sqlalchemy.Column]] = None,
     connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
 ) -> sqlalchemy.engine.CursorResult:  # type: ignore
     """Select rows from ``table``
 
@@ -190,12 +464,15 @@ async def select(
     Keyword Arguments:
        columns: The list of columns to select (defaults to whole table)
        connection: Database connection, or `None` to use a fresh connection
+       readonly: If ``True``, a fresh connection is routed to the read replica
 
     Returns:
        The resulting rows
     """
     result = await execute(
-        _columns_to_select_expr(table, columns), connection=connection
+        _get_select_stmt(table, tuple(columns) if columns else None),
+        connection=connection,
+        readonly=readonly,
     )
     return result.fetchall()
 
@@ -216,7 +493,9 @@ async def delete(
        columns: The list of columns to select (defaults to whole table)
        connection: Database connection, or `None` to use a fresh connection
     """
-    await execute(
-        table.delete().where(_pk_to_where_expr(table, pk)),
-        connection=connection,
-    )
+    if isinstance(pk, ColumnElement):
+        await execute(table.delete().where(pk), connection=connection)
+    else:
+        await execute(
+            _get_delete_stmt(table), _get_pk_params(table, pk), connection=connection
+        )
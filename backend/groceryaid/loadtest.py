@@ -0,0 +1,316 @@
+"""Load testing
+
+The load test simulates shoppers using the store visit workflow concurrently.
+Each shopper creates a store visit, adds the products to the cart one by one
+with JSON Patch requests, occasionally retrieving the store visit in between,
+and finally groups the cart into bins.  The store visits are generated by
+:func:`retail.faker.generate_store_visits()`, so the stores and the products of
+the faker chain must exist in the database, and the faker settings must be
+the same as when they were fetched.
+
+The requests are made either directly to the ASGI application in the same
+process, or over HTTP to a running instance.
+"""
+
+import asyncio
+import collections
+import contextlib
+import json
+import logging
+import random
+import statistics
+import time
+import typing
+
+import aiohttp
+import pydantic
+
+from ._app import app
+from .retail import faker, CartProduct, StoreVisit
+
+logger = logging.getLogger(__name__)
+
+_Headers = typing.Mapping[str, str]
+
+_JSON_PATCH_HEADERS = {"content-type": "application/json-patch+json"}
+
+_JSON_HEADERS = {"content-type": "application/json"}
+
+_CREATE = "POST /storevisits"
+_ADD_PRODUCT = "PATCH /storevisits/{id}"
+_GET = "GET /storevisits/{id}"
+_GET_BINS = "GET /storevisits/{id}/bins"
+
+
+class EndpointStats(pydantic.BaseModel):
+    """Statistics of the requests to a single endpoint"""
+
+    endpoint: str = pydantic.Field(description="The method and the route")
+    requests: int = pydantic.Field(description="Number of requests")
+    errors: int = pydantic.Field(
+        description="Number of requests failed or responded with an error status"
+    )
+    throughput: float = pydantic.Field(description="Requests per second")
+    p50: float = pydantic.Field(description="Median latency (in seconds)")
+    p95: float = pydantic.Field(description="95th percentile latency (in seconds)")
+    p99: float = pydantic.Field(description="99th percentile latency (in seconds)")
+
+    @property
+    def error_rate(self) -> float:
+        """The fraction of the requests that failed"""
+        return self.errors / self.requests if self.requests else 0.0
+
+
+class LoadTestReport(pydantic.BaseModel):
+    """Outcome of a load test"""
+
+    shoppers: int = pydantic.Field(description="Number of simulated shoppers")
+    concurrency: int = pydantic.Field(description="Number of concurrent shoppers")
+    duration: float = pydantic.Field(description="Duration (in seconds)")
+    endpoints: list[EndpointStats] = pydantic.Field(
+        description="Statistics per endpoint"
+    )
+
+
+class _AsgiClient:
+    """Client calling an ASGI application directly"""
+
+    base_url = "http://testserver"
+
+    def __init__(self, app):
+        self._app = app
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        body: bytes = b"",
+        headers: typing.Optional[_Headers] = None,
+    ) -> tuple[int, bytes]:
+        """Make a request and return the status and the body of the response"""
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        raw_headers = [(k.encode(), v.encode()) for (k, v) in (headers or {}).items()]
+        status = 0
+        response_body = bytearray()
+        response_complete = asyncio.Event()
+
+        async def _receive():
+            if messages:
+                return messages.pop()
+            # The client only disconnects after receiving the response
+            await response_complete.wait()
+            return {"type": "http.disconnect"}
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_body.extend(message.get("body", b""))
+                if not message.get("more_body", False):
+                    response_complete.set()
+
+        try:
+            await self._app(
+                {
+                    "type": "http",
+                    "asgi": {"version": "3.0"},
+                    "http_version": "1.1",
+                    "method": method,
+                    "scheme": "http",
+                    "server": ("testserver", 80),
+                    "client": ("loadtest", 50000),
+                    "root_path": "",
+                    "path": path,
+                    "raw_path": path.encode(),
+                    "query_string": b"",
+                    "headers": [(b"host", b"testserver"), *raw_headers],
+                },
+                _receive,
+                _send,
+            )
+        except Exception:  # pylint: disable=broad-except
+            # The application re-raises the exception after responding with a
+            # server error, so that the server can log it.  If no response was
+            # started, the status remains zero.  Either way the request is
+            # counted as failed.
+            logger.debug("Request %s %s failed", method, path, exc_info=True)
+        return status, bytes(response_body)
+
+
+class _HttpClient:
+    """Client making requests over HTTP"""
+
+    def __init__(self, session: aiohttp.ClientSession, base_url: str):
+        self._session = session
+        self.base_url = base_url.rstrip("/")
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        body: bytes = b"",
+        headers: typing.Optional[_Headers] = None,
+    ) -> tuple[int, bytes]:
+        """Make a request and return the status and the body of the response"""
+        async with self._session.request(
+            method, self.base_url + path, data=body, headers=headers
+        ) as response:
+            return response.status, await response.read()
+
+
+class _Recorder:
+    def __init__(self):
+        self.latencies: collections.defaultdict[
+            str, list[float]
+        ] = collections.defaultdict(list)
+        self.errors: collections.Counter[str] = collections.Counter()
+
+    async def request(
+        self,
+        client: _AsgiClient | _HttpClient,
+        endpoint: str,
+        method: str,
+        path: str,
+        *,
+        body: bytes = b"",
+        headers: typing.Optional[_Headers] = None,
+    ) -> typing.Optional[bytes]:
+        started_at = time.perf_counter()
+        try:
+            status, response_body = await client.request(
+                method, path, body=body, headers=headers
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            status, response_body = 0, b""
+        self.latencies[endpoint].append(time.perf_counter() - started_at)
+        if not 200 <= status < 300:
+            self.errors[endpoint] += 1
+            return None
+        return response_body
+
+    def get_stats(self, duration: float) -> list[EndpointStats]:
+        stats = []
+        for (endpoint, latencies) in self.latencies.items():
+            if len(latencies) > 1:
+                quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+            else:
+                quantiles = latencies * 99
+            stats.append(
+                EndpointStats(
+                    endpoint=endpoint,
+                    requests=len(latencies),
+                    errors=self.errors[endpoint],
+                    throughput=len(latencies) / duration if duration else 0.0,
+                    p50=quantiles[49],
+                    p95=quantiles[94],
+                    p99=quantiles[98],
+                )
+            )
+        return stats
+
+
+def _get_cart_item(store_url: str, cartproduct: CartProduct) -> dict[str, typing.Any]:
+    if cartproduct.ean.is_variable_price():
+        # The price is encoded in the EAN code, which identifies the product
+        return {"product": cartproduct.ean, "quantity": None}
+    return {
+        "product": f"{store_url}/products/{cartproduct.ean}",
+        "quantity": cartproduct.quantity,
+    }
+
+
+async def _shop(
+    client: _AsgiClient | _HttpClient,
+    recorder: _Recorder,
+    storevisit: StoreVisit,
+    get_probability: float,
+):
+    # The decisions of each shopper are independent of the order the requests
+    # of the concurrent shoppers finish
+    rng = random.Random(storevisit.id.int)
+    store_url = f"{client.base_url}/api/v1/stores/{storevisit.store_id}"
+    response_body = await recorder.request(
+        client,
+        _CREATE,
+        "POST",
+        "/api/v1/storevisits",
+        body=json.dumps({"store": store_url}).encode(),
+        headers=_JSON_HEADERS,
+    )
+    if response_body is None:
+        return
+    path = f"/api/v1/storevisits/{json.loads(response_body)['id']}"
+    for cartproduct in storevisit.cart:
+        await recorder.request(
+            client,
+            _ADD_PRODUCT,
+            "PATCH",
+            path,
+            body=json.dumps(
+                [
+                    {
+                        "op": "add",
+                        "path": "/cart/items/-",
+                        "value": _get_cart_item(store_url, cartproduct),
+                    }
+                ]
+            ).encode(),
+            headers=_JSON_PATCH_HEADERS,
+        )
+        if rng.random() < get_probability:
+            await recorder.request(client, _GET, "GET", path)
+    await recorder.request(client, _GET_BINS, "GET", f"{path}/bins")
+
+
+async def run_load_test(
+    *,
+    shoppers: int,
+    concurrency: int,
+    url: typing.Optional[str] = None,
+    seed: int = 0,
+    get_probability: float = 0.2,
+) -> LoadTestReport:
+    """Run a load test
+
+    Keyword Arguments:
+        shoppers: The number of shoppers, each making one store visit
+        concurrency: The number of shoppers making requests concurrently
+        url: The base URL of the instance under test, or ``None`` to call the
+            ASGI application in this process
+        seed: The seed of the generated store visits
+        get_probability: The probability of a shopper retrieving the store
+            visit after adding a product
+
+    Returns:
+        The statistics of the requests made by the shoppers
+    """
+    recorder = _Recorder()
+    storevisits = faker.generate_store_visits(shoppers, seed=seed)
+
+    async with contextlib.AsyncExitStack() as stack:
+        client: _AsgiClient | _HttpClient
+        if url is None:
+            client = _AsgiClient(app)
+        else:
+            session = await stack.enter_async_context(
+                aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency))
+            )
+            client = _HttpClient(session, url)
+
+        async def _run_shoppers():
+            for storevisit in storevisits:
+                await _shop(client, recorder, storevisit, get_probability)
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(_run_shoppers() for _ in range(concurrency)))
+        duration = time.perf_counter() - started_at
+
+    return LoadTestReport(
+        shoppers=shoppers,
+        concurrency=concurrency,
+        duration=duration,
+        endpoints=recorder.get_stats(duration),
+    )
@@ -0,0 +1,151 @@
+"""Prometheus metrics
+
+The metrics are collected separately by each process.  When the application is
+served by multiple worker processes, the ``PROMETHEUS_MULTIPROC_DIR``
+environment variable must point to a directory shared by the processes (see
+``gunicorn.conf.py``).  The processes then write their metrics to the
+directory, and the metrics of all processes are aggregated when they are
+exposed.  The directory may also be shared with the command line tasks run in
+other containers (see ``docker-compose.yml``).
+"""
+
+import os
+import socket
+import time
+import typing
+
+import prometheus_client
+from prometheus_client import multiprocess, values
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST
+
+_UNMATCHED_ROUTE = "<unmatched>"
+
+
+def get_process_identifier(pid: typing.Optional[int] = None) -> str:
+    """Return the identifier of a process in the metrics directory
+
+    The processes in different containers may have the same process id, so the
+    identifier also includes the host name.
+
+    Parameters:
+        pid: The process id, or ``None`` for the current process
+    """
+    return f"{socket.gethostname()}_{os.getpid() if pid is None else pid}"
+
+
+# The value class must be replaced before any metrics are created
+if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+    values.ValueClass = values.MultiProcessValue(get_process_identifier)
+
+http_requests = prometheus_client.Counter(
+    "groceryaid_http_requests_total",
+    "Number of HTTP requests handled",
+    ["method", "route", "status"],
+)
+
+http_request_duration = prometheus_client.Histogram(
+    "groceryaid_http_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ["method", "route"],
+)
+
+http_requests_in_progress = prometheus_client.Gauge(
+    "groceryaid_http_requests_in_progress",
+    "Number of HTTP requests being handled",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+
+db_query_duration = prometheus_client.Histogram(
+    "groceryaid_db_query_duration_seconds",
+    "Time spent executing database queries",
+    ["database", "operation"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+fetch_pages = prometheus_client.Counter(
+    "groceryaid_fetch_pages_total",
+    "Number of product pages fetched from retail chains",
+    ["chain", "store"],
+)
+
+fetch_products = prometheus_client.Counter(
+    "groceryaid_fetch_products_total",
+    "Number of products fetched from retail chains",
+    ["chain", "store"],
+)
+
+fetch_errors = prometheus_client.Counter(
+    "groceryaid_fetch_errors_total",
+    "Number of failed attempts to fetch stores from retail chains",
+    ["chain", "store"],
+)
+
+
+def _get_route(scope: Scope) -> str:
+    # The route template is used instead of the path to keep the number of
+    # distinct label values bounded
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match is not Match.NONE:
+            return route.path
+    return _UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """ASGI middleware collecting the HTTP request metrics
+
+    Parameters:
+        app: The ASGI application
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = _get_route(scope)
+        # If the response is never started, the application failed
+        status = 500
+
+        async def _send(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = http_requests_in_progress.labels(method, route)
+        in_progress.inc()
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            http_request_duration.labels(method, route).observe(
+                time.perf_counter() - start_time
+            )
+            http_requests.labels(method, route, str(status)).inc()
+            in_progress.dec()
+
+
+def get_operation(statement: str) -> str:
+    """Return the operation (``SELECT``, ``INSERT`` etc.) of a SQL statement"""
+    # Only the beginning of the statement is split, since it may be long
+    words = statement[:32].split(maxsplit=1)
+    return words[0].upper() if words else ""
+
+
+def generate_latest() -> bytes:
+    """Return the metrics of all processes in the Prometheus text format"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry)
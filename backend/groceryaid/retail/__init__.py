@@ -11,4 +11,7 @@ from .common import (
     Ean,
     Price,
     Quantity,
+    to_cents,
+    from_cents,
 )
+from .binpacking import BinPackingStrategy
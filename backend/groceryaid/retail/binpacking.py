@@ -0,0 +1,257 @@
+"""Bin packing of carts
+
+The bins are carts whose total price is capped below a given limit.  The
+engine supports several strategies trading the quality of the packing for
+speed:
+
+* :attr:`BinPackingStrategy.GREEDY` is a simple first fit decreasing algorithm
+
+* :attr:`BinPackingStrategy.BEST_FIT` is a best fit decreasing algorithm that
+  keeps the residual capacities of the bins in sorted order
+
+* :attr:`BinPackingStrategy.EXACT` is a branch and bound search for the
+  optimal packing.  It is only attempted for small carts, and the search is
+  cut short when the time budget is exhausted, in which case the best packing
+  found so far is returned.
+
+All strategies work on prices in integer cents.
+"""
+
+import bisect
+import decimal
+import enum
+import time
+import typing
+
+from .common import CartProduct, to_cents
+from ..settings import settings
+
+
+class BinPackingStrategy(enum.Enum):
+    """Algorithm used to pack a cart into bins"""
+
+    GREEDY = "greedy"
+    BEST_FIT = "best_fit"
+    EXACT = "exact"
+
+
+class _Item(typing.NamedTuple):
+    cartproduct: CartProduct
+    size: int
+    count: int
+
+
+# Maps item index to the number of units of the item in the bin
+_Bin = dict[int, int]
+
+
+class _SearchFinished(Exception):
+    pass
+
+
+def _get_items(
+    cart: typing.Iterable[CartProduct], limit: int
+) -> tuple[list[_Item], list[CartProduct]]:
+    items = []
+    oversized_cartproducts = []
+    for cartproduct in cart:
+        assert cartproduct.price is not None
+        size = to_cents(cartproduct.price)
+        if size > limit:
+            oversized_cartproducts.append(cartproduct)
+        else:
+            items.append(_Item(cartproduct, size, cartproduct.quantity or 1))
+    items.sort(key=lambda item: -item.size)
+    oversized_cartproducts.sort(key=lambda cartproduct: -cartproduct.price)  # type: ignore
+    return items, oversized_cartproducts
+
+
+def _get_lower_bound(items: list[_Item], limit: int) -> int:
+    if not items:
+        return 0
+    if not limit:
+        return 1
+    total_size = sum(item.size * item.count for item in items)
+    return max(1, -(-total_size // limit))
+
+
+def _pack_greedy(items: list[_Item], limit: int) -> list[_Bin]:
+    bins: list[_Bin] = []
+    counts_remaining = [item.count for item in items]
+    n_units_remaining = sum(counts_remaining)
+    while n_units_remaining:
+        bin_: _Bin = {}
+        residual = limit
+        for item_index, item in enumerate(items):
+            if (count := counts_remaining[item_index]) and item.size <= residual:
+                n_units = min(count, residual // item.size) if item.size else count
+                bin_[item_index] = n_units
+                counts_remaining[item_index] -= n_units
+                n_units_remaining -= n_units
+                residual -= n_units * item.size
+        bins.append(bin_)
+    return bins
+
+
+def _pack_best_fit(items: list[_Item], limit: int) -> list[_Bin]:
+    bins: list[_Bin] = []
+    # Residual capacities of the bins as (capacity, bin index) pairs in
+    # ascending order
+    residuals: list[tuple[int, int]] = []
+    for item_index, item in enumerate(items):
+        count = item.count
+        while count:
+            i = bisect.bisect_left(residuals, (item.size, -1))
+            if i < len(residuals):
+                residual, bin_index = residuals.pop(i)
+            else:
+                residual, bin_index = limit, len(bins)
+                bins.append({})
+            n_units = min(count, residual // item.size) if item.size else count
+            bins[bin_index][item_index] = n_units
+            count -= n_units
+            bisect.insort(residuals, (residual - n_units * item.size, bin_index))
+    return bins
+
+
+def _pack_exact(items: list[_Item], limit: int, deadline: float) -> list[_Bin]:
+    best_bins = _pack_best_fit(items, limit)
+    lower_bound = _get_lower_bound(items, limit)
+    if len(best_bins) <= lower_bound:
+        return best_bins
+
+    units = [
+        (item_index, item.size)
+        for (item_index, item) in enumerate(items)
+        for _ in range(item.count)
+    ]
+    # remaining_sizes[i] is the total size of units[i:]
+    remaining_sizes = [0] * (len(units) + 1)
+    for i in reversed(range(len(units))):
+        remaining_sizes[i] = remaining_sizes[i + 1] + units[i][1]
+    assignment = [0] * len(units)
+    residuals: list[int] = []
+    n_nodes = 0
+
+    def _record_solution():
+        nonlocal best_bins
+        best_bins = [{} for _ in residuals]
+        for (item_index, _), bin_index in zip(units, assignment):
+            bin_ = best_bins[bin_index]
+            bin_[item_index] = bin_.get(item_index, 0) + 1
+        if len(best_bins) <= lower_bound:
+            raise _SearchFinished()
+
+    def _search(i: int, free_capacity: int):
+        nonlocal n_nodes
+        n_nodes += 1
+        if not n_nodes % 256 and time.monotonic() > deadline:
+            raise _SearchFinished()
+        if i == len(units):
+            _record_solution()
+            return
+        n_bins_needed = len(residuals)
+        if (overflow := remaining_sizes[i] - free_capacity) > 0:
+            n_bins_needed += -(-overflow // limit)
+        if n_bins_needed >= len(best_bins):
+            return
+        item_index, size = units[i]
+        # Units of the same item are interchangeable, so it's enough to
+        # consider assignments where their bin indices are non-decreasing
+        first_bin_index = (
+            assignment[i - 1] if i and units[i - 1][0] == item_index else 0
+        )
+        # Bins with equal residual capacity are interchangeable
+        residuals_tried = set()
+        for bin_index in range(first_bin_index, len(residuals)):
+            residual = residuals[bin_index]
+            if residual >= size and residual not in residuals_tried:
+                residuals_tried.add(residual)
+                residuals[bin_index] -= size
+                assignment[i] = bin_index
+                _search(i + 1, free_capacity - size)
+                residuals[bin_index] += size
+        if len(residuals) + 1 < len(best_bins):
+            residuals.append(limit - size)
+            assignment[i] = len(residuals) - 1
+            _search(i + 1, free_capacity + limit - size)
+            residuals.pop()
+
+    try:
+        _search(0, 0)
+    except _SearchFinished:
+        pass
+    return best_bins
+
+
+def _bin_to_cart(items: list[_Item], bin_: _Bin) -> list[CartProduct]:
+    cart = []
+    for item_index, n_units in bin_.items():
+        cartproduct = items[item_index].cartproduct
+        if cartproduct.quantity is not None and cartproduct.quantity != n_units:
+            cartproduct = cartproduct.copy(update={"quantity": n_units})
+        cart.append(cartproduct)
+    return cart
+
+
+def pack(
+    cart: list[CartProduct],
+    limit: decimal.Decimal,
+    *,
+    strategy: BinPackingStrategy = BinPackingStrategy.GREEDY,
+    time_budget: typing.Optional[float] = None,
+) -> list[list[CartProduct]]:
+    """Pack cart into bins
+
+    Groups the given ``cart`` into multiple bins in such a way that the total
+    price of each cart remains below ``limit``.
+
+    All the products whose price is higher than ``limit`` (and thus couldn't
+    normally be placed in any bin) are returned as part of the last bin.
+
+    Parameters:
+        cart: A list of cart products
+        limit: The target price limit per bin
+
+    Keyword Arguments:
+        strategy: The bin packing algorithm
+        time_budget: The maximum time (in seconds) spent searching for the
+            optimal packing when using the exact strategy (defaults to the
+            value in settings)
+
+    Returns:
+        A list of lists of cart products, each containing one bin
+    """
+    limit_in_cents = to_cents(limit)
+    items, oversized_cartproducts = _get_items(cart, limit_in_cents)
+    if strategy is BinPackingStrategy.GREEDY:
+        bins = _pack_greedy(items, limit_in_cents)
+    elif (
+        strategy is BinPackingStrategy.EXACT
+        and sum(item.count for item in items) <= settings.bin_packing_exact_max_units
+    ):
+        if time_budget is None:
+            time_budget = settings.default_store_visit_bin_packing_time_budget
+        bins = _pack_exact(items, limit_in_cents, time.monotonic() + time_budget)
+    else:
+        bins = _pack_best_fit(items, limit_in_cents)
+    carts = [_bin_to_cart(items, bin_) for bin_ in bins]
+    if oversized_cartproducts:
+        carts.append(oversized_cartproducts)
+    return carts
+
+
+def get_lower_bound(cart: list[CartProduct], limit: decimal.Decimal) -> int:
+    """Return lower bound for the number of bins needed to pack ``cart``
+
+    The lower bound is the total price of the cart divided by ``limit``,
+    rounded up.  The products whose price is higher than ``limit`` are counted
+    as one additional bin, as that's how they are returned by :func:`pack()`.
+
+    Parameters:
+        cart: A list of cart products
+        limit: The target price limit per bin
+    """
+    limit_in_cents = to_cents(limit)
+    items, oversized_cartproducts = _get_items(cart, limit_in_cents)
+    return _get_lower_bound(items, limit_in_cents) + bool(oversized_cartproducts)
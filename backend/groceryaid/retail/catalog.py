@@ -0,0 +1,478 @@
+"""Product catalog
+
+The products of a store only change when they are fetched from the retail
+chain, but they are read on almost every request.  This module caches the
+products in the memory of the worker process.
+
+Each store has a catalog version that is bumped whenever its products change.
+The cached products are stamped with the catalog version they were read with,
+and the catalog version is re-read from the database once it is older than
+:attr:`Settings.product_cache_version_ttl`.  That way all worker processes pick
+up the changed products without needing to be restarted.
+"""
+
+import collections
+import re
+import time
+import typing
+import uuid
+
+import pydantic
+import sqlalchemy
+import sqlalchemy.ext.asyncio as sqlaio
+
+from .common import Ean
+from .. import db
+from ..settings import settings
+
+ProductRecord = typing.Mapping[str, typing.Any]
+
+# Position of a product in the search results, consisting of its score and EAN
+SearchPosition = tuple[float, str]
+
+_ProductKey = tuple[uuid.UUID, str]
+
+
+class ProductCacheStats(pydantic.BaseModel):
+    """Product cache statistics"""
+
+    hits: int = pydantic.Field(description="Number of products found in the cache")
+    misses: int = pydantic.Field(
+        description="Number of products read from the database"
+    )
+    evictions: int = pydantic.Field(
+        description="Number of products evicted to keep the cache within its size"
+    )
+    size: int = pydantic.Field(description="Number of products in the cache")
+    max_size: int = pydantic.Field(description="Maximum number of cached products")
+
+
+class ProductCache:
+    """Least recently used cache of products
+
+    Parameters:
+        max_size: The maximum number of products in the cache
+        version_ttl: The time (in seconds) catalog versions are cached
+    """
+
+    def __init__(self, max_size: int, version_ttl: float):
+        self.max_size = max_size
+        self.version_ttl = version_ttl
+        self._products: collections.OrderedDict[
+            _ProductKey, tuple[int, ProductRecord]
+        ] = collections.OrderedDict()
+        self._versions: dict[uuid.UUID, tuple[int, float]] = {}
+        self._all_versions: typing.Optional[tuple[dict[uuid.UUID, int], float]] = None
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_version(self, store_id: uuid.UUID) -> typing.Optional[int]:
+        """Return the cached catalog version, or ``None`` if it has expired"""
+        if (entry := self._versions.get(store_id)) is not None:
+            version, expires_at = entry
+            if time.monotonic() < expires_at:
+                return version
+            del self._versions[store_id]
+        return None
+
+    def set_version(self, store_id: uuid.UUID, version: int):
+        """Cache the catalog version of a store"""
+        self._versions[store_id] = version, time.monotonic() + self.version_ttl
+
+    def get_all_versions(self) -> typing.Optional[dict[uuid.UUID, int]]:
+        """Return the cached catalog versions of all stores, or ``None`` if they
+        have expired"""
+        if self._all_versions is not None:
+            versions, expires_at = self._all_versions
+            if time.monotonic() < expires_at:
+                return versions
+            self._all_versions = None
+        return None
+
+    def set_all_versions(self, versions: dict[uuid.UUID, int]):
+        """Cache the catalog versions of all stores"""
+        self._all_versions = versions, time.monotonic() + self.version_ttl
+        for store_id, version in versions.items():
+            self.set_version(store_id, version)
+
+    def get(
+        self, store_id: uuid.UUID, ean: str, version: int
+    ) -> typing.Optional[ProductRecord]:
+        """Return cached product, or ``None`` if the product is not cached
+
+        A product cached with an older catalog version is considered missing.
+        """
+        key = (store_id, ean)
+        if (entry := self._products.get(key)) is not None and entry[0] == version:
+            self._products.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+        self._misses += 1
+        return None
+
+    def put(self, store_id: uuid.UUID, ean: str, version: int, product: ProductRecord):
+        """Cache a product read with the given catalog version"""
+        if not self.max_size:
+            return
+        key = (store_id, ean)
+        self._products[key] = version, product
+        self._products.move_to_end(key)
+        while len(self._products) > self.max_size:
+            self._products.popitem(last=False)
+            self._evictions += 1
+
+    def get_stats(self) -> ProductCacheStats:
+        """Return the cache statistics"""
+        return ProductCacheStats(
+            hits=self._hits,
+            misses=self._misses,
+            evictions=self._evictions,
+            size=len(self._products),
+            max_size=self.max_size,
+        )
+
+
+def _create_cache() -> ProductCache:
+    return ProductCache(
+        max_size=settings.product_cache_max_size,
+        version_ttl=settings.product_cache_version_ttl,
+    )
+
+
+_cache = _create_cache()
+
+
+def clear_cache():
+    """Clear the product cache and its statistics"""
+    global _cache  # pylint: disable=global-statement,invalid-name
+    _cache = _create_cache()
+
+
+def get_cache_stats() -> ProductCacheStats:
+    """Return the product cache statistics of this worker"""
+    return _cache.get_stats()
+
+
+async def get_catalog_version(
+    store_id: uuid.UUID,
+    *,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
+) -> typing.Optional[int]:
+    """Get the catalog version of a store
+
+    The catalog version is cached, and may lag behind the database by
+    :attr:`Settings.product_cache_version_ttl`.
+
+    Parameters:
+        store_id: The store id
+
+    Keyword Arguments:
+        connection: Database connection, or ``None`` to use a fresh connection
+        readonly: If ``True``, a fresh connection is routed to the read replica
+
+    Returns:
+        The catalog version, or ``None`` if the store is unknown
+    """
+    if (version := _cache.get_version(store_id)) is None:
+        store = await db.read(
+            db.stores,
+            store_id,
+            columns=[db.stores.c.catalog_version],
+            connection=connection,
+            readonly=readonly,
+        )
+        if store is None:
+            return None
+        version = store.catalog_version
+        _cache.set_version(store_id, version)
+    return version
+
+
+async def get_catalog_versions(
+    *,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
+) -> dict[uuid.UUID, int]:
+    """Get the catalog versions of all stores
+
+    The catalog versions are cached, and may lag behind the database by
+    :attr:`Settings.product_cache_version_ttl`.
+
+    Keyword Arguments:
+        connection: Database connection, or ``None`` to use a fresh connection
+        readonly: If ``True``, a fresh connection is routed to the read replica
+
+    Returns:
+        A mapping from store ids to catalog versions
+    """
+    if (versions := _cache.get_all_versions()) is None:
+        stores = await db.select(
+            db.stores,
+            columns=[db.stores.c.id, db.stores.c.catalog_version],
+            connection=connection,
+            readonly=readonly,
+        )
+        versions = {store.id: store.catalog_version for store in stores}
+        _cache.set_all_versions(versions)
+    return versions
+
+
+async def get_products(
+    store_id: uuid.UUID,
+    eans: typing.Iterable[Ean],
+    *,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
+) -> dict[str, ProductRecord]:
+    """Get products from the catalog of a store
+
+    Parameters:
+        store_id: The store id
+        eans: The EAN codes of the products, in the normalized database format
+
+    Keyword Arguments:
+        connection: Database connection, or ``None`` to use a fresh connection
+        readonly: If ``True``, a fresh connection is routed to the read replica
+
+    Returns:
+        A mapping from EAN codes to products containing ``ean``, ``name`` and
+        ``price``.  Unknown products are omitted.
+    """
+    products: dict[str, ProductRecord] = {}
+    version = await get_catalog_version(
+        store_id, connection=connection, readonly=readonly
+    )
+    if version is None:
+        return products
+    missing_eans = []
+    for ean in set(eans):
+        if (product := _cache.get(store_id, ean, version)) is not None:
+            products[ean] = product
+        else:
+            missing_eans.append(ean)
+    if missing_eans:
+        result = await db.execute(
+            sqlalchemy.select(
+                [db.products.c.ean, db.products.c.name, db.products.c.price]
+            ).where(
+                db.products.c.store_id == store_id,
+                db.products.c.ean.in_(missing_eans),
+            ),
+            connection=connection,
+            readonly=readonly,
+        )
+        for row in result:
+            product = dict(row)
+            _cache.put(store_id, row.ean, version, product)
+            products[row.ean] = product
+    return products
+
+
+async def get_product(
+    store_id: uuid.UUID,
+    ean: Ean,
+    *,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
+) -> typing.Optional[ProductRecord]:
+    """Get a single product from the catalog of a store
+
+    Parameters:
+        store_id: The store id
+        ean: The EAN code of the product, in the normalized database format
+
+    Keyword Arguments:
+        connection: Database connection, or ``None`` to use a fresh connection
+        readonly: If ``True``, a fresh connection is routed to the read replica
+
+    Returns:
+        The product containing ``ean``, ``name`` and ``price``, or ``None`` if
+        the product is unknown
+    """
+    products = await get_products(
+        store_id, [ean], connection=connection, readonly=readonly
+    )
+    return products.get(ean)
+
+
+async def bump_catalog_version(
+    store_id: uuid.UUID,
+    *,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+):
+    """Bump the catalog version of a store
+
+    This needs to be called whenever the products of the store change, to
+    invalidate the products cached by the worker processes.
+
+    Parameters:
+        store_id: The store id
+
+    Keyword Arguments:
+        connection: Database connection, or ``None`` to use a fresh connection
+    """
+    await db.execute(
+        db.stores.update()
+        .where(db.stores.c.id == store_id)
+        .values(catalog_version=db.stores.c.catalog_version + 1),
+        connection=connection,
+    )
+
+
+def _get_list_products_stmt(store_id: uuid.UUID):
+    return (
+        sqlalchemy.select([db.products.c.ean, db.products.c.name, db.products.c.price])
+        .where(db.products.c.store_id == store_id)
+        .order_by(db.products.c.ean)
+    )
+
+
+async def list_products(
+    store_id: uuid.UUID,
+    *,
+    limit: int,
+    after: typing.Optional[str] = None,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
+) -> list[ProductRecord]:
+    """List products from the catalog of a store ordered by EAN code
+
+    Parameters:
+        store_id: The store id
+
+    Keyword Arguments:
+        limit: The maximum number of products returned
+        after: The EAN code of the last product of the previous page
+        connection: Database connection, or ``None`` to use a fresh connection
+        readonly: If ``True``, a fresh connection is routed to the read replica
+
+    Returns:
+        A list of products containing ``ean``, ``name`` and ``price``
+    """
+    stmt = _get_list_products_stmt(store_id)
+    if after is not None:
+        stmt = stmt.where(db.products.c.ean > after)
+    result = await db.execute(
+        stmt.limit(limit), connection=connection, readonly=readonly
+    )
+    return [dict(row) for row in result]
+
+
+async def stream_products(
+    store_id: uuid.UUID,
+    *,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
+) -> typing.AsyncIterator[ProductRecord]:
+    """Stream all products from the catalog of a store ordered by EAN code
+
+    Unlike :func:`list_products()`, the products are streamed from the database
+    with a server-side cursor, so that the whole catalog is never held in
+    memory.
+
+    Parameters:
+        store_id: The store id
+
+    Keyword Arguments:
+        connection: Database connection, or ``None`` to use a fresh connection
+        readonly: If ``True``, a fresh connection is routed to the read replica
+    """
+    async for row in db.stream(
+        _get_list_products_stmt(store_id), connection=connection, readonly=readonly
+    ):
+        yield row
+
+
+_SEARCH_TERM_PATTERN = re.compile(r"\w+")
+
+
+def _get_search_clauses(dialect_name: str, terms: list[str]):
+    # Returns the FROM clause, the score and the filter of the search.  Each
+    # term is matched as prefix, so that the results can be updated while the
+    # user is typing.  The terms consist of word characters only, so they can be
+    # embedded to the query syntax of both databases.
+    if dialect_name == "sqlite":
+        fts_query = " ".join(f'"{term}"*' for term in terms)
+        return (
+            db.products.join(
+                db.products_fts,
+                db.products_fts.c.rowid == sqlalchemy.literal_column("products.rowid"),
+            ),
+            # The rank of FTS5 is better the lower it is
+            -db.products_fts.c.rank,
+            db.products_fts.c.products_fts.op("MATCH")(fts_query),
+        )
+    config = sqlalchemy.literal_column("'simple'::regconfig")
+    # The expression must match the index expression exactly
+    document = sqlalchemy.func.to_tsvector(config, db.products.c.name)
+    tsquery = sqlalchemy.func.to_tsquery(
+        config, " & ".join(f"{term}:*" for term in terms)
+    )
+    return (
+        db.products,
+        sqlalchemy.func.ts_rank(document, tsquery),
+        document.op("@@")(tsquery),
+    )
+
+
+async def search_products(
+    store_id: uuid.UUID,
+    query: str,
+    *,
+    limit: int,
+    after: typing.Optional[SearchPosition] = None,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
+) -> list[ProductRecord]:
+    """Search products by name from the catalog of a store
+
+    The products whose name contains words starting with each word in
+    ``query`` are returned, the best matches first.  The search is backed by
+    the full text search index of the database.
+
+    Parameters:
+        store_id: The store id
+        query: The search query
+
+    Keyword Arguments:
+        limit: The maximum number of products returned
+        after: The position of the last product of the previous page, to
+            continue the search from
+        connection: Database connection, or ``None`` to use a fresh connection
+        readonly: If ``True``, a fresh connection is routed to the read replica
+
+    Returns:
+        A list of products containing ``ean``, ``name``, ``price`` and
+        ``score``.  The position of a product is ``(score, ean)``.
+    """
+    if not (terms := _SEARCH_TERM_PATTERN.findall(query.lower())):
+        return []
+    async with db.begin_connection(connection, readonly=readonly) as conn:
+        from_, score, filter_ = _get_search_clauses(conn.dialect.name, terms)
+        matches = (
+            sqlalchemy.select(
+                [
+                    db.products.c.ean,
+                    db.products.c.name,
+                    db.products.c.price,
+                    score.label("score"),
+                ]
+            )
+            .select_from(from_)
+            .where(db.products.c.store_id == store_id, filter_)
+            .subquery()
+        )
+        stmt = sqlalchemy.select(matches)
+        if after is not None:
+            after_score, after_ean = after
+            stmt = stmt.where(
+                (matches.c.score < after_score)
+                | ((matches.c.score == after_score) & (matches.c.ean > after_ean))
+            )
+        result = await db.execute(
+            stmt.order_by(matches.c.score.desc(), matches.c.ean).limit(limit),
+            connection=conn,
+        )
+        return [dict(row) for row in result]
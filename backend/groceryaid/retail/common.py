@@ -2,6 +2,7 @@
 
 import decimal
 import enum
+import math
 import uuid
 import re
 import typing
@@ -47,6 +48,34 @@ else:
     Quantity = pydantic.conint(ge=1, le=999)
 
 
+def to_cents(amount: decimal.Decimal) -> int:
+    """Convert monetary amount to integer cents
+
+    Internally prices are aggregated in integer cents, which is considerably
+    faster than decimal arithmetic.  Amounts with sub-cent precision are rounded
+    down.
+    """
+    return math.floor(amount * 100)
+
+
+def from_cents(cents: int) -> Price:
+    """Convert integer cents to monetary amount"""
+    return decimal.Decimal(cents).scaleb(-2)
+
+
+_ZERO = ord("0")
+
+# The sum of the ASCII offsets of the weighted digits in a 12 letter EAN prefix
+_CHECKSUM_OFFSET = _ZERO * (6 + 3 * 6)
+
+
+def _calculate_check_digit(prefix: bytes) -> int:
+    # Summing the slices of ASCII encoded digits runs in C, which makes this
+    # considerably faster than converting the digits to int one by one
+    checksum = sum(prefix[0:12:2]) + 3 * sum(prefix[1:12:2]) - _CHECKSUM_OFFSET
+    return -checksum % 10
+
+
 class Ean(str):
     """EAN code"""
 
@@ -99,13 +128,7 @@ class Ean(str):
     @staticmethod
     def calculate_check_digit(prefix: str) -> str:
         """Calculates check digit for 12 letter EAN prefix"""
-        checksum = sum(int(c) for c in prefix[0::2]) + 3 * sum(
-            int(c) for c in prefix[1::2]
-        )
-        checksum %= 10
-        if checksum == 0:
-            return "0"
-        return str(10 - checksum)
+        return str(_calculate_check_digit(prefix.encode("ascii")))
 
     @classmethod
     def from_prefix(cls, prefix: str) -> "Ean":
@@ -114,13 +137,44 @@ class Ean(str):
 
     @classmethod
     def validate(cls, value: str):
-        if (
-            not cls.pattern.fullmatch(value)
-            or cls.calculate_check_digit(value[:12]) != value[12]
-        ):
+        if not cls._is_valid(value):
             raise ValueError(f"{value!r} is not valid EAN number")
         return cls(value)
 
+    @classmethod
+    def normalize_many(cls, eans: typing.Iterable["Ean"]) -> list["Ean"]:
+        """Return a batch of EANs in normalized database format
+
+        This is equivalent to calling :meth:`get_ean_for_query()` for each EAN,
+        but faster for large batches.
+        """
+        normalized_prefixes: dict[str, Ean] = {}
+        normalized_eans = []
+        for ean in eans:
+            if ean.startswith("2"):
+                prefix = ean[:8]
+                if (normalized_ean := normalized_prefixes.get(prefix)) is None:
+                    normalized_ean = normalized_prefixes[prefix] = cls.from_prefix(
+                        prefix + "0000"
+                    )
+                normalized_eans.append(normalized_ean)
+            else:
+                normalized_eans.append(ean)
+        return normalized_eans
+
+    @classmethod
+    def _is_valid(cls, value: str) -> bool:
+        # The length and ASCII checks make the encoding safe, and the
+        # comparison of the check digits in ASCII avoids converting the last
+        # digit to int
+        return (
+            len(value) == 13
+            and value.isascii()
+            and value.isdigit()
+            and (encoded_value := value.encode("ascii"))[12]
+            == _ZERO + _calculate_check_digit(encoded_value)
+        )
+
     @classmethod
     def __get_validators__(cls):
         yield cls.validate
@@ -189,16 +243,27 @@ class CartProduct(pydantic.BaseModel):
         """
         return self.quantity is None
 
+    def get_total_price_in_cents(self) -> typing.Optional[int]:
+        """Return the total price of the cart product in cents, if known"""
+        if self.price is not None:
+            return (self.quantity or 1) * to_cents(self.price)
+        return None
+
     def get_total_price(self) -> typing.Optional[Price]:
         """Return the total price of the cart product, if known"""
-        if self.price is not None:
-            return (self.quantity or 1) * self.price
+        if (total_price := self.get_total_price_in_cents()) is not None:
+            return from_cents(total_price)
         return None
 
 
 class StoreVisit(pydantic.BaseModel):
-    """State of a single store visit"""
+    """State of a single store visit
+
+    The version is incremented whenever the store visit is updated, and used to
+    detect concurrent updates.
+    """
 
     id: uuid.UUID = pydantic.Field(default_factory=uuid.uuid4)
     store_id: uuid.UUID
     cart: list[CartProduct]
+    version: int = 0
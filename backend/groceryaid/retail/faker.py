@@ -1,11 +1,36 @@
-"""Utilities for generating fake store and product data for testing and development"""
+"""Utilities for generating fake store and product data for testing and development
+
+The module contains two kinds of generators:
+
+* The factories generate random objects for tests.  They require the
+  ``factory_boy`` package.
+
+* The faker retail chain generates a synthetic catalog, whose size is
+  configured in the settings.  The stores and the products are derived from
+  :attr:`Settings.faker_seed` and their indices by hashing, without
+  constructing them via factories.  This makes generating large catalogs fast,
+  and any product can be generated independently of the others, which is used
+  to generate store visit workloads for load testing.
+"""
 
 
 import contextlib
-import functools
+import itertools
+import random
 import typing
-
-from .common import RetailChain, Store, Product, StoreVisit, CartProduct
+import uuid
+
+from .common import (
+    RetailChain,
+    Store,
+    Product,
+    StoreVisit,
+    CartProduct,
+    Ean,
+    from_cents,
+    _get_product_id,
+)
+from ..settings import settings
 
 try:
     import factory
@@ -91,24 +116,285 @@ else:
             self.cart.sort(key=lambda cp: cp.ean)
 
 
+_MASK = (1 << 64) - 1
+
+
+def _mix(*values: int) -> int:
+    # Combines the values into a pseudorandom 64-bit integer with the
+    # finalizer of the SplitMix64 generator
+    result = 0
+    for value in values:
+        result = (result ^ value) + 0x9E3779B97F4A7C15 & _MASK
+        result = (result ^ (result >> 30)) * 0xBF58476D1CE4E5B9 & _MASK
+        result = (result ^ (result >> 27)) * 0x94D049BB133111EB & _MASK
+        result ^= result >> 31
+    return result
+
+
+_CITIES = [
+    "Helsinki",
+    "Espoo",
+    "Tampere",
+    "Vantaa",
+    "Oulu",
+    "Turku",
+    "Jyväskylä",
+    "Lahti",
+    "Kuopio",
+    "Pori",
+]
+
+_PRODUCT_BRANDS = ["Pirkka", "Rainbow", "Kotimaista", "Valio", "Fazer", "Arla"]
+
+_PRODUCT_KINDS = [
+    "milk",
+    "yoghurt",
+    "bread",
+    "coffee",
+    "oat drink",
+    "cheese",
+    "butter",
+    "juice",
+    "pasta",
+    "rice",
+    "cereal",
+    "chocolate",
+]
+
+_PRODUCT_SIZES = ["100 g", "250 g", "500 g", "1 kg", "0.5 l", "1 l", "1.5 l"]
+
+_VARIABLE_PRICE_KINDS = ["minced meat", "salmon fillet", "cheese", "tomatoes"]
+
+# The names repeat with the product index
+_FIXED_PRICE_NAMES = [
+    f"{brand} {kind} {size}"
+    for (size, brand, kind) in itertools.product(
+        _PRODUCT_SIZES, _PRODUCT_BRANDS, _PRODUCT_KINDS
+    )
+]
+
+_VARIABLE_PRICE_NAMES = [
+    f"{brand} {kind}"
+    for (brand, kind) in itertools.product(_PRODUCT_BRANDS, _VARIABLE_PRICE_KINDS)
+]
+
+# Multipliers mapping product indices to EAN prefixes.  They are coprime with
+# the powers of ten, so that distinct indices map to distinct EAN codes.
+_FIXED_PRICE_EAN_MULTIPLIER = 48_271_013_597
+_VARIABLE_PRICE_EAN_MULTIPLIER = 7_368_787
+
+_FRACTION_BITS = 20
+
+
+def _get_store_index(store_external_id: str) -> int:
+    return int(store_external_id)
+
+
+class _ProductGenerator:
+    """Generates the products of a store from their indices
+
+    The EAN code, the name and the base price of a product are the same in all
+    stores, while the price varies by ±10 % between the stores.
+    """
+
+    def __init__(self, store: Store):
+        self.store_id = store.id
+        self.seed_key = _mix(settings.faker_seed)
+        self.store_key = _mix(self.seed_key, _get_store_index(store.external_id))
+        self.variable_price_threshold = int(
+            settings.faker_variable_price_fraction * (1 << _FRACTION_BITS)
+        )
+
+    def __call__(self, index: int) -> Product:
+        product_key = _mix(self.seed_key, index)
+        if product_key & ((1 << _FRACTION_BITS) - 1) < self.variable_price_threshold:
+            number = index * _VARIABLE_PRICE_EAN_MULTIPLIER % 10**7
+            ean = Ean.from_prefix(f"2{number:07d}0000")
+            name = _VARIABLE_PRICE_NAMES[index % len(_VARIABLE_PRICE_NAMES)]
+        else:
+            number = index * _FIXED_PRICE_EAN_MULTIPLIER % 10**11
+            ean = Ean.from_prefix(f"6{number:011d}")
+            name = _FIXED_PRICE_NAMES[index % len(_FIXED_PRICE_NAMES)]
+        base_price = 50 + (product_key >> _FRACTION_BITS) % 1500
+        price = base_price * (90 + _mix(product_key, self.store_key) % 21) // 100
+        return Product.construct(
+            id=_get_product_id(self.store_id, ean),
+            store_id=self.store_id,
+            ean=ean,
+            name=name,
+            price=from_cents(price),
+        )
+
+
+def generate_store(store_external_id: str) -> Store:
+    """Generate a store of the faker chain
+
+    Parameters:
+        store_external_id: The external id of the store
+    """
+    index = _get_store_index(store_external_id)
+    city = _CITIES[index % len(_CITIES)]
+    number = index // len(_CITIES)
+    return Store(
+        chain=RetailChain.FAKER,
+        external_id=store_external_id,
+        name=f"{city} {number + 1}" if number else city,
+    )
+
+
+def generate_products(
+    store: Store, *, batch_size: typing.Optional[int] = None
+) -> typing.Iterator[list[Product]]:
+    """Generate the products of a store of the faker chain
+
+    The products are generated lazily in batches, so that the memory needed
+    doesn't depend on :attr:`Settings.faker_products_per_store`.
+
+    Parameters:
+        store: The store
+
+    Keyword Arguments:
+        batch_size: The number of products in each batch (defaults to the
+            value in settings)
+    """
+    generate_product = _ProductGenerator(store)
+    batch_size = batch_size or settings.faker_products_batch_size
+    n_products = settings.faker_products_per_store
+    for start in range(0, n_products, batch_size):
+        yield [
+            generate_product(index)
+            for index in range(start, min(start + batch_size, n_products))
+        ]
+
+
+def generate_store_visits(
+    count: int,
+    *,
+    seed: typing.Optional[int] = None,
+    mean_cart_size: float = 15,
+    max_cart_size: int = 100,
+) -> typing.Iterator[StoreVisit]:
+    """Generate a workload of store visits to the stores of the faker chain
+
+    The store visits are distributed evenly between the stores.  The size of
+    the carts is exponentially distributed, and some products are much more
+    popular than others.  Fixed price products are bought in quantities of one
+    to three, and variable price products as a single item with its price
+    encoded in the EAN code.
+
+    Parameters:
+        count: The number of store visits
+
+    Keyword Arguments:
+        seed: The seed of the store visits, in addition to
+            :attr:`Settings.faker_seed`
+        mean_cart_size: The average number of distinct products in a cart
+        max_cart_size: The maximum number of distinct products in a cart
+
+    Returns:
+        Iterator over the store visits, with carts in the order the products
+        are picked
+    """
+    rng = random.Random(_mix(settings.faker_seed, seed or 0))
+    generators = [
+        _ProductGenerator(generate_store(store_external_id))
+        for store_external_id in get_store_external_ids()
+    ]
+    n_products = settings.faker_products_per_store
+    if not generators or not n_products:
+        return
+    for _ in range(count):
+        generate_product = generators[rng.randrange(len(generators))]
+        cart_size = min(
+            max(round(rng.expovariate(1 / mean_cart_size)), 1),
+            max_cart_size,
+            n_products,
+        )
+        # Squaring makes the products with small indices more popular
+        indices = dict.fromkeys(
+            int(n_products * rng.random() ** 2) for _ in range(cart_size)
+        )
+        cart = []
+        for index in indices:
+            product = generate_product(index)
+            if product.ean.is_variable_price():
+                price = min(
+                    from_cents(int(product.price * rng.randint(20, 150))),
+                    from_cents(9999),
+                )
+                cart.append(
+                    CartProduct.construct(
+                        ean=product.ean.get_ean_with_price(price),
+                        name=product.name,
+                        price=price,
+                        quantity=None,
+                    )
+                )
+            else:
+                cart.append(
+                    CartProduct.construct(
+                        ean=product.ean,
+                        name=product.name,
+                        price=product.price,
+                        quantity=rng.randint(1, 3),
+                    )
+                )
+        yield StoreVisit.construct(
+            id=uuid.UUID(int=rng.getrandbits(128), version=4),
+            store_id=generate_product.store_id,
+            cart=cart,
+            version=0,
+        )
+
+
 class StoreFetcher(contextlib.AbstractAsyncContextManager):
-    """Utility class for generating fake store and product data
+    """Store fetcher for the faker chain
 
     This class conforms to the general store fetcher protocol. Instead of
-    accessing an external API, is simply generates some fake data for
-    testing and development.
+    accessing an external API, it generates the synthetic catalog configured
+    in the settings.
 
     Parameters:
         store_external_id: The external id of the store
+
+    Keyword Arguments:
+        session: Ignored, accepted for compatibility with other fetchers
+        max_concurrent_pages: Ignored, accepted for compatibility with other
+            fetchers
+        read_ahead: Ignored, accepted for compatibility with other fetchers
+        preserve_order: Ignored, accepted for compatibility with other fetchers
     """
 
-    def __init__(self, store_external_id: str):
-        self.store = StoreFactory(external_id=store_external_id)
-        self.products = ProductFactory.build_batch(20, store_id=self.store.id)
+    # pylint: disable=unused-argument
+    def __init__(
+        self,
+        store_external_id: str,
+        *,
+        session: typing.Any = None,
+        max_concurrent_pages: int = 1,
+        read_ahead: int = 0,
+        preserve_order: bool = True,
+    ):
+        self.store = generate_store(store_external_id)
+        self._products: typing.Optional[list[Product]] = None
 
     async def __aexit__(self, *args):
         pass
 
+    @property
+    def products(self) -> list[Product]:
+        """The products of the store
+
+        The products are generated in full on first access, and the changes
+        made to the list are reflected in the fetched products.  Unless
+        accessed, the products are generated page by page while fetched.
+        """
+        if self._products is None:
+            self._products = list(
+                itertools.chain.from_iterable(generate_products(self.store))
+            )
+        return self._products
+
     def get_store(self) -> Store:
         """Get the fake store"""
         return self.store
@@ -117,11 +403,20 @@ class StoreFetcher(contextlib.AbstractAsyncContextManager):
         self,
     ) -> typing.AsyncIterable[list[Product]]:
         """Get the faked products"""
-        yield self.products[:10]
-        yield self.products[10:]
+        if self._products is None:
+            for products in generate_products(self.store):
+                yield products
+        else:
+            batch_size = settings.faker_products_batch_size
+            for start in range(0, len(self._products), batch_size):
+                yield self._products[start : start + batch_size]
+
+
+def connect() -> typing.AsyncContextManager[None]:
+    """Return null session, as fake data is not fetched over network"""
+    return contextlib.nullcontext()
 
 
-@functools.cache
 def get_store_external_ids() -> list[str]:
     """Return list of faked store ids"""
-    return [store.external_id for store in StoreFactory.build_batch(2)]
+    return [str(index) for index in range(settings.faker_store_count)]
@@ -0,0 +1,106 @@
+"""Price history
+
+The price of each product is recorded when the product is first fetched, and
+whenever its price changes.  The history is append-only.
+"""
+
+import datetime
+import typing
+import uuid
+
+import pydantic
+import sqlalchemy
+import sqlalchemy.ext.asyncio as sqlaio
+
+from .common import Ean, Price, Product, _get_product_id, to_cents, from_cents
+from .. import db
+
+
+class PriceChange(pydantic.BaseModel):
+    """Price of a product from the given time on"""
+
+    valid_from: datetime.datetime
+    price: Price
+
+
+async def record_prices(
+    products: typing.Sequence[Product],
+    *,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+):
+    """Record the current prices of products in the price history
+
+    This should only be called for products whose price has changed (or that
+    are new), to keep the history compact.  The prices are valid from now on.
+    If the same product is given more than once, the last price is recorded.
+
+    Parameters:
+        products: The products
+
+    Keyword Arguments:
+        connection: Database connection, or ``None`` to use a fresh connection
+    """
+    if products:
+        valid_from = datetime.datetime.now(datetime.timezone.utc)
+        # All prices share the same time, so each product may only appear once
+        prices = {product.id: to_cents(product.price) for product in products}
+        await db.create(
+            db.productprices,
+            [
+                {"product_id": product_id, "valid_from": valid_from, "price": price}
+                for (product_id, price) in prices.items()
+            ],
+            connection=connection,
+        )
+
+
+async def read_price_history(
+    store_id: uuid.UUID,
+    ean: Ean,
+    *,
+    since: typing.Optional[datetime.datetime] = None,
+    connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
+) -> list[PriceChange]:
+    """Read the price history of a product
+
+    Parameters:
+        store_id: The store id
+        ean: The EAN code of the product, in the normalized database format
+
+    Keyword Arguments:
+        since: If given, only the price changes after this time are returned,
+            preceded by the price valid at this time
+        connection: Database connection, or ``None`` to use a fresh connection
+        readonly: If ``True``, a fresh connection is routed to the read replica
+
+    Returns:
+        The price changes in time order
+    """
+    product_id = _get_product_id(store_id, ean)
+    stmt = sqlalchemy.select(
+        [db.productprices.c.valid_from, db.productprices.c.price]
+    ).where(db.productprices.c.product_id == product_id)
+    if since is not None:
+        # The latest change at or before ``since`` is still in effect
+        valid_at_since = (
+            sqlalchemy.select([sqlalchemy.func.max(db.productprices.c.valid_from)])
+            .where(
+                db.productprices.c.product_id == product_id,
+                db.productprices.c.valid_from <= since,
+            )
+            .scalar_subquery()
+        )
+        stmt = stmt.where(
+            (db.productprices.c.valid_from > since)
+            | (db.productprices.c.valid_from == valid_at_since)
+        )
+    result = await db.execute(
+        stmt.order_by(db.productprices.c.valid_from),
+        connection=connection,
+        readonly=readonly,
+    )
+    return [
+        PriceChange.construct(valid_from=row.valid_from, price=from_cents(row.price))
+        for row in result
+    ]
@@ -1,5 +1,6 @@
 """Utilities for fetching S-Group store and product data"""
 
+import asyncio
 import contextlib
 import typing
 
@@ -34,34 +35,108 @@ def _get_gql_client() -> gql.Client:
     return gql.Client(transport=gql_aiohttp.AIOHTTPTransport(url=settings.sok_api_url))
 
 
+@contextlib.asynccontextmanager
+async def connect() -> typing.AsyncIterator[gql.client.AsyncClientSession]:
+    """Open a session to S-Group API
+
+    The session can be shared between several store fetchers, so that they
+    reuse the same underlying HTTP connection pool.
+    """
+    async with _get_gql_client() as session:
+        yield session
+
+
+_T = typing.TypeVar("_T")
+
+
+async def _read_ahead(
+    iterable: typing.AsyncIterable[_T], maxsize: int
+) -> typing.AsyncIterator[_T]:
+    queue: asyncio.Queue[tuple[typing.Any, typing.Optional[Exception]]] = asyncio.Queue(
+        maxsize
+    )
+    end = object()
+
+    async def _produce():
+        try:
+            async for item in iterable:
+                await queue.put((item, None))
+        except Exception as ex:  # pylint: disable=broad-except
+            await queue.put((end, ex))
+        else:
+            await queue.put((end, None))
+
+    producer = asyncio.create_task(_produce())
+    try:
+        while True:
+            item, ex = await queue.get()
+            if ex:
+                raise ex
+            if item is end:
+                break
+            yield item
+    finally:
+        producer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await producer
+
+
 class StoreFetcher(contextlib.AbstractAsyncContextManager):
     """Utility class for fetching store and product info via S-Group API
 
     Parameters:
         store_external_id: The external (S-Group API specific) id of the store
+
+    Keyword Arguments:
+        session: A session returned by :func:`connect()`, or ``None`` to open a
+            new session for this fetcher only
+        max_concurrent_pages: The maximum number of product pages requested
+            concurrently
+        read_ahead: The maximum number of product batches buffered ahead of
+            the consumer, or zero to only fetch batches when requested
+        preserve_order: If ``False``, the batches may be yielded in the order
+            the pages are received instead of the order of the products in the
+            external API
     """
 
-    _cursor: int
     _gql_connection: gql.client.AsyncClientSession
-    _gql_result: dict
+    _first_page: dict
     _store: Store
 
-    def __init__(self, store_external_id: str):
+    def __init__(
+        self,
+        store_external_id: str,
+        *,
+        session: typing.Optional[gql.client.AsyncClientSession] = None,
+        max_concurrent_pages: int = 1,
+        read_ahead: int = 0,
+        preserve_order: bool = True,
+    ):
         self._store_external_id = store_external_id
-        self._gql_client = _get_gql_client()
+        self._session = session
+        self._max_concurrent_pages = max_concurrent_pages
+        self._read_ahead = read_ahead
+        self._preserve_order = preserve_order
+        self._exit_stack = contextlib.AsyncExitStack()
 
     async def __aenter__(self) -> "StoreFetcher":
-        self._cursor = 0
-        self._gql_connection = await self._gql_client.__aenter__()
-        store_dict = await self._fetch_next()
+        if self._session is None:
+            self._gql_connection = await self._exit_stack.enter_async_context(
+                _get_gql_client()
+            )
+        else:
+            self._gql_connection = self._session
+        self._first_page = await self._fetch_page(0)
         self._store = Store(
-            chain=RetailChain.SOK, external_id=store_dict["id"], name=store_dict["name"]
+            chain=RetailChain.SOK,
+            external_id=self._first_page["id"],
+            name=self._first_page["name"],
         )
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
         del self._gql_connection
-        return await self._gql_client.__aexit__(exc_type, exc, tb)
+        return await self._exit_stack.__aexit__(exc_type, exc, tb)
 
     def get_store(self) -> Store:
         """Get the fetched store"""
@@ -73,33 +148,87 @@ class StoreFetcher(contextlib.AbstractAsyncContextManager):
         The fetcher makes calls to external API and fetches in batches whose
         size is determined in the settings. It ends when either products in
         external API are exhausted or the setting specific limit is reached.
+
+        If the fetcher allows several concurrent pages, the next pages are
+        requested concurrently assuming that each page except the last one is
+        full.
+
+        If the fetcher reads ahead, the pages are fetched in a background task
+        while the consumer processes the earlier batches.
         """
-        products = self._parse_products()
-        yield products
-        while products and (
-            not settings.sok_products_fetch_limit
-            or self._cursor < settings.sok_products_fetch_limit
-        ):
-            await self._fetch_next()
-            products = self._parse_products()
-            if products:
+        batches = self._fetch_products_in_batches()
+        if self._read_ahead:
+            batches = _read_ahead(batches, self._read_ahead)
+        # Closing the batches early cancels the page requests still in flight
+        async with contextlib.aclosing(batches):
+            async for products in batches:
                 yield products
 
-    async def _fetch_next(self):
-        self._gql_result = await self._gql_connection.execute(
+    async def _fetch_products_in_batches(self) -> typing.AsyncIterator[list[Product]]:
+        products = self._parse_products(self._first_page)
+        yield products
+        cursor = len(products)
+        exhausted = not products
+        while not exhausted and not self._is_fetch_limit_reached(cursor):
+            pages = self._fetch_pages(self._get_next_offsets(cursor))
+            async with contextlib.aclosing(pages):
+                async for offset, page in pages:
+                    if products := self._parse_products(page):
+                        cursor = max(cursor, offset + len(products))
+                        yield products
+                    else:
+                        exhausted = True
+
+    async def _fetch_pages(
+        self, offsets: list[int]
+    ) -> typing.AsyncIterator[tuple[int, dict]]:
+        async def _fetch_page_with_offset(offset: int):
+            return offset, await self._fetch_page(offset)
+
+        tasks = [
+            asyncio.create_task(_fetch_page_with_offset(offset)) for offset in offsets
+        ]
+        try:
+            if self._preserve_order:
+                for task in tasks:
+                    yield await task
+            else:
+                for next_offset_and_page in asyncio.as_completed(tasks):
+                    yield await next_offset_and_page
+        finally:
+            # If a page fails, or the consumer stops early, the remaining
+            # requests must not outlive the session
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def _is_fetch_limit_reached(cursor: int):
+        limit = settings.sok_products_fetch_limit
+        return bool(limit) and cursor >= limit
+
+    def _get_next_offsets(self, cursor: int) -> list[int]:
+        offsets = (
+            cursor + n * settings.sok_products_batch_size
+            for n in range(self._max_concurrent_pages)
+        )
+        return [
+            offset for offset in offsets if not self._is_fetch_limit_reached(offset)
+        ]
+
+    async def _fetch_page(self, offset: int) -> dict:
+        result = await self._gql_connection.execute(
             _store_and_products_query,
             {
                 "store_id": self._store_external_id,
-                "from": self._cursor,
+                "from": offset,
                 "limit": settings.sok_products_batch_size,
             },
         )
-        store = self._gql_result["store"]
-        self._cursor += len(store["products"]["items"])
-        return store
+        return result["store"]
 
-    def _parse_products(self):
-        items = self._gql_result["store"]["products"]["items"]
+    def _parse_products(self, page: dict) -> list[Product]:
+        items = page["products"]["items"]
         return [Product(store_id=self._store.id, **item) for item in items]
 
 
@@ -7,9 +7,14 @@ import typing
 import sqlalchemy
 import sqlalchemy.ext.asyncio as sqlaio
 
-from .common import StoreVisit, CartProduct, _get_product_id
+from . import binpacking
+from .common import StoreVisit, CartProduct, Ean, _get_product_id
 
-from .. import db
+from .. import db, tracing
+
+
+class StoreVisitConflict(Exception):
+    """Raised when updating a store visit that was concurrently modified"""
 
 
 def _prepare_cart_for_db(storevisit: StoreVisit) -> list[dict]:
@@ -25,53 +30,74 @@ def _prepare_cart_for_db(storevisit: StoreVisit) -> list[dict]:
     ]
 
 
+@tracing.traced
 async def read_store_visit(
     id: uuid.UUID,
     *,
     connection: typing.Optional[sqlaio.AsyncConnection] = None,
+    readonly: bool = False,
 ) -> typing.Optional[StoreVisit]:
     """Read store visit from database
 
-    This retrieves the store visit, as well as the related cart.
+    This retrieves the store visit, as well as the related cart, in a single
+    query.  The rows are trusted to be valid, and the models are constructed
+    without validation.
 
     Parameters:
         id: The store visit id
 
     Keyword Arguments:
        connection: Database connection, or ``None`` to use a fresh connection
+       readonly: If ``True``, a fresh connection is routed to the read replica
     """
-    async with db.begin_connection(connection) as conn:
-        storevisit = await db.read(
-            db.storevisits,
-            id,
-            columns=[db.storevisits.c.store_id],
-            connection=conn,
+    # The store visit is outer joined with its cart, so that a store visit with
+    # an empty cart is returned as a single row with null cart columns
+    cart = db.cartproducts.join(db.products)
+    result = await db.execute(
+        sqlalchemy.select(
+            [
+                db.storevisits.c.store_id,
+                db.storevisits.c.version,
+                db.cartproducts.c.rank,
+                db.products.c.ean,
+                db.products.c.name,
+                sqlalchemy.func.coalesce(
+                    db.cartproducts.c.price, db.products.c.price
+                ).label("price"),
+                db.cartproducts.c.quantity,
+            ]
         )
-        if storevisit is None:
-            return None
-        cartproducts = await db.execute(
-            sqlalchemy.select(
-                [
-                    db.products.c.ean,
-                    db.products.c.name,
-                    sqlalchemy.func.coalesce(
-                        db.cartproducts.c.price, db.products.c.price
-                    ).label("price"),
-                    db.cartproducts.c.quantity,
-                ]
+        .select_from(
+            db.storevisits.outerjoin(
+                cart, db.storevisits.c.id == db.cartproducts.c.storevisit_id
             )
-            .select_from(db.cartproducts.join(db.products))
-            .where(db.cartproducts.c.storevisit_id == id)
-            .order_by(db.cartproducts.c.rank),
-            connection=conn,
         )
-    return StoreVisit(
+        .where(db.storevisits.c.id == id)
+        .order_by(db.cartproducts.c.rank),
+        connection=connection,
+        readonly=readonly,
+    )
+    rows = result.fetchall()
+    if not rows:
+        return None
+    return StoreVisit.construct(
         id=id,
-        **storevisit,
-        cart=cartproducts.fetchall(),
+        store_id=rows[0].store_id,
+        cart=[
+            CartProduct.construct(
+                ean=Ean(row.ean),
+                name=row.name,
+                price=row.price,
+                quantity=row.quantity,
+            )
+            for row in rows
+            if row.rank is not None
+        ],
+        version=rows[0].version,
     )
 
 
+@tracing.traced
 async def create_store_visit(
     storevisit: StoreVisit,
     *,
@@ -97,64 +123,108 @@ async def create_store_visit(
             )
 
 
+_CartRowValues = tuple[
+    uuid.UUID, typing.Optional[int], typing.Optional[decimal.Decimal]
+]
+
+
+def _get_cart_row_values(row: typing.Mapping) -> _CartRowValues:
+    return row["product_id"], row["quantity"], row["price"]
+
+
+async def _read_cart_row_values(
+    storevisit_id: uuid.UUID, connection: sqlaio.AsyncConnection
+) -> dict[int, _CartRowValues]:
+    result = await db.execute(
+        sqlalchemy.select(
+            [
+                db.cartproducts.c.rank,
+                db.cartproducts.c.product_id,
+                db.cartproducts.c.quantity,
+                db.cartproducts.c.price,
+            ]
+        ).where(db.cartproducts.c.storevisit_id == storevisit_id),
+        connection=connection,
+    )
+    return {row.rank: _get_cart_row_values(row) for row in result}
+
+
+@tracing.traced
 async def update_store_visit(
     storevisit: StoreVisit,
     *,
+    previous: typing.Optional[StoreVisit] = None,
     connection: typing.Optional[sqlaio.AsyncConnection] = None,
 ):
     """Update an existing store visit with dependencies
 
+    The new cart is compared with the stored cart, and only the cart products
+    that were added, changed or removed are written to the database.
+
+    The update is based on ``storevisit.version``.  If the stored store visit
+    has a different version, it was modified concurrently, and the update
+    fails.  Otherwise the version is incremented both in the database and in
+    ``storevisit``.  The version check doesn't need to hold any locks before
+    the update, and the update itself serializes concurrent writers.
+
     Parameters:
         storevisit: The store visit
 
     Keyword Arguments:
+       previous: The stored state of the store visit, if already read within
+           the same transaction.  If ``None``, the stored cart is read from
+           the database.
        connection: Database connection, or ``None`` to use a fresh connection
+
+    Raises:
+        :exc:`StoreVisitConflict` if the stored version of the store visit
+        doesn't match ``storevisit.version``
     """
     async with db.begin_connection(connection) as conn:
-        await db.update(
-            db.storevisits,
-            storevisit.dict(exclude={"store_id", "cart"}),
+        result = await db.execute(
+            db.storevisits.update()
+            .where(
+                db.storevisits.c.id == storevisit.id,
+                db.storevisits.c.version == storevisit.version,
+            )
+            .values(version=db.storevisits.c.version + 1),
             connection=conn,
         )
-        if storevisit.cart:
-            await db.upsert(
+        if not result.rowcount:
+            raise StoreVisitConflict(
+                f"Store visit {storevisit.id!r} version {storevisit.version} "
+                "is not the current version"
+            )
+        if previous is None:
+            old_cart = await _read_cart_row_values(storevisit.id, conn)
+        else:
+            old_cart = {
+                row["rank"]: _get_cart_row_values(row)
+                for row in _prepare_cart_for_db(previous)
+            }
+        changed_rows = [
+            row
+            for row in _prepare_cart_for_db(storevisit)
+            if old_cart.get(row["rank"]) != _get_cart_row_values(row)
+        ]
+        if changed_rows:
+            await db.upsert(db.cartproducts, changed_rows, connection=conn)
+        if len(old_cart) > len(storevisit.cart):
+            await db.delete(
                 db.cartproducts,
-                _prepare_cart_for_db(storevisit),
+                (db.cartproducts.c.storevisit_id == storevisit.id)
+                & (db.cartproducts.c.rank >= len(storevisit.cart)),
                 connection=conn,
             )
-        await db.delete(
-            db.cartproducts,
-            (db.cartproducts.c.storevisit_id == storevisit.id)
-            & (db.cartproducts.c.rank >= len(storevisit.cart)),
-            connection=conn,
-        )
-
-
-def _divide_cartproduct_to_bin_and_remaining(
-    cartproduct: CartProduct, limit: decimal.Decimal
-) -> tuple[typing.Optional[CartProduct], typing.Optional[CartProduct], decimal.Decimal]:
-    assert cartproduct.price is not None
-    if cartproduct.price > limit:
-        return None, cartproduct, limit
-    if cartproduct.quantity is None:
-        return cartproduct, None, limit - cartproduct.price
-    if cartproduct.price > 0:
-        n_items_to_bin = min(int(limit / cartproduct.price), cartproduct.quantity)
-    else:
-        n_items_to_bin = cartproduct.quantity
-    new_limit = limit - n_items_to_bin * cartproduct.price
-    if n_items_to_bin == cartproduct.quantity:
-        return cartproduct, None, new_limit
-    n_items_remaining = cartproduct.quantity - n_items_to_bin
-    return (
-        cartproduct.copy(update={"quantity": n_items_to_bin}),
-        cartproduct.copy(update={"quantity": n_items_remaining}),
-        new_limit,
-    )
+    storevisit.version += 1
 
 
 def bin_pack_cart(
-    cart: list[CartProduct], limit: decimal.Decimal
+    cart: list[CartProduct],
+    limit: decimal.Decimal,
+    *,
+    strategy: binpacking.BinPackingStrategy = binpacking.BinPackingStrategy.GREEDY,
+    time_budget: typing.Optional[float] = None,
 ) -> list[list[CartProduct]]:
     """Apply bin packing to cart
 
@@ -168,42 +238,11 @@ def bin_pack_cart(
         cart: A list of cart products
         limit: The target price limit per bin
 
+    Keyword Arguments:
+        strategy: The bin packing algorithm
+        time_budget: The maximum time (in seconds) spent by the exact algorithm
+
     Returns:
         A list of lists of cart products, each containing one bin
     """
-    cart_with_descending_prices = sorted(
-        cart, key=lambda cartproduct: -cartproduct.price  # type: ignore
-    )
-    last_bin = []
-    while (
-        cart_with_descending_prices
-        and (price := cart_with_descending_prices[0].price)
-        and price > limit
-    ):
-        last_bin.append(cart_with_descending_prices.pop(0))
-    bins = []
-    next_bin = []
-    limit_remaining = limit
-    while cart_with_descending_prices:
-        for i, cartproduct in enumerate(cart_with_descending_prices):
-            (
-                cartproduct_to_bin,
-                cartproduct_remaining,
-                limit_remaining,
-            ) = _divide_cartproduct_to_bin_and_remaining(cartproduct, limit_remaining)
-            if cartproduct_to_bin:
-                next_bin.append(cartproduct_to_bin)
-                if cartproduct_remaining:
-                    cart_with_descending_prices[i] = cartproduct_remaining
-                else:
-                    cart_with_descending_prices.pop(i)
-                break
-        else:
-            bins.append(next_bin)
-            next_bin = []
-            limit_remaining = limit
-    if next_bin:
-        bins.append(next_bin)
-    if last_bin:
-        bins.append(last_bin)
-    return bins
+    return binpacking.pack(cart, limit, strategy=strategy, time_budget=time_budget)
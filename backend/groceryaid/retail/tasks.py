@@ -1,9 +1,23 @@
 """Retail tasks"""
 
-from .. import db
+import asyncio
+import collections
+import decimal
+import logging
+import typing
+import uuid
 
-from . import sok, faker
-from .common import RetailChain
+import pydantic
+import sqlalchemy
+import sqlalchemy.ext.asyncio as sqlaio
+
+from .. import db, metrics
+from ..settings import settings
+
+from . import catalog, prices, sok, faker
+from .common import RetailChain, Product
+
+logger = logging.getLogger(__name__)
 
 store_modules = {
     RetailChain.FAKER: faker,
@@ -11,18 +25,187 @@ store_modules = {
 }
 
 
-async def fetch_and_save_stores_and_products(chain: RetailChain):
-    """Fetch all stores and products via external APIs"""
-    module = store_modules[chain]
-    for store_external_id in module.get_store_external_ids():
-        async with db.get_connection() as connection, module.StoreFetcher(
-            store_external_id
-        ) as fetcher:
-            store = fetcher.get_store()
+class StoreFetchReport(pydantic.BaseModel):
+    """Outcome of fetching and saving a single store
+
+    The product counts are from the last attempt to fetch the store.  Vanished
+    products are the products that exist in the database, but were not
+    returned by the fetcher.  They are left in the database as is.
+    """
+
+    store_external_id: str
+    attempts: int
+    error: typing.Optional[str] = None
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    vanished: int = 0
+
+    def is_success(self):
+        """Return ``True`` if the store was fetched and saved successfully"""
+        return self.error is None
+
+
+_ProductFingerprint = tuple[str, decimal.Decimal]
+
+
+def _get_product_fingerprint(product: Product) -> _ProductFingerprint:
+    return product.name, product.price
+
+
+async def _read_product_fingerprints(
+    store_id: uuid.UUID, connection: sqlaio.AsyncConnection
+) -> dict[str, _ProductFingerprint]:
+    result = await db.execute(
+        sqlalchemy.select(
+            [db.products.c.ean, db.products.c.name, db.products.c.price]
+        ).where(db.products.c.store_id == store_id),
+        connection=connection,
+    )
+    return {row.ean: (row.name, row.price) for row in result}
+
+
+async def _fetch_and_save_store(
+    module, store_external_id: str, *, session, max_concurrent_pages: int
+) -> dict[str, int]:
+    # The order of the batches doesn't matter when upserting, so they are saved
+    # in the order they arrive
+    async with db.get_connection() as connection, module.StoreFetcher(
+        store_external_id,
+        session=session,
+        max_concurrent_pages=max_concurrent_pages,
+        read_ahead=settings.fetch_read_ahead_pages,
+        preserve_order=False,
+    ) as fetcher:
+        store = fetcher.get_store()
+        store_in_db = await db.read(
+            db.stores, store.id, columns=[db.stores.c.name], connection=connection
+        )
+        store_changed = not store_in_db or store_in_db.name != store.name
+        if store_changed:
             await db.upsert(db.stores, store.dict(), connection=connection)
-            async for products in fetcher.get_products_in_batches():
-                await db.upsert(
-                    db.products,
-                    [product.dict() for product in products],
-                    connection=connection,
+        fingerprints = await _read_product_fingerprints(store.id, connection)
+        # The fetcher may return the same product more than once.  The last
+        # one wins, but each product is only counted once.
+        seen_fingerprints: dict[str, _ProductFingerprint] = {}
+        counts: collections.Counter[str] = collections.Counter()
+        metric_labels = store.chain.value, store_external_id
+        async for products in fetcher.get_products_in_batches():
+            metrics.fetch_pages.labels(*metric_labels).inc()
+            metrics.fetch_products.labels(*metric_labels).inc(len(products))
+            changed_products: dict[str, Product] = {}
+            changed_prices: dict[str, Product] = {}
+            for product in products:
+                new_fingerprint = _get_product_fingerprint(product)
+                if product.ean in seen_fingerprints:
+                    fingerprint = seen_fingerprints[product.ean]
+                else:
+                    fingerprint = fingerprints.pop(product.ean, None)
+                    if fingerprint is None:
+                        counts["inserted"] += 1
+                    elif fingerprint != new_fingerprint:
+                        counts["updated"] += 1
+                    else:
+                        counts["unchanged"] += 1
+                seen_fingerprints[product.ean] = new_fingerprint
+                if fingerprint == new_fingerprint:
+                    continue
+                changed_products[product.ean] = product
+                if fingerprint is None or fingerprint[1] != product.price:
+                    changed_prices[product.ean] = product
+            await db.bulk_upsert(
+                db.products,
+                [product.dict() for product in changed_products.values()],
+                connection=connection,
+            )
+            await prices.record_prices(
+                list(changed_prices.values()), connection=connection
+            )
+        counts["vanished"] = len(fingerprints)
+        if store_changed or counts["inserted"] or counts["updated"]:
+            await catalog.bump_catalog_version(store.id, connection=connection)
+    logger.info("Fetched store %r: %s", store_external_id, dict(counts))
+    return counts
+
+
+async def _fetch_and_save_store_with_retries(
+    chain: RetailChain,
+    store_external_id: str,
+    *,
+    semaphore: asyncio.Semaphore,
+    **kwargs,
+) -> StoreFetchReport:
+    retries = settings.fetch_retries
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            async with semaphore:
+                counts = await _fetch_and_save_store(
+                    store_modules[chain], store_external_id, **kwargs
+                )
+        except Exception as ex:  # pylint: disable=broad-except
+            metrics.fetch_errors.labels(chain.value, store_external_id).inc()
+            logger.warning(
+                "Fetching store %r failed (attempt %d of %d): %r",
+                store_external_id,
+                attempt,
+                retries + 1,
+                ex,
+            )
+            if attempt > retries:
+                return StoreFetchReport(
+                    store_external_id=store_external_id,
+                    attempts=attempt,
+                    error=repr(ex),
+                )
+            await asyncio.sleep(settings.fetch_retry_delay * 2 ** (attempt - 1))
+        else:
+            return StoreFetchReport(
+                store_external_id=store_external_id, attempts=attempt, **counts
+            )
+
+
+async def fetch_and_save_stores_and_products(
+    chain: RetailChain,
+    *,
+    max_concurrent_stores: typing.Optional[int] = None,
+    max_concurrent_pages: typing.Optional[int] = None,
+) -> list[StoreFetchReport]:
+    """Fetch all stores and products via external APIs
+
+    The stores are fetched concurrently, sharing a single session to the
+    external API.  Each store is saved in its own transaction, and a store that
+    fails to be fetched is retried without affecting the other stores.
+
+    Parameters:
+        chain: The retail chain
+
+    Keyword Arguments:
+        max_concurrent_stores: The maximum number of stores fetched
+            concurrently (defaults to the value in settings)
+        max_concurrent_pages: The maximum number of product pages per store
+            fetched concurrently (defaults to the value in settings)
+
+    Returns:
+        List of reports, one for each store
+    """
+    module = store_modules[chain]
+    semaphore = asyncio.Semaphore(
+        max_concurrent_stores or settings.fetch_max_concurrent_stores
+    )
+    async with module.connect() as session:
+        return await asyncio.gather(
+            *(
+                _fetch_and_save_store_with_retries(
+                    chain,
+                    store_external_id,
+                    semaphore=semaphore,
+                    session=session,
+                    max_concurrent_pages=(
+                        max_concurrent_pages or settings.fetch_max_concurrent_pages
+                    ),
                 )
+                for store_external_id in module.get_store_external_ids()
+            )
+        )
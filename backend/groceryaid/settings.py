@@ -1,6 +1,8 @@
 """Settings management"""
 
 import decimal
+import pathlib
+import typing
 import uuid
 
 import pydantic
@@ -10,12 +12,138 @@ class Settings(pydantic.BaseSettings):
     """Grocery Aid app settings"""
 
     database_url: pydantic.PostgresDsn = "postgresql+asyncpg://test@localhost/test"  # type: ignore
+    database_replica_url: typing.Optional[pydantic.PostgresDsn] = pydantic.Field(
+        None,
+        description="""
+        URL of a read replica used by read-only API endpoints. If not set, all
+        queries go to the primary database.
+        """,
+    )
+    database_replica_read_your_writes_window: pydantic.NonNegativeFloat = pydantic.Field(
+        5.0,
+        description="""
+            Time (in seconds) a store visit is read from the primary database
+            after being modified, to hide the replication lag from the client
+            that modified it.  The time is carried by the client in a cookie.
+            """,
+    )
+
+    # Database connection pool (per worker process)
+    database_pool_size: pydantic.PositiveInt = pydantic.Field(
+        5, description="Number of connections kept open in the pool"
+    )
+    database_max_overflow: pydantic.NonNegativeInt = pydantic.Field(
+        10,
+        description="Number of connections that can be opened beyond the pool size",
+    )
+    database_pool_timeout: pydantic.PositiveFloat = pydantic.Field(
+        30.0,
+        description="Time (in seconds) to wait for a connection before giving up",
+    )
+    database_pool_recycle: int = pydantic.Field(
+        -1,
+        description="""
+        Time (in seconds) after which connections are replaced with new ones.
+        Set to -1 to never recycle connections.
+        """,
+    )
+    database_pool_pre_ping: bool = pydantic.Field(
+        False, description="Test connections for liveness when checking them out"
+    )
+    database_statement_cache_size: pydantic.NonNegativeInt = pydantic.Field(
+        100,
+        description="""
+        Number of prepared statements cached per connection. Set to zero when
+        connecting through a transaction pooling proxy, such as PgBouncer.
+        """,
+    )
+    database_stream_batch_size: pydantic.PositiveInt = pydantic.Field(
+        1000,
+        description="Number of rows fetched at a time when streaming query results",
+    )
+
+    database_slow_query_threshold: typing.Optional[
+        pydantic.NonNegativeFloat
+    ] = pydantic.Field(
+        None,
+        description="""
+        Time (in seconds) after which a query is logged as slow. If not set,
+        slow queries are not logged.
+        """,
+    )
+    database_slow_query_explain: bool = pydantic.Field(
+        False,
+        description="""
+        If set, the execution plans of the slow queries are logged as well. The
+        queries are explained in the background with separate connections, but
+        explaining still adds load to the database.
+        """,
+    )
+
+    # Tracing
+    trace_export_path: typing.Optional[pathlib.Path] = pydantic.Field(
+        None,
+        description="""
+        File the spans of the traced requests are appended to, in the OTLP
+        JSON format. If not set, the requests are not traced.
+        """,
+    )
 
     store_root_namespace: uuid.UUID = pydantic.Field(
         default_factory=uuid.uuid4,
         description="The root namespace of UUID hierarchy used in the application",
     )
 
+    # Store and product fetching
+    fetch_max_concurrent_stores: pydantic.PositiveInt = pydantic.Field(
+        4, description="Maximum number of stores fetched concurrently"
+    )
+    fetch_max_concurrent_pages: pydantic.PositiveInt = pydantic.Field(
+        1, description="Maximum number of product pages per store fetched concurrently"
+    )
+    fetch_read_ahead_pages: pydantic.NonNegativeInt = pydantic.Field(
+        2,
+        description="""
+        Maximum number of product pages per store buffered while the earlier
+        pages are being saved. Set to zero to only fetch a page after the
+        previous one is saved.
+        """,
+    )
+    fetch_retries: pydantic.NonNegativeInt = pydantic.Field(
+        2, description="Number of times fetching a failed store is retried"
+    )
+    fetch_retry_delay: pydantic.NonNegativeFloat = pydantic.Field(
+        5.0,
+        description="""
+        Delay (in seconds) before retrying to fetch a failed store. The delay
+        is doubled after each failed attempt.
+        """,
+    )
+
+    # Product cache
+    product_cache_max_size: pydantic.NonNegativeInt = pydantic.Field(
+        100000,
+        description="""
+        Maximum number of products cached in memory by each worker. Set to zero
+        to disable the cache.
+        """,
+    )
+    product_cache_version_ttl: pydantic.NonNegativeFloat = pydantic.Field(
+        5.0,
+        description="""
+        Time (in seconds) the catalog version of a store is cached before
+        checking it from the database. Products fetched from the retail chain
+        become visible within this time.
+        """,
+    )
+    catalog_cache_max_age: pydantic.NonNegativeInt = pydantic.Field(
+        60,
+        description="""
+        Time (in seconds) clients and proxies may cache responses of the store
+        and product endpoints without revalidating them.
+        """,
+    )
+
     # S-Group specific configuration
     sok_api_url: pydantic.AnyHttpUrl = "http://localhost/sok"  # type: ignore
     sok_store_ids: list[str] = []
@@ -30,8 +158,61 @@ class Settings(pydantic.BaseSettings):
         """,
     )
 
+    # Synthetic data generated by the faker retail chain
+    faker_store_count: pydantic.NonNegativeInt = pydantic.Field(
+        2, description="Number of stores generated"
+    )
+    faker_products_per_store: pydantic.NonNegativeInt = pydantic.Field(
+        20, description="Number of products generated per store"
+    )
+    faker_products_batch_size: pydantic.PositiveInt = pydantic.Field(
+        10, description="Number of products generated per page"
+    )
+    faker_variable_price_fraction: pydantic.confloat(ge=0, le=1) = pydantic.Field(  # type: ignore
+        0.1, description="Fraction of the generated products that are variable price"
+    )
+    faker_seed: int = pydantic.Field(
+        0,
+        description="""
+        Seed of the generated data. The same seed always generates the same
+        stores, products and store visits.
+        """,
+    )
+
     # API defaults
     default_store_visit_bin_limit: decimal.Decimal = decimal.Decimal(10)
+    default_store_visit_bin_packing_strategy: typing.Literal[
+        "greedy", "best_fit", "exact"
+    ] = "greedy"
+    default_store_visit_bin_packing_time_budget: pydantic.PositiveFloat = (
+        pydantic.Field(
+            0.1,
+            description="Maximum time (in seconds) spent searching for optimal bins",
+        )
+    )
+    default_page_size: pydantic.PositiveInt = pydantic.Field(
+        50, description="Number of items per page in paginated responses"
+    )
+    max_page_size: pydantic.PositiveInt = pydantic.Field(
+        1000,
+        description="Maximum number of items per page a client may request",
+    )
+    max_product_lookup_size: pydantic.PositiveInt = pydantic.Field(
+        1000, description="Maximum number of EAN codes looked up in one request"
+    )
+
+    # Bin packing
+    bin_packing_max_time_budget: pydantic.PositiveFloat = pydantic.Field(
+        1.0,
+        description="Maximum time (in seconds) a client may request for bin packing",
+    )
+    bin_packing_exact_max_units: pydantic.PositiveInt = pydantic.Field(
+        100,
+        description="""
+        Maximum number of product units in a cart for which optimal bin packing
+        is attempted. Larger carts are packed using the best fit algorithm.
+        """,
+    )
 
     class Config:
         env_file = ".env"
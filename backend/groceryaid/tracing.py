@@ -0,0 +1,442 @@
+"""Request tracing
+
+Each HTTP request is given a request id, which is carried in a context variable
+to everything done on behalf of the request, including the database queries.
+The id is taken from the ``X-Request-ID`` header if the client (or a proxy)
+sent one, and is returned in the ``X-Request-ID`` header of the response.
+
+If :attr:`Settings.trace_export_path` is set, the request and the work done on
+behalf of it are also recorded as spans.  The spans of each request are
+appended to the file as a single line in the OTLP JSON format, which can be
+imported to the OpenTelemetry collector and the tools building on it.  Spans
+are not recorded unless they are exported.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import queue
+import re
+import secrets
+import threading
+import time
+import typing
+import uuid
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .settings import settings
+
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id: contextvars.ContextVar[typing.Optional[str]] = contextvars.ContextVar(
+    "request_id", default=None
+)
+
+_VALID_REQUEST_ID = re.compile(r"[\w.:/+=-]{1,128}")
+
+_TRACEPARENT = re.compile(r"00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}")
+
+# Span kinds and status codes of the OTLP format
+_SPAN_KIND_INTERNAL = 1
+_SPAN_KIND_SERVER = 2
+_SPAN_KIND_CLIENT = 3
+_STATUS_CODE_ERROR = 2
+
+_SERVICE_NAME = "groceryaid"
+
+
+@dataclasses.dataclass
+class Span:
+    """A timed operation in a trace
+
+    The times are nanoseconds since the epoch.
+    """
+
+    name: str
+    kind: int
+    trace_id: str
+    span_id: str
+    parent_span_id: typing.Optional[str]
+    start_time: int
+    end_time: int = 0
+    attributes: dict[str, typing.Any] = dataclasses.field(default_factory=dict)
+    error: bool = False
+
+
+@dataclasses.dataclass
+class _Trace:
+    trace_id: str
+    spans: list[Span] = dataclasses.field(default_factory=list)
+
+
+_current_trace: contextvars.ContextVar[
+    typing.Optional[_Trace]
+] = contextvars.ContextVar("current_trace", default=None)
+
+_current_span: contextvars.ContextVar[typing.Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def _encode_attribute_value(value: typing.Any) -> dict[str, typing.Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _encode_attributes(attributes: typing.Mapping[str, typing.Any]) -> list[dict]:
+    return [
+        {"key": key, "value": _encode_attribute_value(value)}
+        for (key, value) in attributes.items()
+    ]
+
+
+def _encode_span(span: Span) -> dict[str, typing.Any]:
+    encoded = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_time),
+        "endTimeUnixNano": str(span.end_time),
+        "attributes": _encode_attributes(span.attributes),
+    }
+    if span.parent_span_id:
+        encoded["parentSpanId"] = span.parent_span_id
+    if span.error:
+        encoded["status"] = {"code": _STATUS_CODE_ERROR}
+    return encoded
+
+
+def _encode_line(spans: typing.Sequence[Span]) -> bytes:
+    line = json.dumps(
+        {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _encode_attributes(
+                            {"service.name": _SERVICE_NAME}
+                        )
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [_encode_span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        },
+        separators=(",", ":"),
+    )
+    return (line + "\n").encode()
+
+
+class FileSpanExporter:
+    """Span exporter appending the spans to a file in the OTLP JSON format
+
+    The spans are encoded and written in a background thread, so exporting
+    doesn't block the event loop.
+
+    Parameters:
+        path: The path of the file
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._queue: queue.SimpleQueue[
+            typing.Optional[typing.Sequence[Span]]
+        ] = queue.SimpleQueue()
+        self._thread: typing.Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, spans: typing.Sequence[Span]):
+        """Append ``spans`` to the file as a single line"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._write_lines, name="span-exporter", daemon=True
+                )
+                self._thread.start()
+        self._queue.put(spans)
+
+    def _write_lines(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            while (spans := self._queue.get()) is not None:
+                # Each line is written with a single call to an append-only
+                # file, which keeps the lines of different worker processes
+                # appending to the same file from interleaving
+                line = _encode_line(spans)
+                while line:
+                    line = line[os.write(fd, line) :]
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """Write the spans exported so far, and close the file"""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+
+_exporter: typing.Optional[FileSpanExporter] = None
+
+
+def _reset_exporter():
+    # The child process doesn't inherit the writer thread, so it creates its
+    # own exporter on first use
+    global _exporter  # pylint: disable=global-statement
+    _exporter = None
+
+
+def _close_exporter():
+    if _exporter is not None:
+        _exporter.close()
+
+
+os.register_at_fork(after_in_child=_reset_exporter)
+atexit.register(_close_exporter)
+
+
+def get_exporter() -> typing.Optional[FileSpanExporter]:
+    """Return the span exporter, or ``None`` if spans are not exported"""
+    global _exporter  # pylint: disable=global-statement
+    if (path := settings.trace_export_path) is None:
+        return None
+    if _exporter is None or _exporter.path != path:
+        if _exporter is not None:
+            _exporter.close()
+        _exporter = FileSpanExporter(path)
+    return _exporter
+
+
+def _start_span(
+    name: str, kind: int, attributes: dict[str, typing.Any]
+) -> typing.Optional[Span]:
+    if (trace := _current_trace.get()) is None:
+        return None
+    parent = _current_span.get()
+    return Span(
+        name=name,
+        kind=kind,
+        trace_id=trace.trace_id,
+        span_id=secrets.token_hex(8),
+        parent_span_id=parent.span_id if parent else None,
+        start_time=time.time_ns(),
+        attributes=attributes,
+    )
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes) -> typing.Iterator[typing.Optional[Span]]:
+    """Record the execution of the ``with`` block as a span
+
+    The span is a child of the current span.  Outside of traced requests, no
+    span is recorded.
+
+    Parameters:
+        name: The name of the span
+
+    Keyword Arguments:
+        attributes: The attributes of the span
+
+    Returns:
+        A context manager yielding the span, or ``None`` if no span is recorded
+    """
+    if (current := _start_span(name, _SPAN_KIND_INTERNAL, attributes)) is None:
+        yield None
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException:
+        current.error = True
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_time = time.time_ns()
+        typing.cast(_Trace, _current_trace.get()).spans.append(current)
+
+
+_AsyncFunc = typing.TypeVar(
+    "_AsyncFunc", bound=typing.Callable[..., typing.Awaitable[typing.Any]]
+)
+
+
+def traced(func: _AsyncFunc) -> _AsyncFunc:
+    """Decorate an async function to record each of its calls as a span"""
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    async def _wrapper(*args, **kwargs):
+        with span(name):
+            return await func(*args, **kwargs)
+
+    return typing.cast(_AsyncFunc, _wrapper)
+
+
+_NORMALIZE_PATTERNS = [
+    # String literals
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    # Numeric literals that aren't part of identifiers
+    (re.compile(r"(?<![\w$])\d+(?:\.\d+)?"), "?"),
+    # Bind parameters in the styles used by the database drivers
+    (re.compile(r"%\(\w+\)s|%s|\$\d+|(?<!:):\w+|\?"), "?"),
+    # Lists of parameters, whose length varies with the number of values
+    (re.compile(r"\?(?:\s*,\s*\?)+"), "?"),
+    (re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+"), "(?)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_statement(statement: str) -> str:
+    """Return the SQL ``statement`` with the literals and parameters removed
+
+    Statements differing only by the values they use, or the number of values
+    in lists, are normalized to the same text.
+    """
+    for (pattern, replacement) in _NORMALIZE_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def get_fingerprint(statement: str) -> str:
+    """Return a short hash identifying the normalized SQL ``statement``"""
+    return hashlib.blake2b(
+        normalize_statement(statement).encode(), digest_size=8
+    ).hexdigest()
+
+
+def record_statement(statement: str, duration: float, **attributes):
+    """Record the execution of a SQL statement as a span
+
+    The span is a child of the current span, and ended at the time of the call.
+
+    Parameters:
+        statement: The SQL statement
+        duration: The time (in seconds) it took to execute the statement
+
+    Keyword Arguments:
+        attributes: Additional attributes of the span
+    """
+    if _current_trace.get() is None:
+        return
+    normalized = normalize_statement(statement)
+    current = typing.cast(
+        Span,
+        _start_span(
+            normalized.split(" ", 1)[0].upper(),
+            _SPAN_KIND_CLIENT,
+            {
+                "db.statement": normalized,
+                "db.fingerprint": get_fingerprint(statement),
+                **attributes,
+            },
+        ),
+    )
+    current.end_time = current.start_time
+    current.start_time -= int(duration * 1e9)
+    typing.cast(_Trace, _current_trace.get()).spans.append(current)
+
+
+def _get_header(scope: Scope, name: bytes) -> typing.Optional[str]:
+    for (key, value) in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _start_trace(scope: Scope, id_: str) -> tuple[_Trace, Span]:
+    parent_span_id = None
+    traceparent = _get_header(scope, b"traceparent")
+    if traceparent and (match := _TRACEPARENT.fullmatch(traceparent)):
+        trace = _Trace(match.group(1))
+        parent_span_id = match.group(2)
+    else:
+        trace = _Trace(secrets.token_hex(16))
+    root = Span(
+        name=f"{scope['method']} {scope['path']}",
+        kind=_SPAN_KIND_SERVER,
+        trace_id=trace.trace_id,
+        span_id=secrets.token_hex(8),
+        parent_span_id=parent_span_id,
+        start_time=time.time_ns(),
+        attributes={
+            "http.method": scope["method"],
+            "http.target": scope["path"],
+            "http.request_id": id_,
+        },
+    )
+    return trace, root
+
+
+class TracingMiddleware:
+    """ASGI middleware assigning request ids and tracing the requests
+
+    If the request has a ``traceparent`` header, as defined in the W3C Trace
+    Context recommendation, the spans of the request continue the trace of the
+    caller.
+
+    Parameters:
+        app: The ASGI application
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        id_ = _get_header(scope, REQUEST_ID_HEADER.encode())
+        if id_ is None or not _VALID_REQUEST_ID.fullmatch(id_):
+            id_ = uuid.uuid4().hex
+        status = 500
+
+        async def _send(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (REQUEST_ID_HEADER.encode(), id_.encode("latin-1")),
+                ]
+            await send(message)
+
+        request_id_token = request_id.set(id_)
+        if (exporter := get_exporter()) is None:
+            try:
+                await self.app(scope, receive, _send)
+            finally:
+                request_id.reset(request_id_token)
+            return
+
+        trace, root = _start_trace(scope, id_)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            request_id.reset(request_id_token)
+            root.end_time = time.time_ns()
+            root.attributes["http.status_code"] = status
+            root.error = status >= 500
+            exporter.export([root, *trace.spans])
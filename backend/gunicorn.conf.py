@@ -0,0 +1,36 @@
+"""Gunicorn configuration
+
+The worker processes share a directory for their Prometheus metrics, so that
+the metrics of all workers are aggregated regardless of which worker serves the
+``/metrics`` endpoint.
+"""
+
+import os
+import pathlib
+import socket
+import tempfile
+
+# The directory must be known before the Prometheus client is imported
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(
+        prefix="groceryaid-metrics-"
+    )
+_metrics_dir = pathlib.Path(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+
+def on_starting(server):
+    """Prepare the metrics directory before forking the workers"""
+    _metrics_dir.mkdir(parents=True, exist_ok=True)
+    # The metrics of the previous run would otherwise be counted again
+    for path in _metrics_dir.glob("*.db"):
+        path.unlink()
+
+
+def child_exit(server, worker):
+    """Discard the live gauges of a worker that exits"""
+    # pylint: disable=import-outside-toplevel
+    from prometheus_client import multiprocess
+
+    # The same identifier as groceryaid.metrics.get_process_identifier(),
+    # which isn't imported to keep the application out of the master process
+    multiprocess.mark_process_dead(f"{socket.gethostname()}_{worker.pid}")
@@ -1,3 +1,6 @@
 #!/bin/bash
 source /usr/venv/groceryaid/bin/activate
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
 exec "$@"
@@ -0,0 +1,47 @@
+"""Test load testing"""
+
+import pytest
+import pytest_asyncio
+
+from groceryaid import loadtest
+from groceryaid.retail import storevisits, RetailChain
+from groceryaid.retail.tasks import fetch_and_save_stores_and_products
+from groceryaid.settings import settings
+
+
+@pytest_asyncio.fixture
+async def faker_catalog(monkeypatch):
+    monkeypatch.setattr(settings, "faker_products_per_store", 100)
+    monkeypatch.setattr(settings, "faker_variable_price_fraction", 0.2)
+    await fetch_and_save_stores_and_products(RetailChain.FAKER, max_concurrent_stores=1)
+
+
+@pytest.mark.asyncio
+async def test_run_load_test(faker_catalog):
+    # The in-memory test database shares a single connection, so the shoppers
+    # are simulated sequentially
+    report = await loadtest.run_load_test(shoppers=5, concurrency=1, seed=1)
+    stats = {stats.endpoint: stats for stats in report.endpoints}
+    assert stats.keys() >= {
+        "POST /storevisits",
+        "PATCH /storevisits/{id}",
+        "GET /storevisits/{id}/bins",
+    }
+    assert stats["POST /storevisits"].requests == 5
+    assert stats["GET /storevisits/{id}/bins"].requests == 5
+    for endpoint_stats in stats.values():
+        assert endpoint_stats.errors == 0
+        assert 0 < endpoint_stats.p50 <= endpoint_stats.p95 <= endpoint_stats.p99
+
+
+@pytest.mark.asyncio
+async def test_run_load_test_counts_server_errors(faker_catalog, monkeypatch):
+    def _fail(*args, **kwargs):
+        raise RuntimeError("Bin packing failed")
+
+    monkeypatch.setattr(storevisits, "bin_pack_cart", _fail)
+    report = await loadtest.run_load_test(shoppers=2, concurrency=1, seed=1)
+    stats = {stats.endpoint: stats for stats in report.endpoints}
+    assert stats["GET /storevisits/{id}/bins"].errors == 2
+    assert stats["GET /storevisits/{id}/bins"].error_rate == 1.0
+    assert stats["POST /storevisits"].errors == 0
@@ -0,0 +1,31 @@
+"""Test metrics"""
+
+import fastapi
+import prometheus_client
+
+
+def _get_sample_value(name, **labels):
+    return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_get_metrics(testclient, store):
+    labels = {"method": "GET", "route": "/api/v1/stores/{id}"}
+    n_requests = _get_sample_value(
+        "groceryaid_http_requests_total", status="200", **labels
+    )
+    n_durations = _get_sample_value(
+        "groceryaid_http_request_duration_seconds_count", **labels
+    )
+    testclient.get(f"http://testserver/api/v1/stores/{store.id}")
+    response = testclient.get("http://testserver/metrics")
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert "groceryaid_http_requests_total" in response.text
+    assert (
+        _get_sample_value("groceryaid_http_requests_total", status="200", **labels)
+        == n_requests + 1
+    )
+    assert (
+        _get_sample_value("groceryaid_http_request_duration_seconds_count", **labels)
+        == n_durations + 1
+    )
+    assert _get_sample_value("groceryaid_http_requests_in_progress", **labels) == 0
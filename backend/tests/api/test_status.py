@@ -0,0 +1,20 @@
+"""Test status API"""
+
+import fastapi
+
+
+def test_get_status(testclient, product):
+    testclient.get(
+        f"http://testserver/api/v1/stores/{product.store_id}/products/{product.ean}"
+    )
+    response = testclient.get("http://testserver/api/v1/status")
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    status = response.json()
+    assert status["database_pool"]["waiting"] == 0
+    assert status["product_cache"] | {"max_size": None} == {
+        "hits": 0,
+        "misses": 1,
+        "evictions": 0,
+        "size": 1,
+        "max_size": None,
+    }
@@ -1,6 +1,15 @@
 """Test stores API"""
 
+import json
+import unittest.mock
+
 import fastapi
+import pytest
+
+from groceryaid import db
+from groceryaid.retail import catalog, prices
+from groceryaid.retail.faker import StoreFactory
+from groceryaid.settings import settings
 
 
 def test_get_stores(testclient, store):
@@ -16,6 +25,21 @@ def test_get_stores(testclient, store):
     ]
 
 
+@pytest.mark.asyncio
+async def test_get_stores_pagination(testclient, store):
+    stores = [store, *StoreFactory.build_batch(4)]
+    await db.create(db.stores, [store.dict() for store in stores[1:]])
+    store_ids = []
+    url = "http://testserver/api/v1/stores?limit=2"
+    while url:
+        response = testclient.get(url)
+        assert response.status_code == fastapi.status.HTTP_200_OK, response.text
+        assert len(response.json()) <= 2
+        store_ids.extend(store["id"] for store in response.json())
+        url = response.links.get("next", {}).get("url")
+    assert store_ids == sorted(str(store.id) for store in stores)
+
+
 def test_get_store(testclient, store):
     store_url = f"http://testserver/api/v1/stores/{store.id}"
     response = testclient.get(store_url)
@@ -28,6 +52,16 @@ def test_get_store(testclient, store):
     }
 
 
+def test_get_store_exposes_etag_to_other_origins(testclient, store):
+    response = testclient.get(
+        f"http://testserver/api/v1/stores/{store.id}",
+        headers={"Origin": "http://localhost:3000"},
+    )
+    exposed_headers = response.headers["access-control-expose-headers"].split(", ")
+    assert "ETag" in exposed_headers
+    assert "Link" in exposed_headers
+
+
 def test_get_store_not_found(testclient, faker):
     response = testclient.get(f"http://testserver/apiv1/stores/{faker.uuid4()}")
     assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
@@ -68,3 +102,202 @@ def test_get_product_not_found(testclient, faker):
         f"http://testserver/apiv1/stores/{faker.uuid4()}/products/{faker.ean()}"
     )
     assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+
+
+def test_get_store_is_read_from_replica(testclient, replica, store):
+    # The store was only created in the primary database
+    response = testclient.get(f"http://testserver/api/v1/stores/{store.id}")
+    assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+
+
+def test_get_products(testclient, store, products):
+    url = f"http://testserver/api/v1/stores/{store.id}/products"
+    eans = []
+    cursor = None
+    while True:
+        response = testclient.get(url, params={"limit": 3, "cursor": cursor})
+        assert response.status_code == fastapi.status.HTTP_200_OK, response.text
+        eans.extend(item["ean"] for item in response.json()["items"])
+        if not (cursor := response.json()["next_cursor"]):
+            break
+    assert eans == sorted(product.ean for product in products)
+
+
+def test_export_products(testclient, store, products):
+    store_url = f"http://testserver/api/v1/stores/{store.id}"
+    response = testclient.get(f"{store_url}/products/export")
+    assert response.status_code == fastapi.status.HTTP_200_OK, response.text
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {
+            "self": f"{store_url}/products/{product.ean}",
+            "store": store_url,
+            "ean": product.ean,
+            "name": product.name,
+            "price": float(product.price),
+        }
+        for product in sorted(products, key=lambda product: product.ean)
+    ]
+
+
+def test_export_products_store_not_found(testclient, faker):
+    response = testclient.get(
+        f"http://testserver/api/v1/stores/{faker.uuid4()}/products/export"
+    )
+    assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+
+
+def test_lookup_products(testclient, product, variable_price_product, faker):
+    store_url = f"http://testserver/api/v1/stores/{product.store_id}"
+    price = faker.pydecimal(positive=True, max_value=10, right_digits=2)
+    variable_price_ean = variable_price_product.ean.get_ean_with_price(price)
+    unknown_ean = faker.ean()
+    response = testclient.post(
+        f"{store_url}/products/lookup",
+        json={"eans": [product.ean, variable_price_ean, unknown_ean]},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK, response.text
+    assert response.json() == {
+        "items": [
+            {
+                "ean": product.ean,
+                "product": {
+                    "self": f"{store_url}/products/{product.ean}",
+                    "store": store_url,
+                    "ean": product.ean,
+                    "name": product.name,
+                    "price": float(product.price),
+                },
+                "price": float(product.price),
+            },
+            {
+                "ean": variable_price_ean,
+                "product": {
+                    "self": f"{store_url}/products/{variable_price_product.ean}",
+                    "store": store_url,
+                    "ean": variable_price_product.ean,
+                    "name": variable_price_product.name,
+                    "price": float(variable_price_product.price),
+                },
+                "price": float(price),
+            },
+            {"ean": unknown_ean, "product": None, "price": None},
+        ],
+        "missing": [unknown_ean],
+    }
+
+
+def test_lookup_products_store_not_found(testclient, faker):
+    response = testclient.post(
+        f"http://testserver/api/v1/stores/{faker.uuid4()}/products/lookup",
+        json={"eans": [faker.ean()]},
+    )
+    assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_get_product_prices(testclient, product):
+    await prices.record_prices([product])
+    product_url = (
+        f"http://testserver/api/v1/stores/{product.store_id}/products/{product.ean}"
+    )
+    response = testclient.get(f"{product_url}/prices")
+    assert response.status_code == fastapi.status.HTTP_200_OK, response.text
+    response_json = response.json()
+    assert response_json["product"] == product_url
+    assert [change["price"] for change in response_json["prices"]] == [
+        float(product.price)
+    ]
+
+
+def test_get_product_prices_not_found(testclient, store, faker):
+    response = testclient.get(
+        f"http://testserver/api/v1/stores/{store.id}/products/{faker.ean()}/prices"
+    )
+    assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+
+
+def test_search_products(testclient, product):
+    store_url = f"http://testserver/api/v1/stores/{product.store_id}"
+    response = testclient.get(f"{store_url}/products", params={"q": product.name})
+    assert response.status_code == fastapi.status.HTTP_200_OK, response.text
+    assert {
+        "self": f"{store_url}/products/{product.ean}",
+        "store": store_url,
+        "ean": product.ean,
+        "name": product.name,
+        "price": float(product.price),
+    } in response.json()["items"]
+
+
+def test_search_products_pagination(testclient, store, products):
+    url = f"http://testserver/api/v1/stores/{store.id}/products"
+    query = products[0].name.split()[0]
+    eans = []
+    cursor = None
+    while True:
+        response = testclient.get(
+            url, params={"q": query, "limit": 1, "cursor": cursor}
+        )
+        assert response.status_code == fastapi.status.HTTP_200_OK, response.text
+        eans.extend(item["ean"] for item in response.json()["items"])
+        if not (cursor := response.json()["next_cursor"]):
+            break
+    assert len(eans) == len(set(eans))
+    assert products[0].ean in eans
+
+
+def test_search_products_invalid_cursor(testclient, store):
+    response = testclient.get(
+        f"http://testserver/api/v1/stores/{store.id}/products",
+        params={"q": "maito", "cursor": "invalid"},
+    )
+    assert response.status_code == fastapi.status.HTTP_400_BAD_REQUEST
+
+
+def test_search_products_store_not_found(testclient, faker):
+    response = testclient.get(
+        f"http://testserver/api/v1/stores/{faker.uuid4()}/products",
+        params={"q": "maito"},
+    )
+    assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+
+
+def test_get_store_returns_cache_headers(testclient, store):
+    response = testclient.get(f"http://testserver/api/v1/stores/{store.id}")
+    assert response.headers["etag"].startswith('"')
+    assert response.headers["cache-control"].startswith("public, max-age=")
+
+
+@pytest.mark.parametrize(
+    "url_template",
+    [
+        "http://testserver/api/v1/stores",
+        "http://testserver/api/v1/stores/{product.store_id}",
+        "http://testserver/api/v1/stores/{product.store_id}/products/{product.ean}",
+    ],
+)
+def test_get_catalog_not_modified(testclient, product, url_template, monkeypatch):
+    url = url_template.format(product=product)
+    etag = testclient.get(url).headers["etag"]
+    read = unittest.mock.AsyncMock()
+    monkeypatch.setattr(db, "read", read)
+    monkeypatch.setattr(db, "select", read)
+    response = testclient.get(url, headers={"If-None-Match": f"W/{etag}"})
+    assert response.status_code == fastapi.status.HTTP_304_NOT_MODIFIED
+    assert response.headers["etag"] == etag
+    read.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_get_store_etag_changes_with_catalog_version(
+    testclient, store, monkeypatch
+):
+    monkeypatch.setattr(settings, "product_cache_version_ttl", 0)
+    catalog.clear_cache()
+    url = f"http://testserver/api/v1/stores/{store.id}"
+    etag = testclient.get(url).headers["etag"]
+    await catalog.bump_catalog_version(store.id)
+    response = testclient.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.headers["etag"] != etag
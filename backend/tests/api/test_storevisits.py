@@ -1,8 +1,23 @@
 """Test store visit API"""
 
 import decimal
+import json
+import uuid
+import unittest.mock
 
 import fastapi
+import fastapi.encoders
+import fastapi.testclient
+from hrefs.starlette import href_context
+from hypothesis import example, given, strategies as st
+import starlette.requests
+
+from groceryaid import app
+from groceryaid.api import storevisits as storevisits_api
+from groceryaid.api.models import StoreVisit
+from groceryaid.retail import storevisits, BinPackingStrategy, CartProduct, Ean
+from groceryaid.retail import StoreVisit as DbStoreVisit
+from groceryaid.settings import settings
 
 
 def test_get_store_visit(testclient, storevisit):
@@ -40,6 +55,42 @@ def test_get_store_visit_not_found(testclient, faker):
     assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
 
 
+def test_get_store_visit_is_read_from_replica(testclient, replica, storevisit):
+    # The store visit was only created in the primary database
+    response = testclient.get(f"http://testserver/api/v1/storevisits/{storevisit.id}")
+    assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+
+
+def test_get_store_visit_reads_own_writes(testclient, replica, storevisit):
+    storevisit_url = f"http://testserver/api/v1/storevisits/{storevisit.id}"
+    patch = [{"op": "replace", "path": "/cart/items", "value": []}]
+    headers = {"Content-Type": "application/json-patch+json"}
+    response = testclient.patch(storevisit_url, json=patch, headers=headers)
+    assert response.status_code == fastapi.status.HTTP_200_OK, response.text
+    # A client that only shares the cookies, as if the next requests were served
+    # by another worker
+    other_testclient = fastapi.testclient.TestClient(app)
+    other_testclient.cookies.update(testclient.cookies)
+    response = other_testclient.get(storevisit_url)
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.json()["cart"]["items"] == []
+    response = other_testclient.get(f"{storevisit_url}/bins")
+    assert response.status_code == fastapi.status.HTTP_200_OK
+
+
+def test_get_store_visit_reads_own_writes_disabled(
+    testclient, replica, storevisit, monkeypatch
+):
+    monkeypatch.setattr(settings, "database_replica_read_your_writes_window", 0)
+    storevisit_url = f"http://testserver/api/v1/storevisits/{storevisit.id}"
+    patch = [{"op": "replace", "path": "/cart/items", "value": []}]
+    headers = {"Content-Type": "application/json-patch+json"}
+    response = testclient.patch(storevisit_url, json=patch, headers=headers)
+    assert response.status_code == fastapi.status.HTTP_200_OK, response.text
+    response = testclient.get(storevisit_url)
+    assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+
+
 def test_post_store_visit(testclient, store, product, faker):
     store_url = f"http://testserver/api/v1/stores/{store.id}"
     product_url = f"{store_url}/products/{product.ean}"
@@ -312,6 +363,32 @@ def test_patch_store_visit(testclient, storevisit, store, product, faker):
     }
 
 
+def test_put_store_visit_if_match(testclient, storevisit):
+    storevisit_url = f"http://testserver/api/v1/storevisits/{storevisit.id}"
+    etag = testclient.get(storevisit_url).headers["etag"]
+    response = testclient.put(
+        storevisit_url, json={"cart": []}, headers={"If-Match": etag}
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK, response.text
+    assert response.headers["etag"] != etag
+    response = testclient.put(
+        storevisit_url, json={"cart": []}, headers={"If-Match": etag}
+    )
+    assert response.status_code == fastapi.status.HTTP_412_PRECONDITION_FAILED
+
+
+def test_patch_store_visit_if_match(testclient, storevisit):
+    storevisit_url = f"http://testserver/api/v1/storevisits/{storevisit.id}"
+    etag = testclient.get(storevisit_url).headers["etag"]
+    patch = [{"op": "replace", "path": "/cart/items", "value": []}]
+    headers = {"Content-Type": "application/json-patch+json", "If-Match": etag}
+    response = testclient.patch(storevisit_url, json=patch, headers=headers)
+    assert response.status_code == fastapi.status.HTTP_200_OK, response.text
+    assert testclient.get(storevisit_url).headers["etag"] == response.headers["etag"]
+    response = testclient.patch(storevisit_url, json=patch, headers=headers)
+    assert response.status_code == fastapi.status.HTTP_412_PRECONDITION_FAILED
+
+
 def test_patch_store_visit_invalid_content_type(testclient, storevisit):
     response = testclient.patch(
         f"http://testserver/api/v1/storevisits/{storevisit.id}", json=[]
@@ -374,3 +451,111 @@ def test_get_grouped_store_visit_cart(testclient, storevisit):
     )
     expected_eans = set(cartproduct.ean for cartproduct in storevisit.cart)
     assert eans_in_response == expected_eans
+
+
+def test_get_grouped_store_visit_cart_default_strategy(
+    testclient, storevisit, monkeypatch
+):
+    bin_pack_cart = unittest.mock.Mock(wraps=storevisits.bin_pack_cart)
+    monkeypatch.setattr(storevisits, "bin_pack_cart", bin_pack_cart)
+    store_visit_url = f"http://testserver/api/v1/storevisits/{storevisit.id}"
+    response = testclient.get(f"{store_visit_url}/bins")
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert bin_pack_cart.call_args.kwargs["strategy"] is BinPackingStrategy.GREEDY
+
+
+def test_get_grouped_store_visit_cart_exact(testclient, storevisit):
+    store_visit_url = f"http://testserver/api/v1/storevisits/{storevisit.id}"
+    response = testclient.get(
+        f"{store_visit_url}/bins", params={"strategy": "exact", "time_budget": 0.1}
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    response_json = response.json()
+    assert len(response_json["binned_cart"]) >= response_json["lower_bound"] >= 1
+
+
+def test_get_grouped_store_visit_cart_invalid_strategy(testclient, storevisit):
+    store_visit_url = f"http://testserver/api/v1/storevisits/{storevisit.id}"
+    response = testclient.get(f"{store_visit_url}/bins", params={"strategy": "magic"})
+    assert response.status_code == fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+_price_strategy = st.decimals(min_value=0, max_value=99, places=2)
+
+_fixed_price_cartproduct_strategy = st.builds(
+    CartProduct,
+    ean=st.from_regex(Ean.prefix_pattern)
+    .filter(lambda prefix: not Ean.variable_price_prefix_pattern.match(prefix))
+    .map(Ean.from_prefix),
+    name=st.text(max_size=20),
+    price=_price_strategy,
+    quantity=st.integers(min_value=1, max_value=999),
+)
+
+_variable_price_cartproduct_strategy = st.builds(
+    lambda ean, name: CartProduct(
+        ean=ean, name=name, price=ean.get_price(), quantity=None
+    ),
+    ean=st.from_regex(Ean.variable_price_prefix_pattern).map(Ean.from_prefix),
+    name=st.text(max_size=20),
+)
+
+_storevisit_strategy = st.builds(
+    DbStoreVisit,
+    cart=st.lists(
+        st.one_of(
+            _fixed_price_cartproduct_strategy, _variable_price_cartproduct_strategy
+        ),
+        unique_by=lambda cartproduct: cartproduct.ean,
+    ),
+    version=st.integers(min_value=0, max_value=100),
+)
+
+
+@st.composite
+def _storevisit_and_products_strategy(draw):
+    storevisit = draw(_storevisit_strategy)
+    # The product records override the names and prices in the cart
+    eans = draw(
+        st.lists(
+            st.sampled_from([cartproduct.ean for cartproduct in storevisit.cart]),
+            unique=True,
+        )
+        if storevisit.cart
+        else st.just([])
+    )
+    products = {
+        ean: {"name": draw(st.text(max_size=20)), "price": draw(_price_strategy)}
+        for ean in eans
+    }
+    return storevisit, products
+
+
+def _create_request():
+    return starlette.requests.Request(
+        {
+            "type": "http",
+            "app": app,
+            "router": app.router,
+            "scheme": "http",
+            "server": ("testserver", 80),
+            "root_path": "",
+            "path": "/",
+            "headers": [],
+        }
+    )
+
+
+@given(_storevisit_and_products_strategy())
+@example((DbStoreVisit(store_id=uuid.uuid4(), cart=[]), {}))
+def test_serialize_store_visit_matches_api_model(storevisit_and_products):
+    storevisit, products = storevisit_and_products
+    request = _create_request()
+    response = storevisits_api._serialize_store_visit(request, storevisit, products)
+    with href_context(request):
+        model = StoreVisit(
+            **storevisits_api._prepare_store_visit_for_api(storevisit, products)
+        )
+    assert json.loads(response.body) == json.loads(
+        json.dumps(fastapi.encoders.jsonable_encoder(model))
+    )
@@ -0,0 +1,118 @@
+"""Test request tracing"""
+
+import json
+
+from groceryaid import tracing
+from groceryaid.settings import settings
+
+
+def test_request_id_is_generated(testclient, store):
+    response = testclient.get(f"http://testserver/api/v1/stores/{store.id}")
+    assert response.headers["x-request-id"]
+
+
+def test_request_id_is_propagated(testclient, store):
+    response = testclient.get(
+        f"http://testserver/api/v1/stores/{store.id}",
+        headers={"X-Request-ID": "request-1"},
+    )
+    assert response.headers["x-request-id"] == "request-1"
+
+
+def test_invalid_request_id_is_replaced(testclient, store):
+    response = testclient.get(
+        f"http://testserver/api/v1/stores/{store.id}",
+        headers={"X-Request-ID": "invalid request id"},
+    )
+    assert response.headers["x-request-id"] != "invalid request id"
+
+
+def test_spans_are_exported(testclient, storevisit, tmp_path, monkeypatch):
+    trace_export_path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(settings, "trace_export_path", trace_export_path)
+    trace_id = "0af7651916cd43dd8448eb211c80319c"
+    parent_span_id = "b7ad6b7169203331"
+    response = testclient.patch(
+        f"http://testserver/api/v1/storevisits/{storevisit.id}",
+        headers={
+            "Content-Type": "application/json-patch+json",
+            "X-Request-ID": "request-1",
+            "traceparent": f"00-{trace_id}-{parent_span_id}-01",
+        },
+        json=[{"op": "replace", "path": "/cart/items", "value": []}],
+    )
+    assert response.status_code == 200, response.text
+    tracing.get_exporter().close()
+    [line] = trace_export_path.read_text().splitlines()
+    [resource_spans] = json.loads(line)["resourceSpans"]
+    [scope_spans] = resource_spans["scopeSpans"]
+    spans = {span["spanId"]: span for span in scope_spans["spans"]}
+    [root] = [span for span in spans.values() if span["kind"] == 2]
+    assert root["traceId"] == trace_id
+    assert root["parentSpanId"] == parent_span_id
+    assert {"key": "http.request_id", "value": {"stringValue": "request-1"}} in root[
+        "attributes"
+    ]
+    [update] = [
+        span for span in spans.values() if span["name"].endswith("update_store_visit")
+    ]
+    assert update["parentSpanId"] == root["spanId"]
+    statements = [
+        span for span in spans.values() if span["parentSpanId"] == update["spanId"]
+    ]
+    assert statements
+    for span in statements:
+        attributes = {
+            attribute["key"]: attribute["value"] for attribute in span["attributes"]
+        }
+        assert span["kind"] == 3
+        assert span["traceId"] == trace_id
+        assert "db.fingerprint" in attributes
+        assert int(span["startTimeUnixNano"]) <= int(span["endTimeUnixNano"])
+
+
+def test_normalize_statement():
+    assert tracing.normalize_statement(
+        "SELECT *\n  FROM products WHERE ean IN (?, ?, ?) AND price > 1.5"
+    ) == tracing.normalize_statement(
+        "SELECT * FROM products WHERE ean IN ($1) AND price > 20"
+    )
+    assert tracing.normalize_statement(
+        "INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)"
+    ) == tracing.normalize_statement("INSERT INTO t (a, b) VALUES ('x', :b)")
+
+
+def test_get_fingerprint():
+    assert tracing.get_fingerprint(
+        "SELECT name FROM stores WHERE id = ?"
+    ) == tracing.get_fingerprint("SELECT name FROM stores WHERE id = 'abc'")
+    assert tracing.get_fingerprint(
+        "SELECT name FROM stores WHERE id = ?"
+    ) != tracing.get_fingerprint("SELECT id FROM stores WHERE name = ?")
+
+
+def test_large_lines_are_not_interleaved(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    spans = [
+        tracing.Span(
+            name="span",
+            kind=1,
+            trace_id="0af7651916cd43dd8448eb211c80319c",
+            span_id=f"{index:016x}",
+            parent_span_id=None,
+            start_time=0,
+            attributes={"data": str(index) * 100_000},
+        )
+        for index in range(10)
+    ]
+    exporters = [tracing.FileSpanExporter(path) for _ in range(2)]
+    for span in spans:
+        for exporter in exporters:
+            exporter.export([span])
+    for exporter in exporters:
+        exporter.close()
+    lines = path.read_text().splitlines()
+    assert sorted(
+        json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["spanId"]
+        for line in lines
+    ) == sorted(2 * [span.span_id for span in spans])
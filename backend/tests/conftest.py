@@ -1,5 +1,6 @@
 """Common test configuration"""
 
+import os
 import random
 
 import hypothesis.strategies
@@ -8,7 +9,8 @@ import pytest_asyncio
 import sqlalchemy.ext.asyncio as sqlaio
 
 from groceryaid import db
-from groceryaid.retail import storevisits, Ean
+from groceryaid.db import _db
+from groceryaid.retail import catalog, storevisits, Ean
 from groceryaid.retail.faker import (
     StoreFactory,
     ProductFactory,
@@ -26,11 +28,54 @@ hypothesis.strategies.register_type_strategy(
 async def database(monkeypatch):
     """Initializes in-memory database and returns the engine"""
     engine = sqlaio.create_async_engine("sqlite+aiosqlite://")
-    monkeypatch.setattr("groceryaid.db._db.get_engine", lambda: engine)
+    _db._instrument_engine(engine, "primary")
+    monkeypatch.setattr("groceryaid.db._db.get_engine", lambda readonly=False: engine)
     await db.init()
     return engine
 
 
+@pytest_asyncio.fixture
+async def replica(database, monkeypatch):
+    """Initializes another in-memory database used as read replica
+
+    Returns the engine of the replica.  Nothing is replicated, so the tests can
+    tell which database the queries were routed to.
+    """
+    engine = sqlaio.create_async_engine("sqlite+aiosqlite://")
+    _db._instrument_engine(engine, "replica")
+    monkeypatch.setattr(
+        "groceryaid.db._db.get_engine",
+        lambda readonly=False: engine if readonly else database,
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(db.get_metadata().create_all)
+    return engine
+
+
+@pytest_asyncio.fixture
+async def postgresql(database, monkeypatch):
+    """Use PostgreSQL as the default database
+
+    The tests using this fixture are skipped unless ``TEST_POSTGRESQL_URL`` is
+    set.  The schema of that database is dropped and recreated.
+    """
+    if not (url := os.environ.get("TEST_POSTGRESQL_URL")):
+        pytest.skip("TEST_POSTGRESQL_URL not set")
+    engine = _db._create_engine(url, "primary")
+    monkeypatch.setattr("groceryaid.db._db.get_engine", lambda readonly=False: engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(db.get_metadata().drop_all)
+        await conn.run_sync(db.get_metadata().create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def product_cache():
+    """Clears the product cache between tests"""
+    catalog.clear_cache()
+
+
 @pytest_asyncio.fixture
 async def store():
     """Return a store that will also be inserted into the database"""
@@ -0,0 +1,54 @@
+"""Test database setup"""
+
+import copy
+
+import prometheus_client
+import pytest
+import sqlalchemy
+import sqlalchemy.ext.asyncio as sqlaio
+
+from groceryaid import db
+from groceryaid.db import _db
+
+
+@pytest.mark.asyncio
+async def test_get_connection_records_checkout():
+    checkouts = db.get_pool_stats().checkouts
+    async with db.get_connection() as connection:
+        await connection.execute(sqlalchemy.text("SELECT 1"))
+    stats = db.get_pool_stats()
+    assert stats.checkouts == checkouts + 1
+    assert stats.waiting == 0
+    assert stats.checkout_seconds_max >= 0
+
+
+@pytest.mark.asyncio
+async def test_instrument_engine_records_query_duration():
+    labels = {"database": "primary", "operation": "SELECT"}
+    n_queries = (
+        prometheus_client.REGISTRY.get_sample_value(
+            "groceryaid_db_query_duration_seconds_count", labels
+        )
+        or 0
+    )
+    engine = sqlaio.create_async_engine("sqlite+aiosqlite://")
+    _db._instrument_engine(engine, "primary")
+    async with engine.connect() as connection:
+        await connection.execute(sqlalchemy.text("SELECT 1"))
+    await engine.dispose()
+    assert (
+        prometheus_client.REGISTRY.get_sample_value(
+            "groceryaid_db_query_duration_seconds_count", labels
+        )
+        == n_queries + 1
+    )
+
+
+@pytest.mark.asyncio
+async def test_instrument_engine_failed_statement():
+    async with db.get_connection() as connection:
+        info = copy.deepcopy(connection.info)
+        with pytest.raises(sqlalchemy.exc.DBAPIError):
+            async with connection.begin_nested():
+                await connection.execute(sqlalchemy.text("SELECT * FROM nonexistent"))
+        assert connection.info == info
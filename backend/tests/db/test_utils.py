@@ -0,0 +1,128 @@
+"""Test database utilities"""
+
+import asyncio
+import decimal
+
+import pytest
+
+from groceryaid import db, tracing
+from groceryaid.db import utils
+from groceryaid.retail import Product
+from groceryaid.retail.faker import StoreFactory, ProductFactory
+from groceryaid.settings import settings
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert(store, products):
+    products[0].price += decimal.Decimal("0.01")
+    new_product = ProductFactory.build(store_id=store.id)
+    await db.bulk_upsert(
+        db.products, [product.dict() for product in [products[0], new_product]]
+    )
+    products_in_db = await db.select(db.products)
+    assert sorted(
+        (Product(**row) for row in products_in_db), key=lambda product: product.id
+    ) == sorted([*products, new_product], key=lambda product: product.id)
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert_duplicates(store, products):
+    duplicate_product = products[0].copy()
+    products[0].price += decimal.Decimal("0.01")
+    await db.bulk_upsert(
+        db.products, [product.dict() for product in [duplicate_product, products[0]]]
+    )
+    product_in_db = await db.read(db.products, products[0].id)
+    assert product_in_db.price == products[0].price
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert_nothing(store):
+    await db.bulk_upsert(db.products, [])
+    assert await db.select(db.products) == []
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert_postgresql(postgresql):
+    store = StoreFactory.build()
+    await db.create(db.stores, store.dict())
+    products = ProductFactory.build_batch(10, store_id=store.id)
+    await db.bulk_upsert(db.products, [product.dict() for product in products])
+    products[0].price += decimal.Decimal("0.01")
+    new_product = ProductFactory.build(store_id=store.id)
+    duplicate_product = products[1].copy()
+    products[1].price += decimal.Decimal("0.01")
+    async with db.get_connection() as connection:
+        # The staging table is reused within the same transaction, and the
+        # last of the duplicate products wins
+        for batch in [[products[0]], [duplicate_product, new_product, products[1]]]:
+            await db.bulk_upsert(
+                db.products,
+                [product.dict() for product in batch],
+                connection=connection,
+            )
+    products_in_db = await db.select(db.products)
+    assert sorted(
+        (Product(**row) for row in products_in_db), key=lambda product: product.id
+    ) == sorted([*products, new_product], key=lambda product: product.id)
+
+
+@pytest.mark.asyncio
+async def test_update_and_read(store):
+    await db.update(db.stores, {"id": store.id, "name": "Updated store"})
+    store_in_db = await db.read(db.stores, store.id, columns=[db.stores.c.name])
+    assert store_in_db.name == "Updated store"
+
+
+@pytest.mark.asyncio
+async def test_delete(products):
+    await db.delete(db.products, products[0].id)
+    assert await db.read(db.products, products[0].id) is None
+
+
+@pytest.mark.asyncio
+async def test_statements_are_cached(products):
+    await db.read(db.products, products[0].id)
+    stats_before = db.get_statement_cache_stats()
+    await db.read(db.products, products[1].id)
+    stats_after = db.get_statement_cache_stats()
+    assert stats_after.hits > stats_before.hits
+    assert stats_after.misses == stats_before.misses
+
+
+def _get_log_messages(caplog) -> list[str]:
+    return [
+        record.getMessage()
+        for record in caplog.records
+        if record.name == "groceryaid.db.utils"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_slow_queries_are_logged(store, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "database_slow_query_threshold", 0)
+    token = tracing.request_id.set("request-1")
+    try:
+        await db.read(db.stores, store.id)
+    finally:
+        tracing.request_id.reset(token)
+    [message] = _get_log_messages(caplog)
+    assert "request-1" in message
+    assert "FROM stores" in message
+    assert not utils._explain_tasks
+
+
+@pytest.mark.asyncio
+async def test_slow_queries_are_explained_in_background(store, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "database_slow_query_threshold", 0)
+    monkeypatch.setattr(settings, "database_slow_query_explain", True)
+    token = tracing.request_id.set("request-1")
+    try:
+        await db.read(db.stores, store.id)
+    finally:
+        tracing.request_id.reset(token)
+    assert len(_get_log_messages(caplog)) == 1
+    await asyncio.gather(*utils._explain_tasks)
+    [_, message] = _get_log_messages(caplog)
+    assert "request-1" in message
+    assert "SEARCH stores" in message
@@ -0,0 +1,86 @@
+"""Test bin packing"""
+
+import collections
+import decimal
+
+from hypothesis import given, strategies as st
+import pytest
+
+from groceryaid.retail import binpacking, BinPackingStrategy, CartProduct
+from groceryaid.retail.faker import CartProductFactory
+
+cartproducts_strategy = st.lists(
+    st.builds(
+        CartProduct,
+        price=st.decimals(min_value=0, max_value=10, places=2),
+        quantity=st.one_of(st.integers(min_value=1, max_value=10), st.none()),
+    ),
+    unique_by=lambda c: c.ean,
+)
+
+limit_strategy = st.decimals(min_value=0, max_value=20)
+
+
+def _pack(cartproducts, limit, strategy):
+    return binpacking.pack(cartproducts, limit, strategy=strategy, time_budget=0.01)
+
+
+@pytest.mark.parametrize("strategy", BinPackingStrategy)
+@given(cartproducts=cartproducts_strategy, limit=limit_strategy)
+def test_pack_replicates_original_quantities(cartproducts, limit, strategy):
+    original_ean_counts = collections.Counter(
+        {cp.ean: cp.quantity or 1 for cp in cartproducts}
+    )
+    binned_ean_counts = collections.Counter()
+    for cart_bin in _pack(cartproducts, limit, strategy):
+        for cartproduct in cart_bin:
+            binned_ean_counts[cartproduct.ean] += cartproduct.quantity or 1
+    assert original_ean_counts == binned_ean_counts
+
+
+@pytest.mark.parametrize("strategy", BinPackingStrategy)
+@given(cartproducts=cartproducts_strategy, limit=limit_strategy)
+def test_pack_keeps_bins_within_limit(cartproducts, limit, strategy):
+    bins = _pack(cartproducts, limit, strategy)
+    has_oversized_products = any(cp.price > limit for cp in cartproducts)
+    for cart_bin in bins[:-1] if has_oversized_products else bins:
+        assert sum(cartproduct.get_total_price() for cartproduct in cart_bin) <= limit
+
+
+@pytest.mark.parametrize("strategy", BinPackingStrategy)
+@given(cartproducts=cartproducts_strategy, limit=limit_strategy)
+def test_pack_respects_lower_bound(cartproducts, limit, strategy):
+    bins = _pack(cartproducts, limit, strategy)
+    assert len(bins) >= binpacking.get_lower_bound(cartproducts, limit)
+
+
+@given(cartproducts=cartproducts_strategy, limit=limit_strategy)
+def test_exact_pack_is_not_worse_than_best_fit(cartproducts, limit):
+    assert len(_pack(cartproducts, limit, BinPackingStrategy.EXACT)) <= len(
+        _pack(cartproducts, limit, BinPackingStrategy.BEST_FIT)
+    )
+
+
+def test_exact_pack_finds_optimal_bins():
+    cartproducts = [
+        CartProductFactory(price=decimal.Decimal(price), quantity=quantity)
+        for (price, quantity) in [("5.00", 1), ("4.00", 2), ("3.00", 1), ("2.00", 2)]
+    ]
+    limit = decimal.Decimal(10)
+    assert binpacking.get_lower_bound(cartproducts, limit) == 2
+    assert (
+        len(binpacking.pack(cartproducts, limit, strategy=BinPackingStrategy.BEST_FIT))
+        == 3
+    )
+    assert (
+        len(binpacking.pack(cartproducts, limit, strategy=BinPackingStrategy.EXACT))
+        == 2
+    )
+
+
+def test_lower_bound_counts_oversized_products():
+    cartproducts = [
+        CartProductFactory(price=decimal.Decimal("6.00"), quantity=2),
+        CartProductFactory(price=decimal.Decimal("12.00"), quantity=1),
+    ]
+    assert binpacking.get_lower_bound(cartproducts, decimal.Decimal(10)) == 3
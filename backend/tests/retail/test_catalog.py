@@ -0,0 +1,113 @@
+"""Test product catalog"""
+
+import pytest
+
+from groceryaid import db
+from groceryaid.retail import catalog
+from groceryaid.retail.faker import ProductFactory
+from groceryaid.settings import settings
+
+
+async def _change_price(product):
+    await db.update(db.products, {"id": product.id, "price": product.price + 1})
+
+
+@pytest.mark.asyncio
+async def test_get_products(products):
+    store_id = products[0].store_id
+    assert await catalog.get_products(store_id, [p.ean for p in products]) == {
+        p.ean: {"ean": p.ean, "name": p.name, "price": p.price} for p in products
+    }
+
+
+@pytest.mark.asyncio
+async def test_get_products_omits_unknown(product, faker):
+    assert await catalog.get_products(product.store_id, [faker.ean()]) == {}
+    assert await catalog.get_products(faker.uuid4(), [product.ean]) == {}
+
+
+@pytest.mark.asyncio
+async def test_get_product_is_cached(product):
+    await catalog.get_product(product.store_id, product.ean)
+    await _change_price(product)
+    cached_product = await catalog.get_product(product.store_id, product.ean)
+    assert cached_product["price"] == product.price
+    stats = catalog.get_cache_stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_bump_catalog_version_invalidates_cache(product, monkeypatch):
+    monkeypatch.setattr(settings, "product_cache_version_ttl", 0)
+    catalog.clear_cache()
+    await catalog.get_product(product.store_id, product.ean)
+    await _change_price(product)
+    await catalog.bump_catalog_version(product.store_id)
+    fresh_product = await catalog.get_product(product.store_id, product.ean)
+    assert fresh_product["price"] == product.price + 1
+
+
+@pytest.mark.asyncio
+async def test_cache_evicts_least_recently_used(products, monkeypatch):
+    monkeypatch.setattr(settings, "product_cache_max_size", 2)
+    catalog.clear_cache()
+    store_id = products[0].store_id
+    for product in products[:3]:
+        await catalog.get_product(store_id, product.ean)
+    await catalog.get_product(store_id, products[2].ean)
+    await catalog.get_product(store_id, products[0].ean)
+    stats = catalog.get_cache_stats()
+    assert (stats.hits, stats.misses, stats.evictions, stats.size) == (1, 4, 2, 2)
+
+
+@pytest.mark.asyncio
+async def test_list_products(products):
+    store_id = products[0].store_id
+    eans = sorted(product.ean for product in products)
+    first_page = await catalog.list_products(store_id, limit=4)
+    second_page = await catalog.list_products(
+        store_id, limit=len(products), after=first_page[-1]["ean"]
+    )
+    assert [product["ean"] for product in first_page + second_page] == eans
+
+
+@pytest.mark.asyncio
+async def test_stream_products(products, monkeypatch):
+    monkeypatch.setattr(settings, "database_stream_batch_size", 3)
+    store_id = products[0].store_id
+    assert [
+        product["ean"] async for product in catalog.stream_products(store_id)
+    ] == sorted(product.ean for product in products)
+
+
+@pytest.fixture
+def search_products():
+    async def _search_products(store, names):
+        products = [ProductFactory(store_id=store.id, name=name) for name in names]
+        await db.create(db.products, [product.dict() for product in products])
+        return {product.ean: product.name for product in products}
+
+    return _search_products
+
+
+@pytest.mark.asyncio
+async def test_search_products(store, search_products):
+    await search_products(store, ["Maito 1l", "Kevytmaito", "Maitorahka", "Juusto"])
+    results = await catalog.search_products(store.id, "MAIT", limit=10)
+    assert {product["name"] for product in results} == {"Maito 1l", "Maitorahka"}
+    results = await catalog.search_products(store.id, "maito 1", limit=10)
+    assert [product["name"] for product in results] == ["Maito 1l"]
+    assert await catalog.search_products(store.id, "-", limit=10) == []
+
+
+@pytest.mark.asyncio
+async def test_search_products_pagination(store, search_products):
+    names = await search_products(store, [f"Maito {n}" for n in range(5)])
+    results = []
+    after = None
+    while page := await catalog.search_products(
+        store.id, "maito", limit=2, after=after
+    ):
+        results.extend(page)
+        after = page[-1]["score"], page[-1]["ean"]
+    assert {product["ean"]: product["name"] for product in results} == names
@@ -5,6 +5,7 @@ Test EAN utilities
 import decimal
 
 from hypothesis import given, strategies as st
+import pytest
 
 from groceryaid.retail import Ean
 
@@ -49,3 +50,33 @@ def test_fixed_price_ean_for_query(ean):
 @given(fixed_price_ean_strategy)
 def test_fixed_price_ean_get_price(ean):
     assert ean.get_price() is None
+
+
+def _calculate_check_digit(prefix):
+    checksum = sum(int(c) for c in prefix[0::2]) + 3 * sum(int(c) for c in prefix[1::2])
+    return str(-checksum % 10)
+
+
+@given(st.from_regex(Ean.prefix_pattern))
+def test_calculate_check_digit(prefix):
+    assert Ean.calculate_check_digit(prefix) == _calculate_check_digit(prefix)
+
+
+@pytest.mark.parametrize(
+    "value", ["", "123456789012", "12345678901234", "123456789012x", "١٢٣٤٥٦٧٨٩٠١٢٣"]
+)
+def test_validate_invalid_format(value):
+    with pytest.raises(ValueError):
+        Ean.validate(value)
+
+
+@given(fixed_price_ean_strategy)
+def test_validate_wrong_check_digit(ean):
+    invalid_ean = ean[:12] + str((int(ean[12]) + 1) % 10)
+    with pytest.raises(ValueError):
+        Ean.validate(invalid_ean)
+
+
+@given(st.lists(st.one_of(variable_price_ean_strategy, fixed_price_ean_strategy)))
+def test_normalize_many(eans):
+    assert Ean.normalize_many(eans) == [ean.get_ean_for_query() for ean in eans]
@@ -0,0 +1,92 @@
+"""Synthetic data generator tests"""
+
+import itertools
+
+import pytest
+
+from groceryaid.retail import Ean, StoreVisit
+import groceryaid.retail.faker as retail_faker
+from groceryaid.settings import settings
+
+
+@pytest.fixture(autouse=True)
+def faker_settings(monkeypatch):
+    monkeypatch.setattr(settings, "faker_store_count", 3)
+    monkeypatch.setattr(settings, "faker_products_per_store", 1000)
+    monkeypatch.setattr(settings, "faker_products_batch_size", 300)
+    monkeypatch.setattr(settings, "faker_variable_price_fraction", 0.2)
+
+
+def _generate_products(store_external_id):
+    store = retail_faker.generate_store(store_external_id)
+    return list(itertools.chain.from_iterable(retail_faker.generate_products(store)))
+
+
+def test_get_store_external_ids():
+    assert retail_faker.get_store_external_ids() == ["0", "1", "2"]
+
+
+def test_generate_products_in_batches():
+    store = retail_faker.generate_store("0")
+    batches = list(retail_faker.generate_products(store))
+    assert [len(batch) for batch in batches] == [300, 300, 300, 100]
+    assert all(product.store_id == store.id for product in batches[0])
+
+
+def test_generated_products_are_valid():
+    products = _generate_products("0")
+    assert len({product.ean for product in products}) == len(products)
+    for product in products:
+        assert Ean.validate(product.ean) == product.ean
+        assert product.price > 0
+    n_variable_price = sum(product.ean.is_variable_price() for product in products)
+    assert 150 <= n_variable_price <= 250
+    assert all(
+        product.ean.get_ean_for_query() == product.ean
+        for product in products
+        if product.ean.is_variable_price()
+    )
+
+
+def test_generated_products_are_deterministic(monkeypatch):
+    products = _generate_products("0")
+    assert _generate_products("0") == products
+    assert [product.ean for product in _generate_products("1")] == [
+        product.ean for product in products
+    ]
+    monkeypatch.setattr(settings, "faker_seed", 1)
+    assert _generate_products("0") != products
+
+
+@pytest.mark.asyncio
+async def test_store_fetcher_fetches_generated_products():
+    fetcher = retail_faker.StoreFetcher("1")
+    products = [
+        product
+        async for batch in fetcher.get_products_in_batches()
+        for product in batch
+    ]
+    assert products == _generate_products("1")
+    assert fetcher.products == products
+
+
+def test_generate_store_visits():
+    catalogs = {}
+    for store_external_id in retail_faker.get_store_external_ids():
+        products = _generate_products(store_external_id)
+        catalogs[products[0].store_id] = {product.ean: product for product in products}
+    storevisits = list(retail_faker.generate_store_visits(50, seed=1))
+    assert len(storevisits) == 50
+    assert list(retail_faker.generate_store_visits(50, seed=1)) == storevisits
+    for storevisit in storevisits:
+        assert StoreVisit(**storevisit.dict()) == storevisit
+        catalog = catalogs[storevisit.store_id]
+        assert storevisit.cart
+        for cartproduct in storevisit.cart:
+            product = catalog[cartproduct.ean.get_ean_for_query()]
+            assert cartproduct.name == product.name
+            if cartproduct.ean.is_variable_price():
+                assert cartproduct.quantity is None
+                assert cartproduct.price == cartproduct.ean.get_price()
+            else:
+                assert cartproduct.price == product.price
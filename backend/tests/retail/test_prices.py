@@ -0,0 +1,50 @@
+"""Test price history"""
+
+import datetime
+import decimal
+
+import pytest
+
+from groceryaid.retail import prices
+
+
+@pytest.mark.asyncio
+async def test_read_price_history(product):
+    original_price = product.price
+    await prices.record_prices([product])
+    product.price += decimal.Decimal("0.5")
+    await prices.record_prices([product])
+    history = await prices.read_price_history(product.store_id, product.ean)
+    assert [change.price for change in history] == [original_price, product.price]
+    assert history[0].valid_from < history[1].valid_from
+
+
+@pytest.mark.asyncio
+async def test_record_prices_duplicate_product(product):
+    duplicate_product = product.copy()
+    product.price += decimal.Decimal("0.5")
+    await prices.record_prices([duplicate_product, product])
+    history = await prices.read_price_history(product.store_id, product.ean)
+    assert [change.price for change in history] == [product.price]
+
+
+@pytest.mark.asyncio
+async def test_read_price_history_since(product):
+    original_price = product.price
+    await prices.record_prices([product])
+    since = datetime.datetime.now(datetime.timezone.utc)
+    product.price += decimal.Decimal("0.5")
+    await prices.record_prices([product])
+    history = await prices.read_price_history(
+        product.store_id, product.ean, since=since
+    )
+    assert [change.price for change in history] == [original_price, product.price]
+    history = await prices.read_price_history(
+        product.store_id, product.ean, since=history[1].valid_from
+    )
+    assert [change.price for change in history] == [product.price]
+
+
+@pytest.mark.asyncio
+async def test_read_price_history_unknown_product(store, faker):
+    assert await prices.read_price_history(store.id, faker.ean()) == []
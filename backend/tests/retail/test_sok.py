@@ -1,6 +1,8 @@
 """Test S-Group (SOK) services"""
 
+import asyncio
 import contextlib
+import itertools
 import unittest.mock
 
 import pytest
@@ -8,6 +10,7 @@ import pytest
 from groceryaid.retail import RetailChain
 from groceryaid.retail.faker import StoreFactory, ProductFactory
 from groceryaid.retail.sok import StoreFetcher
+from groceryaid.settings import settings
 
 
 @pytest.mark.asyncio
@@ -50,3 +53,168 @@ async def test_fetch_and_store_products(monkeypatch):
             products[:3],
             products[3:],
         ]
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_store_products_concurrently(monkeypatch):
+
+    store = StoreFactory(chain=RetailChain.SOK)
+    products = ProductFactory.build_batch(7, store_id=store.id)
+
+    fake_connection = _create_fake_connection(store, products)
+
+    monkeypatch.setattr(settings, "sok_products_batch_size", 2)
+
+    async with StoreFetcher(
+        store.external_id, session=fake_connection, max_concurrent_pages=3
+    ) as fetcher:
+        assert [product async for product in fetcher.get_products_in_batches()] == [
+            products[:2],
+            products[2:4],
+            products[4:6],
+            products[6:],
+        ]
+    assert [
+        call.args[1]["from"] for call in fake_connection.execute.call_args_list
+    ] == [0, 2, 4, 6, 7, 9, 11]
+
+
+def _create_fake_connection(store, products):
+    async def _execute(query, variables):
+        from_, limit = variables["from"], variables["limit"]
+        return {
+            "store": {
+                "id": store.external_id,
+                "name": store.name,
+                "products": {
+                    "items": [
+                        {
+                            "ean": product.ean,
+                            "name": product.name,
+                            "price": product.price,
+                        }
+                        for product in products[from_ : from_ + limit]
+                    ],
+                },
+            }
+        }
+
+    return unittest.mock.Mock(execute=unittest.mock.AsyncMock(side_effect=_execute))
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_store_products_read_ahead(monkeypatch):
+    store = StoreFactory(chain=RetailChain.SOK)
+    products = ProductFactory.build_batch(7, store_id=store.id)
+    fake_connection = _create_fake_connection(store, products)
+
+    monkeypatch.setattr(settings, "sok_products_batch_size", 2)
+
+    async with StoreFetcher(
+        store.external_id, session=fake_connection, read_ahead=1
+    ) as fetcher:
+        batches = fetcher.get_products_in_batches()
+        assert await batches.__anext__() == products[:2]
+        for _ in range(10):
+            await asyncio.sleep(0)
+        # The first page was fetched when entering the fetcher, the second one
+        # is waiting in the queue, and the third one waits for space in the
+        # queue
+        assert fake_connection.execute.await_count == 3
+        assert [product async for product in batches] == [
+            products[2:4],
+            products[4:6],
+            products[6:],
+        ]
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_store_products_unordered(monkeypatch):
+    store = StoreFactory(chain=RetailChain.SOK)
+    products = ProductFactory.build_batch(7, store_id=store.id)
+    fake_connection = _create_fake_connection(store, products)
+
+    monkeypatch.setattr(settings, "sok_products_batch_size", 2)
+
+    async with StoreFetcher(
+        store.external_id,
+        session=fake_connection,
+        max_concurrent_pages=2,
+        read_ahead=2,
+        preserve_order=False,
+    ) as fetcher:
+        batches = [product async for product in fetcher.get_products_in_batches()]
+        assert sorted(
+            itertools.chain.from_iterable(batches), key=lambda product: product.ean
+        ) == sorted(products, key=lambda product: product.ean)
+
+
+def _create_blocking_fake_connection(
+    store, products, *, blocking_offsets, failing_offsets=()
+):
+    fake_connection = _create_fake_connection(store, products)
+    execute = fake_connection.execute.side_effect
+    fake_connection.pending = 0
+
+    async def _execute(query, variables):
+        fake_connection.pending += 1
+        try:
+            if variables["from"] in failing_offsets:
+                raise RuntimeError("Failed")
+            if variables["from"] in blocking_offsets:
+                await asyncio.Event().wait()
+            return await execute(query, variables)
+        finally:
+            fake_connection.pending -= 1
+
+    fake_connection.execute.side_effect = _execute
+    return fake_connection
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("read_ahead", [0, 1])
+async def test_fetch_and_store_products_closed_early(monkeypatch, read_ahead):
+    store = StoreFactory(chain=RetailChain.SOK)
+    products = ProductFactory.build_batch(7, store_id=store.id)
+    fake_connection = _create_blocking_fake_connection(
+        store, products, blocking_offsets={4, 6}
+    )
+
+    monkeypatch.setattr(settings, "sok_products_batch_size", 2)
+
+    async with StoreFetcher(
+        store.external_id,
+        session=fake_connection,
+        max_concurrent_pages=3,
+        read_ahead=read_ahead,
+        preserve_order=False,
+    ) as fetcher:
+        batches = fetcher.get_products_in_batches()
+        assert await batches.__anext__() == products[:2]
+        assert await batches.__anext__() == products[2:4]
+        assert fake_connection.pending == 2
+        await batches.aclose()
+        assert fake_connection.pending == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("preserve_order", [False, True])
+async def test_fetch_and_store_products_failed_page(monkeypatch, preserve_order):
+    store = StoreFactory(chain=RetailChain.SOK)
+    products = ProductFactory.build_batch(7, store_id=store.id)
+    fake_connection = _create_blocking_fake_connection(
+        store, products, blocking_offsets={4}, failing_offsets={2}
+    )
+
+    monkeypatch.setattr(settings, "sok_products_batch_size", 2)
+
+    async with StoreFetcher(
+        store.external_id,
+        session=fake_connection,
+        max_concurrent_pages=2,
+        preserve_order=preserve_order,
+    ) as fetcher:
+        with pytest.raises(RuntimeError):
+            async for _ in fetcher.get_products_in_batches():
+                pass
+        assert fake_connection.pending == 0
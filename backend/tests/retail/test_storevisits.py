@@ -1,12 +1,14 @@
 """Test store visit services"""
 
 import collections
+import unittest.mock
 
 from hypothesis import given, strategies as st
 import pytest
 
+from groceryaid import db
 from groceryaid.retail import storevisits, CartProduct
-from groceryaid.retail.faker import CartProductFactory
+from groceryaid.retail.faker import CartProductFactory, StoreVisitFactory
 
 
 @pytest.mark.asyncio
@@ -14,11 +16,26 @@ async def test_read_store_visit(storevisit):
     assert await storevisits.read_store_visit(storevisit.id) == storevisit
 
 
+@pytest.mark.asyncio
+async def test_read_store_visit_with_empty_cart(store):
+    storevisit = StoreVisitFactory(store_id=store.id, cart=[])
+    await storevisits.create_store_visit(storevisit)
+    assert await storevisits.read_store_visit(storevisit.id) == storevisit
+
+
 @pytest.mark.asyncio
 async def test_read_store_visit_nonexistent(faker):
     assert await storevisits.read_store_visit(faker.uuid4()) is None
 
 
+@pytest.mark.asyncio
+async def test_read_store_visit_readonly_uses_replica(replica, store):
+    storevisit = StoreVisitFactory(store_id=store.id, cart=[])
+    await storevisits.create_store_visit(storevisit)
+    assert await storevisits.read_store_visit(storevisit.id, readonly=True) is None
+    assert await storevisits.read_store_visit(storevisit.id) == storevisit
+
+
 @pytest.mark.asyncio
 async def test_update_store_visit(storevisit, products, variable_price_product):
     storevisit.cart[0].ean = products[-1].ean
@@ -43,6 +60,50 @@ async def test_update_store_visit(storevisit, products, variable_price_product):
     assert await storevisits.read_store_visit(storevisit.id) == storevisit
 
 
+@pytest.fixture
+def upsert(monkeypatch):
+    upsert = unittest.mock.AsyncMock(wraps=db.upsert)
+    monkeypatch.setattr(db, "upsert", upsert)
+    return upsert
+
+
+@pytest.mark.asyncio
+async def test_update_store_visit_with_stale_version(storevisit, upsert):
+    stale_storevisit = storevisit.copy(deep=True)
+    await storevisits.update_store_visit(storevisit)
+    assert storevisit.version == stale_storevisit.version + 1
+    with pytest.raises(storevisits.StoreVisitConflict):
+        await storevisits.update_store_visit(stale_storevisit)
+    upsert.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("with_previous", [False, True])
+async def test_update_store_visit_writes_only_changed_cart_products(
+    storevisit, products, upsert, with_previous
+):
+    previous = storevisit.copy(deep=True)
+    storevisit.cart[1].quantity += 1
+    storevisit.cart.append(
+        CartProductFactory(
+            ean=products[-1].ean, name=products[-1].name, price=products[-1].price
+        )
+    )
+    await storevisits.update_store_visit(
+        storevisit, previous=previous if with_previous else None
+    )
+    upsert.assert_awaited_once()
+    assert [row["rank"] for row in upsert.await_args.args[1]] == [1, 5]
+    assert await storevisits.read_store_visit(storevisit.id) == storevisit
+
+
+@pytest.mark.asyncio
+async def test_update_store_visit_with_unchanged_cart(storevisit, upsert):
+    await storevisits.update_store_visit(storevisit)
+    upsert.assert_not_awaited()
+    assert await storevisits.read_store_visit(storevisit.id) == storevisit
+
+
 cartproducts_strategy = st.lists(
     st.builds(
         CartProduct,
@@ -4,30 +4,205 @@ import itertools
 import unittest.mock
 
 import pytest
+import sqlalchemy
 
 from groceryaid import db
-from groceryaid.retail import Store, Product, RetailChain
+from groceryaid.retail import prices, Store, Product, RetailChain
 import groceryaid.retail.faker as retail_faker
 from groceryaid.retail.tasks import fetch_and_save_stores_and_products
+from groceryaid.settings import settings
 
 
-@pytest.mark.asyncio
-async def test_fetch_store_and_products(monkeypatch):
-    store_external_ids = retail_faker.get_store_external_ids()
-    fetchers = {eid: retail_faker.StoreFetcher(eid) for eid in store_external_ids}
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(settings, "fetch_retry_delay", 0)
 
-    get_store_fetcher = unittest.mock.Mock(side_effect=lambda eid: fetchers[eid])
 
+@pytest.fixture
+def fetchers(monkeypatch):
+    store_external_ids = retail_faker.get_store_external_ids()
+    fetchers = {eid: retail_faker.StoreFetcher(eid) for eid in store_external_ids}
+    get_store_fetcher = unittest.mock.Mock(
+        side_effect=lambda eid, **kwargs: fetchers[eid]
+    )
     monkeypatch.setattr(retail_faker, "StoreFetcher", get_store_fetcher)
+    return fetchers
 
-    await fetch_and_save_stores_and_products(RetailChain.FAKER)
+
+@pytest.mark.asyncio
+async def test_fetch_store_and_products(fetchers):
+    reports = await fetch_and_save_stores_and_products(RetailChain.FAKER)
+    assert all(report.is_success() for report in reports)
 
     stores_in_db = await db.select(db.stores)
-    assert [Store(**row) for row in stores_in_db] == [
-        fetcher.store for fetcher in fetchers.values()
-    ]
+    assert sorted(
+        (Store(**row) for row in stores_in_db), key=lambda store: store.id
+    ) == sorted(
+        (fetcher.store for fetcher in fetchers.values()), key=lambda store: store.id
+    )
 
     products_in_db = await db.select(db.products)
-    assert [Product(**row) for row in products_in_db] == list(
-        itertools.chain.from_iterable(fetcher.products for fetcher in fetchers.values())
+    assert sorted(
+        (Product(**row) for row in products_in_db), key=lambda product: product.id
+    ) == sorted(
+        itertools.chain.from_iterable(
+            fetcher.products for fetcher in fetchers.values()
+        ),
+        key=lambda product: product.id,
+    )
+
+
+@pytest.mark.asyncio
+async def test_fetch_store_and_products_retries_failed_store(fetchers, monkeypatch):
+    failing_external_id, *_ = fetchers
+    failing_fetcher = fetchers[failing_external_id]
+    get_store = failing_fetcher.get_store
+    monkeypatch.setattr(
+        failing_fetcher,
+        "get_store",
+        unittest.mock.Mock(side_effect=[RuntimeError("Failed"), get_store()]),
+    )
+
+    reports = await fetch_and_save_stores_and_products(RetailChain.FAKER)
+    assert {report.store_external_id: report.attempts for report in reports} == {
+        eid: 2 if eid == failing_external_id else 1 for eid in fetchers
+    }
+    assert all(report.is_success() for report in reports)
+    assert len(await db.select(db.stores)) == len(fetchers)
+
+
+@pytest.mark.asyncio
+async def test_fetch_store_and_products_isolates_failed_store(fetchers, monkeypatch):
+    monkeypatch.setattr(settings, "fetch_retries", 1)
+    failing_external_id, *_ = fetchers
+    monkeypatch.setattr(
+        fetchers[failing_external_id],
+        "get_store",
+        unittest.mock.Mock(side_effect=RuntimeError("Failed")),
+    )
+
+    # The in-memory test database shares a single connection, so the stores are
+    # fetched sequentially to keep the failed transaction from rolling back the
+    # others
+    reports = await fetch_and_save_stores_and_products(
+        RetailChain.FAKER, max_concurrent_stores=1
+    )
+    failed_reports = [report for report in reports if not report.is_success()]
+    assert [(r.store_external_id, r.attempts) for r in failed_reports] == [
+        (failing_external_id, 2)
+    ]
+
+    stores_in_db = await db.select(db.stores, columns=[db.stores.c.external_id])
+    assert sorted(row.external_id for row in stores_in_db) == sorted(
+        eid for eid in fetchers if eid != failing_external_id
+    )
+
+
+@pytest.mark.asyncio
+async def test_fetch_store_and_products_writes_only_changes(fetchers):
+    await fetch_and_save_stores_and_products(RetailChain.FAKER)
+
+    changed_external_id, *_ = fetchers
+    changed_fetcher = fetchers[changed_external_id]
+    changed_fetcher.products[0].price += 1
+    changed_fetcher.products[1].name = "Changed product"
+    del changed_fetcher.products[2]
+    changed_fetcher.products.append(
+        retail_faker.ProductFactory(store_id=changed_fetcher.store.id)
+    )
+
+    # Fetched sequentially to avoid concurrent transactions in the single
+    # connection of the test database
+    reports = await fetch_and_save_stores_and_products(
+        RetailChain.FAKER, max_concurrent_stores=1
+    )
+    counts = {
+        report.store_external_id: (
+            report.inserted,
+            report.updated,
+            report.unchanged,
+            report.vanished,
+        )
+        for report in reports
+    }
+    assert counts == {
+        eid: (
+            (1, 2, len(fetcher.products) - 3, 1)
+            if eid == changed_external_id
+            else (0, 0, len(fetcher.products), 0)
+        )
+        for (eid, fetcher) in fetchers.items()
+    }
+
+    # The stores share EAN codes, so only the changed store is compared
+    products_in_db = await db.execute(
+        sqlalchemy.select([db.products.c.ean, db.products.c.price]).where(
+            db.products.c.store_id == changed_fetcher.store.id
+        )
+    )
+    assert {row.ean: row.price for row in products_in_db}.items() >= {
+        product.ean: product.price for product in changed_fetcher.products
+    }.items()
+
+    stores_in_db = await db.select(
+        db.stores, columns=[db.stores.c.id, db.stores.c.catalog_version]
+    )
+    assert {row.id: row.catalog_version for row in stores_in_db} == {
+        fetcher.store.id: 2 if eid == changed_external_id else 1
+        for (eid, fetcher) in fetchers.items()
+    }
+
+    # Initial prices of all products, and the changed and the new prices
+    n_prices = (
+        await db.execute(
+            sqlalchemy.select([sqlalchemy.func.count()]).select_from(db.productprices)
+        )
+    ).scalar()
+    assert n_prices == sum(len(fetcher.products) for fetcher in fetchers.values()) + 2
+
+
+@pytest.mark.asyncio
+async def test_fetch_store_and_products_duplicate_products(fetchers, monkeypatch):
+    monkeypatch.setattr(settings, "faker_products_batch_size", 5)
+    external_id, *_ = fetchers
+    fetcher = fetchers[external_id]
+    n_products = len(fetcher.products)
+    # Repeated in a later page
+    fetcher.products.append(fetcher.products[0])
+
+    # Fetched sequentially to avoid concurrent transactions in the single
+    # connection of the test database
+    reports = await fetch_and_save_stores_and_products(
+        RetailChain.FAKER, max_concurrent_stores=1
+    )
+    [report] = [r for r in reports if r.store_external_id == external_id]
+    assert report.is_success()
+    assert report.attempts == 1
+    assert report.inserted == n_products
+
+    n_prices = (
+        await db.execute(
+            sqlalchemy.select([sqlalchemy.func.count()])
+            .select_from(db.productprices.join(db.products))
+            .where(db.products.c.store_id == fetcher.store.id)
+        )
+    ).scalar()
+    assert n_prices == n_products
+
+
+@pytest.mark.asyncio
+async def test_fetch_store_and_products_duplicate_products_in_page(fetchers):
+    external_id, *_ = fetchers
+    fetcher = fetchers[external_id]
+    n_products = len(fetcher.products)
+    fetcher.products.insert(1, fetcher.products[0])
+
+    reports = await fetch_and_save_stores_and_products(
+        RetailChain.FAKER, max_concurrent_stores=1
     )
+    [report] = [r for r in reports if r.store_external_id == external_id]
+    assert report.is_success()
+    assert report.attempts == 1
+    assert report.inserted == n_products
+    history = await prices.read_price_history(fetcher.store.id, fetcher.products[0].ean)
+    assert [change.price for change in history] == [fetcher.products[0].price]